@@ -4,22 +4,38 @@ import logging
 import sys
 import json
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
-from telegram.error import Conflict
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ChatMemberHandler, TypeHandler, ApplicationHandlerStop, BaseUpdateProcessor, filters, ContextTypes
+from telegram.error import Conflict, RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
 from gtts import gTTS
 import io
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta
 import re
 import math
 import requests
-from urllib.parse import quote
+from requests.adapters import HTTPAdapter
+import httpx
+from urllib.parse import quote, urlsplit
 from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled
 import random
 import string
 import platform
 import tempfile
 import hashlib
+import http.cookiejar
+import sqlite3
+import threading
+import atexit
+import heapq
+import bisect
+import time
+import multiprocessing
+import subprocess
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 # Fix for httpcore asyncio detection on Windows (only for Windows)
 if sys.platform == 'win32':
@@ -55,6 +71,12 @@ except Exception as e:
     VideoFileClip = None
     logger.warning(f"MoviePy import error: {e}")
 
+# proglog ships with MoviePy; it lets jobs follow (and abort) MoviePy's ffmpeg runs
+try:
+    from proglog import ProgressBarLogger
+except (ImportError, ModuleNotFoundError):
+    ProgressBarLogger = None
+
 # Try to import PIL for image processing
 try:
     from PIL import Image, ImageFilter, ImageEnhance, ImageDraw, ImageFont
@@ -111,6 +133,25 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "8443653460:AAH2e35lpAHdyaXKFwq-6--zxEEzTr176
 # OCR.space API key: set environment variable OCR_SPACE_API_KEY to override the free demo key
 OCR_SPACE_API_KEY = os.getenv("OCR_SPACE_API_KEY", "helloworld").strip() or "helloworld"
 
+# Webhook mode - opt-in with BOT_MODE=webhook; polling stays the default. Needs an
+# always-on web service: a host that idles the process (e.g. Render's free web plan)
+# also stops the alarm scheduler, price alert poller and other background tasks.
+# The public URL comes from WEBHOOK_URL or the platform (Render / Railway)
+WEBHOOK_URL = (
+    os.getenv("WEBHOOK_URL")
+    or os.getenv("RENDER_EXTERNAL_URL")
+    or (f"https://{os.getenv('RAILWAY_PUBLIC_DOMAIN')}" if os.getenv("RAILWAY_PUBLIC_DOMAIN") else "")
+).rstrip("/")
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()  # polling or webhook
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+# Telegram echoes this in X-Telegram-Bot-Api-Secret-Token; requests without it are rejected.
+# Telegram only accepts A-Z a-z 0-9 _ - (1-256 chars), so any other value is hashed
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or BOT_TOKEN
+if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET) or WEBHOOK_SECRET == BOT_TOKEN:
+    WEBHOOK_SECRET = hashlib.sha256(WEBHOOK_SECRET.encode()).hexdigest()
+
 # Bot name - Change this to customize bot name in messages
 BOT_NAME = os.getenv("BOT_NAME", "All Smart Tool Bot")  # Default bot name
 
@@ -142,9 +183,450 @@ blocked_users = set()
 ALARMS_FILE = "alarms.json"
 alarms = {}  # {user_id: [{alarm_id, time, message, created_at}]}
 
+# Crypto price alert storage
+PRICE_ALERTS_FILE = "price_alerts.json"
+price_alerts = {}  # {user_id: [{alert_id, coin, coin_id, direction, target, currency, created_at}]}
+
+# Referral system storage
+REFERRAL_DATA_FILE = "referrals.json"
+referral_data = {}
+referral_code_index = {}  # {CODE: user_id_str}, kept in sync with referral_data
+
+# Storage backend - "json" (one file per store, default) or "sqlite" (one row per record)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").strip().lower()
+SQLITE_DB_FILE = os.getenv("SQLITE_DB_FILE", "bot_data.db")
+storage = None  # SQLiteStorage instance when STORAGE_BACKEND == "sqlite"
+
+class SQLiteStorage:
+    """Key/value storage backed by SQLite in WAL mode.
+
+    Each store (users, referrals, alarms, price_alerts, blocked_users) is a table of
+    (key, JSON value) rows, so updating one user touches one row instead of
+    rewriting every record.
+    """
+
+    STORES = ('users', 'referrals', 'alarms', 'price_alerts', 'blocked_users')
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            for store in self.STORES:
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {store} (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def load(self, store):
+        """Return all rows of a store as a dict of key -> decoded value."""
+        with self.lock:
+            rows = self.conn.execute(f"SELECT key, value FROM {store}").fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def put(self, store, key, value):
+        """Insert or update a single record."""
+        self.put_many(store, [(key, value)])
+
+    def put_many(self, store, items):
+        """Insert or update several records in one transaction."""
+        rows = [(str(key), json.dumps(value, ensure_ascii=False)) for key, value in items]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                f"INSERT INTO {store} (key, value) VALUES (?, ?) "
+                f"ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                rows
+            )
+
+    def delete(self, store, key):
+        """Delete a single record if it exists."""
+        with self.lock, self.conn:
+            self.conn.execute(f"DELETE FROM {store} WHERE key = ?", (str(key),))
+
+    def replace_all(self, store, items):
+        """Replace the whole content of a store in one transaction."""
+        rows = [(str(key), json.dumps(value, ensure_ascii=False)) for key, value in items]
+        with self.lock, self.conn:
+            self.conn.execute(f"DELETE FROM {store}")
+            self.conn.executemany(f"INSERT INTO {store} (key, value) VALUES (?, ?)", rows)
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value)
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def migrate_json_to_sqlite(target):
+    """One-shot import of the legacy JSON files into a SQLite storage.
+
+    Runs only once per database (tracked in the meta table); the JSON files are
+    left untouched so switching back to the JSON backend stays possible.
+    """
+    if target.get_meta('json_migrated_at'):
+        return False
+    sources = [
+        ('users', USER_DATA_FILE),
+        ('referrals', REFERRAL_DATA_FILE),
+        ('alarms', ALARMS_FILE),
+        ('price_alerts', PRICE_ALERTS_FILE),
+        ('blocked_users', BLOCKED_USERS_FILE),
+    ]
+    for store, path in sources:
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if store == 'blocked_users':
+                items = [(str(uid), True) for uid in data]
+            else:
+                items = list(data.items())
+            target.put_many(store, items)
+            logger.info(f"Migrated {len(items)} records from {path} to {target.path}")
+        except Exception as e:
+            logger.error(f"Error migrating {path} to SQLite: {e}")
+    target.set_meta('json_migrated_at', datetime.now().isoformat())
+    return True
+
+def init_storage():
+    """Open the configured storage backend (and migrate JSON files on first SQLite run)."""
+    global storage
+    if STORAGE_BACKEND != 'sqlite':
+        storage = None
+        return
+    try:
+        storage = SQLiteStorage(SQLITE_DB_FILE)
+        migrate_json_to_sqlite(storage)
+        logger.info(f"Using SQLite storage: {SQLITE_DB_FILE}")
+    except Exception as e:
+        logger.error(f"Could not open SQLite storage, falling back to JSON files: {e}")
+        storage = None
+
+# Write-behind persistence - mutations only mark a store dirty and a background
+# thread coalesces them into one write per store
+PERSIST_FLUSH_INTERVAL = float(os.getenv("PERSIST_FLUSH_INTERVAL", "5"))  # seconds between flushes
+PERSIST_FLUSH_THRESHOLD = int(os.getenv("PERSIST_FLUSH_THRESHOLD", "200"))  # pending changes forcing an early flush
+
+def atomic_write_json(path, data):
+    """Write JSON to a temp file next to path, fsync it and rename it over path."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+class PersistenceManager:
+    """Tracks dirty stores and flushes them off the event loop.
+
+    Dirty stores are written every ``interval`` seconds, or earlier once
+    ``threshold`` changes are pending. The dirty keys are handed to the store
+    writer so row-based backends only rewrite what changed; ``None`` means
+    the whole store.
+    """
+
+    def __init__(self, interval, threshold):
+        self.interval = interval
+        self.threshold = threshold
+        self.writers = {}
+        self.dirty = {}  # store name -> set of keys, or None for the whole store
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.stopping = False
+        self.flush_count = 0
+        self.change_count = 0
+
+    def register(self, name, writer):
+        """Register ``writer(keys)`` as the flush callback of a store."""
+        self.writers[name] = writer
+
+    def mark_dirty(self, name, key=None):
+        """Record that a store (or a single key of it) needs to be written."""
+        with self.lock:
+            if key is None:
+                self.dirty[name] = None
+            else:
+                keys = self.dirty.setdefault(name, set())
+                if keys is not None:
+                    keys.add(str(key))
+            self.pending += 1
+            self.change_count += 1
+            if self.pending >= self.threshold:
+                self.wakeup.set()
+
+    def flush(self):
+        """Write every dirty store now; stores that fail stay dirty for the next round.
+
+        Returns False if any store could not be written.
+        """
+        ok = True
+        with self.flush_lock:
+            with self.lock:
+                dirty, self.dirty, self.pending = self.dirty, {}, 0
+            for name, keys in dirty.items():
+                writer = self.writers.get(name)
+                if writer is None:
+                    continue
+                try:
+                    writer(keys)
+                    self.flush_count += 1
+                except Exception as e:
+                    ok = False
+                    logger.error(f"Error saving {name}: {e}")
+                    with self.lock:
+                        if keys is None:
+                            self.dirty[name] = None
+                        else:
+                            current = self.dirty.setdefault(name, set())
+                            if current is not None:
+                                current.update(keys)
+        return ok
+
+    def _run(self):
+        while not self.stopping:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def start(self):
+        """Start the background flush thread (no-op if already running)."""
+        if self.thread is None:
+            self.stopping = False
+            self.thread = threading.Thread(target=self._run, name="persistence-flusher", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stop the flush thread and write everything still pending."""
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=30)
+            self.thread = None
+        self.flush()
+
+persistence = PersistenceManager(PERSIST_FLUSH_INTERVAL, PERSIST_FLUSH_THRESHOLD)
+atexit.register(persistence.stop)
+
+def make_store_writer(store, path, get_data, encode=None):
+    """Build the flush callback of a store for the active backend.
+
+    ``get_data`` returns the store as a dict with string keys; ``encode``
+    converts it to the JSON file layout when that differs from the dict.
+    """
+    def write(keys):
+        # Stores are mutated on the event loop while this runs in the flush
+        # thread, so retry if a dict changes size under the encoder.
+        for attempt in range(3):
+            try:
+                data = get_data()
+                if storage is None:
+                    atomic_write_json(path, encode(data) if encode else data)
+                elif keys is None:
+                    storage.replace_all(store, data.items())
+                else:
+                    storage.put_many(store, [(key, data[key]) for key in keys if key in data])
+                    for key in keys:
+                        if key not in data:
+                            storage.delete(store, key)
+                return
+            except RuntimeError:
+                if attempt == 2:
+                    raise
+    return write
+
+def register_persistent_stores():
+    """Hook the in-memory stores up to the persistence manager."""
+    persistence.register('users', make_store_writer('users', USER_DATA_FILE, lambda: dict(user_data)))
+    persistence.register('referrals', make_store_writer('referrals', REFERRAL_DATA_FILE, lambda: dict(referral_data)))
+    persistence.register('alarms', make_store_writer(
+        'alarms', ALARMS_FILE, lambda: {str(k): v for k, v in dict(alarms).items()}
+    ))
+    persistence.register('price_alerts', make_store_writer(
+        'price_alerts', PRICE_ALERTS_FILE, lambda: {str(k): v for k, v in dict(price_alerts).items()}
+    ))
+    persistence.register('blocked_users', make_store_writer(
+        'blocked_users', BLOCKED_USERS_FILE, lambda: dict.fromkeys(set(blocked_users), True), encode=list
+    ))
+
+# Activity journal - last_seen and command_count updates are appended to a JSONL
+# journal instead of rewriting the users store; a compactor folds it back in
+ACTIVITY_JOURNAL_FILE = os.getenv("ACTIVITY_JOURNAL_FILE", "activity_journal.jsonl")
+ACTIVITY_HISTORY_DIR = os.getenv("ACTIVITY_HISTORY_DIR", "")  # keep compacted segments here for analytics
+ACTIVITY_COMPACT_INTERVAL = float(os.getenv("ACTIVITY_COMPACT_INTERVAL", "300"))  # seconds
+ACTIVITY_COMPACT_BYTES = int(os.getenv("ACTIVITY_COMPACT_BYTES", str(4 * 1024 * 1024)))
+
+class ActivityJournal:
+    """Append-only journal of user activity events.
+
+    Events carry absolute values (``last_seen`` timestamp, new
+    ``command_count``), so replaying a segment that is already folded into
+    the snapshot is harmless. Compaction rotates the live file into a
+    segment, flushes the touched users and then drops (or archives) the
+    segment.
+    """
+
+    def __init__(self, path, history_dir=None):
+        self.path = path
+        self.history_dir = history_dir or None
+        self.lock = threading.Lock()
+        self.file = None
+        self.size = 0
+        self.touched = set()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.stopping = False
+
+    def segments(self):
+        """Rotated segments not yet folded into the snapshot, oldest first."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        prefix = os.path.basename(self.path) + '.'
+        names = [n for n in os.listdir(directory) if n.startswith(prefix) and n[len(prefix):].isdigit()]
+        names.sort(key=lambda n: int(n[len(prefix):]))
+        return [os.path.join(directory, n) for n in names]
+
+    def replay(self, apply):
+        """Feed every journaled event to ``apply(event)``; returns the event count."""
+        count = 0
+        for path in self.segments() + [self.path]:
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line after a crash
+                    apply(event)
+                    self.touched.add(event.get('u'))
+                    count += 1
+        return count
+
+    def open(self):
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.size = self.file.tell()
+
+    def append(self, kind, user_id, **fields):
+        """Append one event; this is the only write on the activity hot path."""
+        event = {'e': kind, 'u': str(user_id), **fields}
+        line = json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self.lock:
+            if self.file is None:
+                self.open()
+            self.file.write(line)
+            self.file.flush()
+            self.size += len(line)
+            self.touched.add(event['u'])
+            if self.size >= ACTIVITY_COMPACT_BYTES:
+                self.wakeup.set()
+
+    def compact(self):
+        """Fold the journal into the users store and retire its segments."""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                self.size = 0
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                os.replace(self.path, f"{self.path}.{int(datetime.now().timestamp() * 1000)}")
+            touched, self.touched = self.touched, set()
+        segments = self.segments()
+        if not segments:
+            return
+        for user_id in touched:
+            persistence.mark_dirty('users', user_id)
+        if not persistence.flush():
+            with self.lock:
+                self.touched.update(touched)
+            return
+        for path in segments:
+            try:
+                if self.history_dir:
+                    os.makedirs(self.history_dir, exist_ok=True)
+                    os.replace(path, os.path.join(self.history_dir, os.path.basename(path)))
+                else:
+                    os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not retire journal segment {path}: {e}")
+        logger.info(f"Compacted activity journal ({len(touched)} users)")
+
+    def _run(self):
+        while not self.stopping:
+            self.wakeup.wait(ACTIVITY_COMPACT_INTERVAL)
+            self.wakeup.clear()
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Error compacting activity journal: {e}")
+
+    def start(self):
+        """Start the background compactor (no-op if already running)."""
+        if self.thread is None:
+            self.stopping = False
+            self.thread = threading.Thread(target=self._run, name="activity-compactor", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stop the compactor and fold everything journaled so far."""
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=30)
+            self.thread = None
+        self.compact()
+
+activity_journal = ActivityJournal(ACTIVITY_JOURNAL_FILE, ACTIVITY_HISTORY_DIR)
+atexit.register(activity_journal.stop)
+
+def apply_activity_event(event):
+    """Apply one journaled activity event to user_data."""
+    record = user_data.get(event.get('u'))
+    if record is None:
+        return
+    if 'seen' in event:
+        record['last_seen'] = event['seen']
+    if 'count' in event:
+        record['command_count'] = event['count']
+
+def replay_activity_journal():
+    """Bring user_data up to date with activity journaled since the last compaction."""
+    try:
+        count = activity_journal.replay(apply_activity_event)
+        if count:
+            logger.info(f"Replayed {count} activity events from {ACTIVITY_JOURNAL_FILE}")
+    except Exception as e:
+        logger.error(f"Error replaying activity journal: {e}")
+
 def load_alarms():
     """Load alarms from JSON file."""
     global alarms
+    if storage is not None:
+        try:
+            alarms = {int(k): v for k, v in storage.load('alarms').items()}
+        except Exception as e:
+            logger.error(f"Error loading alarms: {e}")
+            alarms = {}
+        return
     if os.path.exists(ALARMS_FILE):
         try:
             with open(ALARMS_FILE, 'r', encoding='utf-8') as f:
@@ -158,72 +640,882 @@ def load_alarms():
         alarms = {}
 
 def save_alarms():
-    """Save alarms to JSON file."""
+    """Schedule a write of all alarms."""
+    persistence.mark_dirty('alarms')
+
+def save_user_alarms(user_id):
+    """Schedule a write of the alarms of a single user."""
+    persistence.mark_dirty('alarms', user_id)
+
+def load_price_alerts():
+    """Load crypto price alerts from storage."""
+    global price_alerts
     try:
-        with open(ALARMS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(alarms, f, indent=2, ensure_ascii=False)
+        if storage is not None:
+            price_alerts = {int(k): v for k, v in storage.load('price_alerts').items()}
+        elif os.path.exists(PRICE_ALERTS_FILE):
+            with open(PRICE_ALERTS_FILE, 'r', encoding='utf-8') as f:
+                price_alerts = {int(k): v for k, v in json.load(f).items()}
+        else:
+            price_alerts = {}
     except Exception as e:
-        logger.error(f"Error saving alarms: {e}")
+        logger.error(f"Error loading price alerts: {e}")
+        price_alerts = {}
+
+def save_user_price_alerts(user_id):
+    """Schedule a write of the price alerts of a single user."""
+    persistence.mark_dirty('price_alerts', user_id)
+
+# Outgoing message rate limiting - Telegram allows about 30 messages per second
+# across all chats; a RetryAfter pauses every sender sharing the limiter
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))  # messages per second
 
-async def check_alarms_loop(bot):
-    """Background task loop to check and trigger alarms."""
+class AsyncRateLimiter:
+    """Token bucket shared by coroutines on the event loop."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available (waiters are served in order)."""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for ``seconds`` (flood control)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+telegram_send_limiter = AsyncRateLimiter(TELEGRAM_GLOBAL_RATE)
+
+def retry_after_seconds(error):
+    """Seconds to wait from a RetryAfter (an int or a timedelta depending on the PTB version)."""
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+async def send_message_limited(bot, chat_id, text, max_retries=3, **kwargs):
+    """Send a message through the global rate limiter, honouring RetryAfter."""
+    for attempt in range(max_retries + 1):
+        await telegram_send_limiter.acquire()
+        try:
+            return await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        except RetryAfter as e:
+            wait = retry_after_seconds(e)
+            logger.warning(f"Flood control while sending to {chat_id}, retrying in {wait}s")
+            telegram_send_limiter.pause(wait)
+            if attempt == max_retries:
+                raise
+
+# Circuit breakers - every call to a known external provider is recorded in a rolling
+# window. When most recent calls failed the breaker opens and further calls fail
+# immediately; after a cool-down a single probe call decides whether it closes again.
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))  # calls remembered per provider
+BREAKER_MIN_CALLS = 5  # calls needed in the window before a breaker may open
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_OPEN_SECONDS = int(os.getenv("BREAKER_OPEN_SECONDS", "30"))  # first cool-down, doubled per failed probe
+BREAKER_MAX_OPEN_SECONDS = 600
+
+# Hosts of the third-party APIs the bot depends on -> provider name. Calls to other
+# hosts (e.g. user-supplied URLs) are not tracked.
+PROVIDER_HOSTS = {
+    'api.ocr.space': 'OCR.space',
+    'image.pollinations.ai': 'Pollinations',
+    'api.tiklydown.eu.org': 'TiklyDown',
+    'tikwm.com': 'TikWM',
+    'api.screenshotlayer.com': 'Screenshotlayer',
+    'image.thum.io': 'thum.io',
+    'api-inference.huggingface.co': 'HuggingFace',
+    'api.coingecko.com': 'CoinGecko',
+    'ip-api.com': 'ip-api',
+    'is.gd': 'is.gd',
+    'v.gd': 'v.gd',
+    'api.mymemory.translated.net': 'MyMemory',
+    'libretranslate.com': 'LibreTranslate',
+    'translate.googleapis.com': 'Google Translate',
+    'en.wikipedia.org': 'Wikipedia',
+    'bn.wikipedia.org': 'Wikipedia',
+}
+
+class ProviderUnavailable(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+class CircuitBreaker:
+    """Rolling success/latency window for one provider, with closed/open/half-open states."""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()  # calls are recorded from worker threads too
+        self.window = deque(maxlen=BREAKER_WINDOW)  # (succeeded, latency seconds)
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.open_seconds = BREAKER_OPEN_SECONDS
+        self.probe_in_flight = False
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.trips = 0
+
+    def before_call(self):
+        """Raise ProviderUnavailable unless a call may go out now."""
+        with self.lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.open_seconds:
+                self.state = 'half-open'
+            if self.state == 'closed' or (self.state == 'half-open' and not self.probe_in_flight):
+                self.probe_in_flight = self.state == 'half-open'
+                return
+            self.rejected += 1
+            retry_in = max(0, self.open_seconds - (time.monotonic() - self.opened_at))
+        raise ProviderUnavailable(f"{self.name} is temporarily unavailable (retrying in {retry_in:.0f}s)")
+
+    def record(self, succeeded, latency):
+        with self.lock:
+            self.calls += 1
+            self.window.append((succeeded, latency))
+            if not succeeded:
+                self.failures += 1
+            if self.state == 'half-open':
+                self.probe_in_flight = False
+                if succeeded:
+                    logger.info(f"Circuit breaker for {self.name} closed again")
+                    self.state = 'closed'
+                    self.open_seconds = BREAKER_OPEN_SECONDS
+                    self.window.clear()
+                else:
+                    self.trip(min(self.open_seconds * 2, BREAKER_MAX_OPEN_SECONDS))
+            elif self.state == 'closed' and len(self.window) >= BREAKER_MIN_CALLS:
+                failed = sum(1 for ok, _ in self.window if not ok)
+                if failed / len(self.window) >= BREAKER_FAILURE_RATE:
+                    self.trip(BREAKER_OPEN_SECONDS)
+
+    def release(self):
+        """Forget a call that was abandoned (cancelled) before it had a verdict."""
+        with self.lock:
+            if self.state == 'half-open':
+                self.probe_in_flight = False
+
+    def trip(self, open_seconds):
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+        self.open_seconds = open_seconds
+        self.trips += 1
+        logger.warning(f"Circuit breaker for {self.name} opened for {open_seconds}s")
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(latency for _, latency in self.window)
+            successes = sum(1 for ok, _ in self.window if ok)
+            state = self.state
+            if state == 'open' and time.monotonic() - self.opened_at >= self.open_seconds:
+                state = 'half-open'
+            return {
+                'name': self.name,
+                'state': state,
+                'window': len(self.window),
+                'success_rate': successes / len(self.window) if self.window else None,
+                'p50': latencies[len(latencies) // 2] if latencies else None,
+                'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+                'calls': self.calls,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'trips': self.trips,
+                'retry_in': max(0, self.open_seconds - (time.monotonic() - self.opened_at)) if state == 'open' else 0,
+            }
+
+circuit_breakers = {}  # provider name -> CircuitBreaker
+
+def breaker_for_url(url):
+    """The circuit breaker of the provider serving url, or None for untracked hosts."""
+    name = PROVIDER_HOSTS.get((urlsplit(str(url)).hostname or '').lower())
+    if name is None:
+        return None
+    breaker = circuit_breakers.get(name)
+    if breaker is None:
+        breaker = circuit_breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+def response_succeeded(status_code):
+    # 4xx other than rate limiting is the caller's problem, not the provider's
+    return status_code < 500 and status_code != 429
+
+# Shared HTTP clients - one keep-alive connection pool per host instead of a new
+# TCP/TLS connection per call. http_session serves code running in worker threads,
+# http_client (async) serves coroutines without tying up a thread per request.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))  # kept-alive connections per host
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "20"))
+
+def reject_all_cookies():
+    """Cookie policy for the shared clients: they fetch user-supplied URLs (e.g. /clone),
+    so a kept cookie would be sent on another user's request to the same site."""
+    return http.cookiejar.DefaultCookiePolicy(allowed_domains=[])
+
+class PooledSession(requests.Session):
+    """requests.Session with per-host connection pools, a default timeout and no cookie jar."""
+
+    def __init__(self):
+        super().__init__()
+        self.cookies.set_policy(reject_all_cookies())
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        breaker = breaker_for_url(url)
+        if breaker is None:
+            return super().request(method, url, **kwargs)
+        breaker.before_call()
+        started = time.monotonic()
+        try:
+            response = super().request(method, url, **kwargs)
+        except Exception:
+            breaker.record(False, time.monotonic() - started)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record(response_succeeded(response.status_code), time.monotonic() - started)
+        return response
+
+class BreakerAsyncClient(httpx.AsyncClient):
+    """httpx.AsyncClient that reports calls to known providers to their circuit breakers."""
+
+    async def send(self, request, **kwargs):
+        breaker = breaker_for_url(request.url)
+        if breaker is None:
+            return await super().send(request, **kwargs)
+        breaker.before_call()
+        started = time.monotonic()
+        try:
+            response = await super().send(request, **kwargs)
+        except Exception:
+            breaker.record(False, time.monotonic() - started)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record(response_succeeded(response.status_code), time.monotonic() - started)
+        return response
+
+http_session = PooledSession()
+http_client = None  # httpx.AsyncClient, created on first use inside the event loop
+
+def get_http_client():
+    """The shared async HTTP client."""
+    global http_client
+    if http_client is None:
+        http_client = BreakerAsyncClient(
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=HTTP_POOL_SIZE * 4, max_keepalive_connections=HTTP_POOL_SIZE, keepalive_expiry=60),
+            follow_redirects=True,
+            cookies=http.cookiejar.CookieJar(policy=reject_all_cookies()),
+        )
+    return http_client
+
+async def close_http_clients():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+    http_session.close()
+
+class TTLCache:
+    """Bounded LRU cache of API results with expiry. None results (misses) can be kept
+    for a shorter time; concurrent loads of one key share a single call."""
+
+    def __init__(self, max_entries, ttl, negative_ttl=0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()  # key -> (value, expires_at monotonic), least recently used first
+        self.pending = {}  # key -> task loading it
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key, loader):
+        """Return the cached value for key, or await loader() once to fill it in.
+
+        Exceptions from loader() reach every waiting caller and are not cached."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            del self.entries[key]
+        
+        task = self.pending.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self.load(key, loader))
+            self.pending[key] = task
+            task.add_done_callback(lambda t: self.forget_pending(key, t))
+        return await asyncio.shield(task)
+
+    async def load(self, key, loader):
+        value = await loader()
+        self.put(key, value)
+        return value
+
+    def forget_pending(self, key, task):
+        self.pending.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here too, in case every caller was cancelled
+
+    def put(self, key, value):
+        ttl = self.negative_ttl if value is None else self.ttl
+        if ttl <= 0:
+            return
+        self.entries[key] = (value, time.monotonic() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+# Workload executors - blocking work is split by class so a burst of one kind
+# (e.g. video downloads) cannot starve another (e.g. image filters). Each class
+# has its own worker count and queue depth; work beyond that is rejected.
+class ExecutorBusy(Exception):
+    """Raised when a workload executor's queue is full."""
+
+def timed_call(fn, args):
+    """Run fn(*args) in a worker and report when it actually started."""
+    return time.monotonic(), fn(*args)
+
+class WorkloadExecutor:
+    """A named, bounded thread or process pool with saturation metrics."""
+
+    def __init__(self, name, max_workers, max_queue, processes=False):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.processes = processes
+        self.pool = None
+        self.pending = 0  # submitted and not finished (running + queued), including abandoned work
+        self.peak_pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.run_total = 0.0
+
+    def start(self):
+        """Create the pool (process pools fork all workers on the first submit)."""
+        if self.pool is None:
+            if self.processes:
+                # fork keeps module globals without re-running bot.py in the workers
+                self.pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('fork'))
+            else:
+                self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{self.name}-worker")
+        return self.pool
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on this executor, or raise ExecutorBusy if the queue is full."""
+        if self.pending >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise ExecutorBusy(f"The bot is busy with other {self.name} work right now, please try again in a minute.")
+        pool = self.start()
+        self.pending += 1
+        self.submitted += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        submitted_at = time.monotonic()
+        loop = asyncio.get_running_loop()
+        future = None
+        try:
+            if self.processes:
+                future = pool.submit(timed_call, fn, args)
+            else:
+                # Threads see the caller's context, e.g. the job they work for
+                future = pool.submit(contextvars.copy_context().run, timed_call, fn, args)
+            # A cancelled caller cannot stop a running worker, so the slot is freed when
+            # the work itself finishes rather than when this coroutine stops waiting
+            future.add_done_callback(lambda _: self.work_finished(loop))
+            started_at, result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Only a cancelled job makes the worker give up too; a timeout or a cancelled
+            # sub-step of a running job leaves the worker to finish on its own
+            job = current_job.get()
+            if job is not None and job.state == 'cancelled':
+                job.stop_work()
+            raise
+        except BrokenProcessPool:
+            # Forking again now would copy locks held by the bot's other threads, so
+            # the work continues on threads instead (as with CPU_PROCESSES=0)
+            self.failed += 1
+            logger.error(f"{self.name} process pool broke (a worker died), switching to threads")
+            if self.pool is pool:
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = None
+                self.processes = False
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            if future is None:
+                self.pending -= 1  # never submitted
+        self.completed += 1
+        self.wait_total += started_at - submitted_at
+        self.run_total += time.monotonic() - started_at
+        return result
+
+    def work_finished(self, loop):
+        """Done-callback of a submitted future; runs in whichever thread finished it."""
+        try:
+            loop.call_soon_threadsafe(self.release_pending)
+        except RuntimeError:
+            pass  # the event loop is already closed (shutdown)
+
+    def release_pending(self):
+        self.pending -= 1
+
+    def stats(self):
+        """Current load and lifetime counters."""
+        return {
+            'name': self.name,
+            'kind': 'processes' if self.processes else 'threads',
+            'workers': self.max_workers,
+            'queue_limit': self.max_queue,
+            'active': min(self.pending, self.max_workers),
+            'queued': max(0, self.pending - self.max_workers),
+            'peak': self.peak_pending,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'avg_wait': self.wait_total / self.completed if self.completed else 0.0,
+            'avg_run': self.run_total / self.completed if self.completed else 0.0,
+        }
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+# Network calls (APIs, TTS, small downloads)
+io_executor = WorkloadExecutor(
+    'network', int(os.getenv("IO_WORKERS", "16")), int(os.getenv("IO_QUEUE", "64")))
+# Video / website downloads - long running, kept apart from quick API calls
+download_executor = WorkloadExecutor(
+    'download', int(os.getenv("DOWNLOAD_WORKERS", "4")), int(os.getenv("DOWNLOAD_QUEUE", "16")))
+# Pure-Python pixel loops and PDF rendering, in processes so they don't hold the GIL
+# (threads instead with CPU_PROCESSES=0 or where fork is unavailable, e.g. Windows)
+cpu_executor = WorkloadExecutor(
+    'image processing', int(os.getenv("CPU_WORKERS", "2")), int(os.getenv("CPU_QUEUE", "8")),
+    processes=os.getenv("CPU_PROCESSES", "1") != "0" and 'fork' in multiprocessing.get_all_start_methods())
+# In-process Pillow / OCR work done by nested handler helpers
+image_executor = WorkloadExecutor(
+    'image', int(os.getenv("IMAGE_WORKERS", "4")), int(os.getenv("IMAGE_QUEUE", "16")))
+# ffmpeg transcodes (video to MP3, voice to text)
+transcode_executor = WorkloadExecutor(
+    'transcoding', int(os.getenv("TRANSCODE_WORKERS", "2")), int(os.getenv("TRANSCODE_QUEUE", "8")))
+WORKLOAD_EXECUTORS = (io_executor, download_executor, cpu_executor, image_executor, transcode_executor)
+
+def start_executors():
+    """Fork the CPU worker processes now, before any other thread is running."""
+    if cpu_executor.processes:
+        cpu_executor.start().submit(abs, 0).result()
+
+def shutdown_executors():
+    for executor in WORKLOAD_EXECUTORS:
+        executor.shutdown()
+
+# Telegram media fetch - files are streamed by PTB's own async client straight into
+# memory (or a spool file for tools that need a path), with size limits and retries
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_MB", "20")) * 1024 * 1024  # the cloud Bot API serves up to 20 MB
+MEDIA_FETCH_RETRIES = 3
+
+class MediaTooLarge(Exception):
+    """Raised when a Telegram file is over the download size limit."""
+
+async def with_media_retries(call):
+    """Await call() again after flood control or transient network errors."""
+    for attempt in range(MEDIA_FETCH_RETRIES):
+        try:
+            return await call()
+        except RetryAfter as e:
+            if attempt == MEDIA_FETCH_RETRIES - 1:
+                raise
+            await asyncio.sleep(retry_after_seconds(e))
+        except BadRequest:
+            raise
+        except (TimedOut, NetworkError) as e:
+            if attempt == MEDIA_FETCH_RETRIES - 1:
+                raise
+            logger.warning(f"Telegram file download failed ({e}), retrying...")
+            await asyncio.sleep(2 ** attempt)
+
+async def get_telegram_file(bot, file_id, file_size=None, max_bytes=MEDIA_MAX_BYTES):
+    """Resolve a file_id, refusing files over max_bytes before anything is downloaded."""
+    if not file_size or file_size <= max_bytes:
+        file = await with_media_retries(lambda: bot.get_file(file_id))
+        file_size = file.file_size
+        if not file_size or file_size <= max_bytes:
+            return file
+    raise MediaTooLarge(f"File is too large ({file_size / (1024 * 1024):.1f} MB). The limit is {max_bytes // (1024 * 1024)} MB.")
+
+async def fetch_telegram_file(bot, file_id, file_size=None, max_bytes=MEDIA_MAX_BYTES):
+    """Download a Telegram file into memory and return its bytes."""
+    file = await get_telegram_file(bot, file_id, file_size, max_bytes)
+    return bytes(await with_media_retries(lambda: file.download_as_bytearray()))
+
+async def spool_telegram_file(bot, file_id, suffix='', file_size=None, max_bytes=MEDIA_MAX_BYTES):
+    """Download a Telegram file to a temporary file and return its path (the caller removes it)."""
+    file = await get_telegram_file(bot, file_id, file_size, max_bytes)
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        await with_media_retries(lambda: file.download_to_drive(path))
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+# Media cache - downloaded files keyed by file_unique_id, which stays the same for a
+# file across chats and file_ids, so repeat edits of one photo skip the download
+MEDIA_CACHE_MEMORY_BYTES = int(os.getenv("MEDIA_CACHE_MEMORY_MB", "64")) * 1024 * 1024
+MEDIA_CACHE_DISK_BYTES = int(os.getenv("MEDIA_CACHE_DISK_MB", "512")) * 1024 * 1024  # 0 disables the disk tier
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "bot_media_cache"))
+
+class MediaCache:
+    """Two-tier (memory, then disk) LRU cache of Telegram file contents."""
+
+    def __init__(self, memory_bytes, disk_bytes, directory):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.directory = directory
+        self.memory = OrderedDict()  # file_unique_id -> bytes, least recently used first
+        self.memory_used = 0
+        self.disk = OrderedDict()  # file_unique_id -> size of the file on disk
+        self.disk_used = 0
+        self.pending = {}  # file_unique_id -> task downloading it, shared by concurrent requests
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def load_index(self):
+        """Pick up files cached by a previous run, oldest first."""
+        if not self.disk_bytes:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = sorted(os.scandir(self.directory), key=lambda entry: entry.stat().st_mtime)
+            for entry in entries:
+                if entry.name.endswith('.tmp'):
+                    os.unlink(entry.path)
+                    continue
+                self.disk[entry.name] = entry.stat().st_size
+                self.disk_used += self.disk[entry.name]
+            for key in self.evict_disk():
+                os.unlink(self.path(key))
+            logger.info(f"Media cache: {len(self.disk)} file(s) on disk in {self.directory}")
+        except OSError as e:
+            logger.warning(f"Media cache directory unavailable ({e}), caching in memory only")
+            self.disk_bytes = 0
+            self.disk.clear()
+            self.disk_used = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def remember(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+        self.memory[key] = data
+        self.memory_used += len(data)
+        while self.memory_used > self.memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_used -= len(evicted)
+
+    def evict_disk(self):
+        """Drop least recently used entries from the disk index; returns their keys."""
+        evicted = []
+        while self.disk_used > self.disk_bytes:
+            key, size = self.disk.popitem(last=False)
+            self.disk_used -= size
+            evicted.append(key)
+        return evicted
+
+    def read_file(self, key):
+        path = self.path(key)
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)  # keep the LRU order across restarts
+        return data
+
+    def write_file(self, key, data, evicted):
+        for old_key in evicted:
+            try:
+                os.unlink(self.path(old_key))
+            except FileNotFoundError:
+                pass
+        temp_path = self.path(key) + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, self.path(key))
+
+    async def get(self, bot, media, max_bytes=MEDIA_MAX_BYTES):
+        """Return the contents of a PhotoSize/Document/etc., downloading it at most once."""
+        key = media.file_unique_id
+        data = self.memory.get(key)
+        if data is not None:
+            self.memory.move_to_end(key)
+            self.memory_hits += 1
+            return data
+        
+        # One download per file however many handlers ask for it; the task outlives
+        # a cancelled caller so the others still get the result
+        task = self.pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self.load(bot, media, max_bytes))
+            self.pending[key] = task
+            task.add_done_callback(lambda t: self.forget_pending(key, t))
+        return await asyncio.shield(task)
+
+    def forget_pending(self, key, task):
+        self.pending.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here too, in case every caller was cancelled
+
+    async def load(self, bot, media, max_bytes):
+        key = media.file_unique_id
+        if key in self.disk:
+            try:
+                data = await io_executor.run(self.read_file, key)
+            except (OSError, ExecutorBusy) as e:
+                logger.warning(f"Media cache read failed for {key}: {e}")
+                self.disk_used -= self.disk.pop(key, 0)
+            else:
+                if key in self.disk:
+                    self.disk.move_to_end(key)
+                self.disk_hits += 1
+                self.remember(key, data)
+                return data
+        
+        self.misses += 1
+        data = await fetch_telegram_file(bot, media.file_id, media.file_size, max_bytes)
+        self.remember(key, data)
+        
+        if len(data) <= self.disk_bytes and key not in self.disk:
+            self.disk[key] = len(data)
+            self.disk_used += len(data)
+            evicted = self.evict_disk()
+            try:
+                await io_executor.run(self.write_file, key, data, evicted)
+            except (OSError, ExecutorBusy) as e:
+                logger.warning(f"Media cache write failed for {key}: {e}")
+                self.disk_used -= self.disk.pop(key, 0)
+        return data
+
+    def stats(self):
+        return {
+            'memory_items': len(self.memory),
+            'memory_mb': self.memory_used / (1024 * 1024),
+            'disk_items': len(self.disk),
+            'disk_mb': self.disk_used / (1024 * 1024),
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+        }
+
+media_cache = MediaCache(MEDIA_CACHE_MEMORY_BYTES, MEDIA_CACHE_DISK_BYTES, MEDIA_CACHE_DIR)
+
+# Background tasks - the event loop only keeps weak references to tasks, so
+# fire-and-forget tasks are held here until they finish
+background_tasks = set()
+
+def start_background_task(coro):
+    """Schedule a coroutine that nobody awaits and keep it alive until it is done."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Alarm scheduler - a min-heap of absolute fire times; the scheduler task sleeps
+# until the earliest alarm instead of polling every minute
+ALARM_SCHEDULER_MAX_SLEEP = 600  # seconds; re-check now and then in case the wall clock moved
+ALARM_DELIVERY_CONCURRENCY = int(os.getenv("ALARM_DELIVERY_CONCURRENCY", "50"))
+alarm_heap = []  # [[fire_ts, seq, user_id, alarm_id, active]]
+alarm_heap_entries = {}  # {alarm_id: heap entry}, for O(1) lazy cancellation
+alarm_heap_seq = 0
+alarm_wakeup = None  # asyncio.Event owned by the scheduler task
+
+def next_alarm_fire_time(alarm_time, now=None):
+    """Return the next datetime at which an ``HH:MM`` alarm is due.
+
+    An alarm set for the current minute is due now rather than tomorrow.
+    """
+    now = now or datetime.now()
+    hour, minute = map(int, alarm_time.split(':'))
+    fire_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if fire_at <= now - timedelta(minutes=1):
+        fire_at += timedelta(days=1)
+    return fire_at
+
+def schedule_alarm(user_id, alarm, now=None):
+    """Push an alarm onto the scheduler heap (O(log n))."""
+    global alarm_heap_seq
+    alarm_id = alarm.get('alarm_id', '')
+    try:
+        fire_ts = next_alarm_fire_time(alarm.get('time', ''), now).timestamp()
+    except (ValueError, AttributeError):
+        logger.warning(f"Skipping alarm {alarm_id} with invalid time {alarm.get('time')!r}")
+        return
+    cancel_alarm(alarm_id)
+    alarm_heap_seq += 1
+    entry = [fire_ts, alarm_heap_seq, user_id, alarm_id, True]
+    heapq.heappush(alarm_heap, entry)
+    alarm_heap_entries[alarm_id] = entry
+    if alarm_wakeup is not None and alarm_heap[0] is entry:
+        alarm_wakeup.set()
+
+def cancel_alarm(alarm_id):
+    """Cancel a scheduled alarm; the dead heap entry is dropped when it surfaces."""
+    entry = alarm_heap_entries.pop(alarm_id, None)
+    if entry is not None:
+        entry[4] = False
+        # Rebuild once dead entries dominate so the heap stays O(live alarms)
+        if len(alarm_heap) > 64 and len(alarm_heap) > 2 * len(alarm_heap_entries):
+            alarm_heap[:] = [e for e in alarm_heap if e[4]]
+            heapq.heapify(alarm_heap)
+
+def schedule_all_alarms():
+    """(Re)build the heap from the alarms store."""
+    alarm_heap.clear()
+    alarm_heap_entries.clear()
+    now = datetime.now()
+    for user_id, user_alarms in alarms.items():
+        for alarm in user_alarms:
+            schedule_alarm(user_id, alarm, now)
+    logger.info(f"Scheduled {len(alarm_heap_entries)} alarms")
+
+def pop_due_alarms(now_ts):
+    """Pop every live alarm whose fire time has passed."""
+    due = []
+    while alarm_heap and alarm_heap[0][0] <= now_ts:
+        entry = heapq.heappop(alarm_heap)
+        if not entry[4]:
+            continue
+        alarm_heap_entries.pop(entry[3], None)
+        due.append((entry[2], entry[3]))
+    return due
+
+def seconds_until_next_alarm(now_ts):
+    """Seconds until the earliest live alarm, or None if nothing is scheduled."""
+    while alarm_heap and not alarm_heap[0][4]:
+        heapq.heappop(alarm_heap)
+    if not alarm_heap:
+        return None
+    return max(0.0, alarm_heap[0][0] - now_ts)
+
+async def deliver_alarm(bot, user_id, alarm):
+    """Send the alarm notification; returns True if the alarm should be removed."""
+    try:
+        message = alarm.get('message', '⏰ Alarm!')
+        
+        # Send notification messages with sound/alert effect
+        # Send multiple quick messages to ensure phone notification sound
+        notification_messages = [
+            "🔔🔔🔔",
+            "🔔",
+            f"⏰ **ALARM!** ⏰\n\n{message}\n\n🔔 Wake Up! 🔔"
+        ]
+        
+        for i, notif_text in enumerate(notification_messages):
+            await send_message_limited(
+                bot,
+                user_id,
+                notif_text,
+                parse_mode='Markdown' if i == 2 else None,
+                disable_notification=False  # Ensure notification sound plays
+            )
+            if i < len(notification_messages) - 1:
+                await asyncio.sleep(0.5)  # Delay between notifications
+        
+        logger.info(f"Alarm triggered for user {user_id}: {message}")
+        return True
+    except Exception as e:
+        logger.error(f"Error sending alarm to user {user_id}: {e}")
+        # Remove alarm if user blocked bot or chat not found
+        return "chat not found" in str(e).lower() or "blocked" in str(e).lower()
+
+async def deliver_due_alarms(bot, due):
+    """Deliver a batch of due alarms concurrently and persist the removals once."""
+    semaphore = asyncio.Semaphore(ALARM_DELIVERY_CONCURRENCY)
+    
+    async def deliver(user_id, alarm):
+        async with semaphore:
+            return await deliver_alarm(bot, user_id, alarm)
+    
+    batch = []
+    for user_id, alarm_id in due:
+        alarm = next((a for a in alarms.get(user_id, []) if a.get('alarm_id') == alarm_id), None)
+        if alarm is not None:
+            batch.append((user_id, alarm))
+    results = await asyncio.gather(*(deliver(user_id, alarm) for user_id, alarm in batch))
+    
+    # Remove triggered alarms; ones whose send failed go back on the heap for the
+    # next day's occurrence (one minute ahead so the current minute is not reused)
+    removed = {}
+    retry_from = datetime.now() + timedelta(minutes=1)
+    for (user_id, alarm), remove in zip(batch, results):
+        if remove:
+            removed.setdefault(user_id, set()).add(alarm.get('alarm_id'))
+        elif any(a is alarm for a in alarms.get(user_id, [])):
+            schedule_alarm(user_id, alarm, retry_from)
+    for user_id, alarm_ids in removed.items():
+        if user_id in alarms:
+            alarms[user_id] = [a for a in alarms[user_id] if a.get('alarm_id') not in alarm_ids]
+            if not alarms[user_id]:
+                del alarms[user_id]
+            save_user_alarms(user_id)
+    if batch:
+        logger.info(f"Delivered {len(batch)} alarms ({sum(1 for r in results if r)} removed)")
+
+async def alarm_scheduler_loop(bot):
+    """Background task that fires alarms exactly when they are due."""
+    global alarm_wakeup
+    alarm_wakeup = asyncio.Event()
     while True:
         try:
-            current_time = datetime.now()
-            current_time_str = current_time.strftime("%H:%M")
-            
-            # Check all alarms
-            alarms_to_remove = []
-            for user_id, user_alarms in list(alarms.items()):
-                for alarm in user_alarms[:]:  # Create a copy to iterate
-                    alarm_time = alarm.get('time', '')
-                    alarm_id = alarm.get('alarm_id', '')
-                    
-                    # Check if alarm time matches current time (HH:MM format)
-                    if alarm_time == current_time_str:
-                        try:
-                            message = alarm.get('message', '⏰ Alarm!')
-                            
-                            # Send notification messages with sound/alert effect
-                            # Send multiple quick messages to ensure phone notification sound
-                            notification_messages = [
-                                "🔔🔔🔔",
-                                "🔔",
-                                f"⏰ **ALARM!** ⏰\n\n{message}\n\n🔔 Wake Up! 🔔"
-                            ]
-                            
-                            for i, notif_text in enumerate(notification_messages):
-                                await bot.send_message(
-                                    chat_id=user_id,
-                                    text=notif_text,
-                                    parse_mode='Markdown' if i == 2 else None,
-                                    disable_notification=False  # Ensure notification sound plays
-                                )
-                                if i < len(notification_messages) - 1:
-                                    await asyncio.sleep(0.5)  # Delay between notifications
-                            
-                            alarms_to_remove.append((user_id, alarm_id))
-                            logger.info(f"Alarm triggered for user {user_id}: {message}")
-                        except Exception as e:
-                            logger.error(f"Error sending alarm to user {user_id}: {e}")
-                            # Remove alarm if user blocked bot or chat not found
-                            if "chat not found" in str(e).lower() or "blocked" in str(e).lower():
-                                alarms_to_remove.append((user_id, alarm_id))
-            
-            # Remove triggered alarms
-            for user_id, alarm_id in alarms_to_remove:
-                if user_id in alarms:
-                    alarms[user_id] = [a for a in alarms[user_id] if a.get('alarm_id') != alarm_id]
-                    if not alarms[user_id]:
-                        del alarms[user_id]
-                    save_alarms()
-            
-            # Wait 60 seconds before next check
-            await asyncio.sleep(60)
+            alarm_wakeup.clear()
+            due = pop_due_alarms(datetime.now().timestamp())
+            if due:
+                # Deliver in the background so later alarms are not held up by this batch
+                start_background_task(deliver_due_alarms(bot, due))
+            
+            # Sleep until the next alarm is due, or until a new earlier alarm is scheduled
+            delay = seconds_until_next_alarm(datetime.now().timestamp())
+            if delay is None or delay > ALARM_SCHEDULER_MAX_SLEEP:
+                delay = ALARM_SCHEDULER_MAX_SLEEP
+            try:
+                await asyncio.wait_for(alarm_wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
             
         except Exception as e:
-            logger.error(f"Error in alarm check task: {e}")
-            await asyncio.sleep(60)
+            logger.error(f"Error in alarm scheduler: {e}")
+            await asyncio.sleep(1)
 
 async def ocrsetup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Diagnose OCR setup and provide actionable guidance."""
@@ -260,6 +1552,13 @@ async def ocrsetup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 def load_user_data():
     """Load user data from JSON file."""
     global user_data
+    if storage is not None:
+        try:
+            user_data = storage.load('users')
+        except Exception as e:
+            logger.error(f"Error loading user data: {e}")
+            user_data = {}
+        return
     if os.path.exists(USER_DATA_FILE):
         try:
             with open(USER_DATA_FILE, 'r', encoding='utf-8') as f:
@@ -271,12 +1570,226 @@ def load_user_data():
         user_data = {}
 
 def save_user_data():
-    """Save user data to JSON file."""
+    """Schedule a write of all user data."""
+    persistence.mark_dirty('users')
+
+# Incremental user statistics - kept up to date by track_user() and
+# increment_command_count() so admin stats never scan user_data
+STATS_TOP_K = 5
+STATS_WINDOWS = (7, 30)  # days
+total_command_count = 0
+top_command_users = {}  # {user_id_str: command_count} of the current top-K
+last_seen_day_counts = {}  # {day ordinal: users whose last_seen falls on that day}
+
+def last_seen_day(last_seen):
+    """Day ordinal of an ISO timestamp, or None if it cannot be parsed."""
     try:
-        with open(USER_DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(user_data, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        logger.error(f"Error saving user data: {e}")
+        return datetime.fromisoformat(last_seen[:10]).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+def stats_move_last_seen(old_last_seen, new_last_seen):
+    """Move a user from the activity bucket of old_last_seen to that of new_last_seen."""
+    old_day = last_seen_day(old_last_seen) if old_last_seen else None
+    new_day = last_seen_day(new_last_seen) if new_last_seen else None
+    if old_day == new_day:
+        return
+    if old_day is not None and old_day in last_seen_day_counts:
+        last_seen_day_counts[old_day] -= 1
+        if last_seen_day_counts[old_day] <= 0:
+            del last_seen_day_counts[old_day]
+    if new_day is not None:
+        last_seen_day_counts[new_day] = last_seen_day_counts.get(new_day, 0) + 1
+
+def stats_record_command(user_id_str, count):
+    """Account one command and keep the bounded top-K current (counts only grow)."""
+    global total_command_count
+    total_command_count += 1
+    if user_id_str in top_command_users or len(top_command_users) < STATS_TOP_K:
+        top_command_users[user_id_str] = count
+        return
+    lowest = min(top_command_users, key=top_command_users.get)
+    if count > top_command_users[lowest]:
+        del top_command_users[lowest]
+        top_command_users[user_id_str] = count
+
+def rebuild_top_command_users():
+    top_command_users.clear()
+    top = heapq.nlargest(STATS_TOP_K, user_data.items(), key=lambda item: item[1].get('command_count', 0))
+    for uid, data in top:
+        top_command_users[uid] = data.get('command_count', 0)
+
+def rebuild_user_stats():
+    """Recompute all counters from user_data (startup only)."""
+    global total_command_count
+    total_command_count = sum(data.get('command_count', 0) for data in user_data.values())
+    last_seen_day_counts.clear()
+    for data in user_data.values():
+        stats_move_last_seen(None, data.get('last_seen'))
+    rebuild_top_command_users()
+
+def stats_forget_user(user_id_str, record):
+    """Remove a deleted user from the counters."""
+    global total_command_count
+    total_command_count -= record.get('command_count', 0)
+    stats_move_last_seen(record.get('last_seen'), None)
+    if user_id_str in top_command_users:
+        rebuild_top_command_users()
+
+def active_user_count(days):
+    """Users whose last_seen falls within the last ``days`` days (today included)."""
+    today = datetime.now().toordinal()
+    # Buckets older than the widest window can never count again
+    for day in [d for d in last_seen_day_counts if d <= today - max(STATS_WINDOWS)]:
+        del last_seen_day_counts[day]
+    return sum(count for day, count in last_seen_day_counts.items() if day > today - days)
+
+def get_top_command_users():
+    """[(user_id_str, command_count)] of the most active users, highest first."""
+    return sorted(top_command_users.items(), key=lambda item: item[1], reverse=True)
+
+# Secondary indexes for browsing users - sorted [(key, user_id_str)] lists
+USER_INDEX_FIELDS = ('last_seen', 'first_seen', 'command_count')
+USER_SORTS = {
+    # name: (short code used in callback data, indexed field, descending)
+    'recent': ('r', 'last_seen', True),
+    'new': ('n', 'first_seen', True),
+    'old': ('o', 'first_seen', False),
+    'active': ('a', 'command_count', True),
+}
+user_indexes = {field: [] for field in USER_INDEX_FIELDS}
+
+def user_index_key(field, value):
+    """Normalize an indexed value so every entry of an index compares cleanly.
+
+    Missing values sort as '' / 0, and last_seen is kept to the minute so a
+    user only moves in that index once a minute, not on every update.
+    """
+    if field == 'command_count':
+        return int(value or 0)
+    if field == 'last_seen':
+        return str(value or '')[:16]
+    return str(value or '')
+
+def index_insert(user_id_str, field, value):
+    bisect.insort(user_indexes[field], (user_index_key(field, value), user_id_str))
+
+def index_delete(user_id_str, field, value):
+    index = user_indexes[field]
+    entry = (user_index_key(field, value), user_id_str)
+    pos = bisect.bisect_left(index, entry)
+    if pos < len(index) and index[pos] == entry:
+        del index[pos]
+
+def index_move(user_id_str, field, old_value, new_value):
+    """Move a user's entry in one index, unless its normalized key stays the same."""
+    if user_index_key(field, old_value) == user_index_key(field, new_value):
+        return
+    index_delete(user_id_str, field, old_value)
+    index_insert(user_id_str, field, new_value)
+
+def index_add_user(user_id_str, record):
+    for field in USER_INDEX_FIELDS:
+        index_insert(user_id_str, field, record.get(field))
+
+def index_remove_user(user_id_str, record):
+    for field in USER_INDEX_FIELDS:
+        index_delete(user_id_str, field, record.get(field))
+
+def rebuild_user_indexes():
+    """Rebuild every index from user_data (startup only)."""
+    for field in USER_INDEX_FIELDS:
+        user_indexes[field] = sorted(
+            (user_index_key(field, data.get(field)), uid) for uid, data in user_data.items()
+        )
+
+def user_index_page(sort, cursor=None, direction='next', page_size=10, offset=0):
+    """Return (entries, start, total) for one page of users in ``sort`` order.
+
+    ``cursor`` is the (key, user_id) of the last (direction 'next') or first
+    (direction 'prev') entry of the neighbouring page, so pages stay stable
+    while users move around in the index. Without a cursor the page starts
+    at ``offset``.
+    """
+    _, field, descending = USER_SORTS[sort]
+    index = user_indexes[field]
+    total = len(index)
+    if cursor is None:
+        start = min(max(0, offset), total)
+    elif direction == 'next':
+        start = total - bisect.bisect_left(index, cursor) if descending else bisect.bisect_right(index, cursor)
+    else:
+        before = total - bisect.bisect_right(index, cursor) if descending else bisect.bisect_left(index, cursor)
+        start = max(0, before - page_size)
+    end = min(total, start + page_size)
+    if descending:
+        entries = [index[total - 1 - i] for i in range(start, end)]
+    else:
+        entries = index[start:end]
+    return entries, start, total
+
+def encode_user_cursor(entry):
+    return f"{entry[0]}|{entry[1]}"
+
+def decode_user_cursor(field, text):
+    key, uid = text.rsplit('|', 1)
+    return (user_index_key(field, key), uid)
+
+def render_users_page(sort='recent', cursor=None, direction='next', offset=0):
+    """Build the text and navigation keyboard of one /admin_users page."""
+    users_per_page = 10
+    code = USER_SORTS[sort][0]
+    entries, start, total = user_index_page(sort, cursor, direction, users_per_page, offset)
+    page = start // users_per_page + 1
+    total_pages = max(1, (total + users_per_page - 1) // users_per_page)
+    
+    users_text = (
+        f"👥 **All Users** (Page {page}/{total_pages}, sorted by {sort})\n"
+        "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
+    )
+    
+    for _, uid in entries:
+        data = user_data.get(uid, {})
+        username = data.get('username', 'N/A')
+        name = data.get('first_name', 'Unknown')
+        commands = data.get('command_count', 0)
+        last_seen = data.get('last_seen', 'N/A')
+        
+        # Escape special characters to avoid Markdown parsing errors
+        escaped_name = escape_markdown(str(name))
+        escaped_username = escape_markdown(str(username))
+        escaped_last_seen = escape_markdown(last_seen[:10] if len(last_seen) > 10 else str(last_seen))
+        
+        users_text += (
+            f"👤 **{escaped_name}**\n"
+            f"   ID: `{uid}`\n"
+            f"   Username: @{escaped_username}\n"
+            f"   Commands: {commands}\n"
+            f"   Last Seen: {escaped_last_seen}\n\n"
+        )
+    
+    users_text += f"━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+    users_text += f"💡 Use `/admin_users [recent|new|old|active] [page]` to jump to a page"
+    
+    nav = []
+    if entries and start > 0:
+        nav.append(InlineKeyboardButton("◀️ Prev", callback_data=f"admin_users:{code}:p:{encode_user_cursor(entries[0])}"))
+    if entries and start + len(entries) < total:
+        nav.append(InlineKeyboardButton("Next ▶️", callback_data=f"admin_users:{code}:n:{encode_user_cursor(entries[-1])}"))
+    sorts = [
+        InlineKeyboardButton(("• " if name == sort else "") + name.title(), callback_data=f"admin_users:{c}")
+        for name, (c, _, _) in USER_SORTS.items()
+    ]
+    reply_markup = InlineKeyboardMarkup([row for row in (nav, sorts) if row])
+    return users_text, reply_markup
+
+def delete_user(user_id_str):
+    """Delete a user's record and schedule the write."""
+    record = user_data.pop(user_id_str, None)
+    if record is not None:
+        stats_forget_user(user_id_str, record)
+        index_remove_user(user_id_str, record)
+        save_user(user_id_str)
 
 def track_user(user_id, username=None, first_name=None, last_name=None):
     """Track user when they interact with bot."""
@@ -291,22 +1804,40 @@ def track_user(user_id, username=None, first_name=None, last_name=None):
             'last_seen': datetime.now().isoformat(),
             'command_count': 0
         }
+        stats_move_last_seen(None, user_data[user_id_str]['last_seen'])
+        index_add_user(user_id_str, user_data[user_id_str])
+        save_user(user_id_str)
+        return
+    
+    record = user_data[user_id_str]
+    previous_last_seen = record.get('last_seen')
+    record['last_seen'] = datetime.now().isoformat()
+    stats_move_last_seen(previous_last_seen, record['last_seen'])
+    index_move(user_id_str, 'last_seen', previous_last_seen, record['last_seen'])
+    # Profile changes are rare and go to the store; last_seen only hits the journal
+    profile_changed = False
+    for field, value in (('username', username), ('first_name', first_name), ('last_name', last_name)):
+        if value and record.get(field) != value:
+            record[field] = value
+            profile_changed = True
+    if profile_changed:
+        save_user(user_id_str)
     else:
-        user_data[user_id_str]['last_seen'] = datetime.now().isoformat()
-        if username:
-            user_data[user_id_str]['username'] = username
-        if first_name:
-            user_data[user_id_str]['first_name'] = first_name
-        if last_name:
-            user_data[user_id_str]['last_name'] = last_name
-    save_user_data()
+        activity_journal.append('seen', user_id_str, seen=record['last_seen'])
 
 def increment_command_count(user_id):
     """Increment command usage count for user."""
     user_id_str = str(user_id)
     if user_id_str in user_data:
-        user_data[user_id_str]['command_count'] = user_data[user_id_str].get('command_count', 0) + 1
-        save_user_data()
+        count = user_data[user_id_str].get('command_count', 0) + 1
+        user_data[user_id_str]['command_count'] = count
+        stats_record_command(user_id_str, count)
+        index_move(user_id_str, 'command_count', count - 1, count)
+        activity_journal.append('cmd', user_id_str, count=count, at=datetime.now().isoformat())
+
+def save_user(user_id):
+    """Schedule a write of a single user's record (deletes it if the user is gone)."""
+    persistence.mark_dirty('users', user_id)
 
 def escape_markdown(text):
     """Escape special Markdown characters for Telegram."""
@@ -327,108 +1858,591 @@ def get_admin_contacts():
         if username and username != 'N/A':
             admin_contacts.append(f"@{username}")
         else:
-            # If no username, use user ID
-            admin_contacts.append(f"User ID: `{admin_id}`")
-    return admin_contacts
+            # If no username, use user ID
+            admin_contacts.append(f"User ID: `{admin_id}`")
+    return admin_contacts
+
+ADMIN_CONTACTS_TTL = int(os.getenv("ADMIN_CONTACTS_TTL", "3600"))  # seconds before resolved contacts go stale
+BLOCKED_REPLY_INTERVAL = int(os.getenv("BLOCKED_REPLY_INTERVAL", "600"))  # seconds between "you are blocked" replies per user
+admin_contacts_cache = {'contacts': None, 'fetched_at': 0.0}
+admin_contacts_refresh = None  # in-flight refresh task, shared by concurrent callers
+blocked_reply_times = {}  # user_id -> monotonic time of the last block notice
+
+async def resolve_admin_contact(bot, admin_id):
+    """Resolve one admin's contact line through the Bot API, falling back to user_data."""
+    admin_info = user_data.get(str(admin_id), {})
+    username = admin_info.get('username', None)
+    try:
+        user_chat = await bot.get_chat(admin_id)
+    except Exception as e:
+        # If API call fails, fall back to user_data
+        logger.warning(f"Could not fetch admin info for {admin_id}: {e}")
+        if username and username != 'N/A':
+            return f"@{username}"
+        return f"User ID: `{admin_id}`"
+    if user_chat.username:
+        return f"@{user_chat.username}"
+    if username and username != 'N/A':
+        return f"@{username}"
+    name = user_chat.first_name or "Admin"
+    return f"{name} (ID: `{admin_id}`)"
+
+async def refresh_admin_contacts(bot):
+    """Resolve all admin contacts and store them in the cache."""
+    admin_ids = list(ADMIN_IDS)
+    contacts = await asyncio.gather(*(resolve_admin_contact(bot, admin_id) for admin_id in admin_ids))
+    admin_contacts_cache['contacts'] = list(contacts)
+    # If the admin list changed mid-refresh, leave the entry stale so the next reader refreshes again
+    admin_contacts_cache['fetched_at'] = time.monotonic() if admin_ids == ADMIN_IDS else float('-inf')
+    return admin_contacts_cache['contacts']
+
+def start_admin_contacts_refresh(bot):
+    """Start a cache refresh unless one is already running; return the task."""
+    global admin_contacts_refresh
+    if admin_contacts_refresh is None or admin_contacts_refresh.done():
+        admin_contacts_refresh = asyncio.create_task(refresh_admin_contacts(bot))
+    return admin_contacts_refresh
+
+async def get_admin_contacts_async(context):
+    """Get admin contact lines, served from a TTL cache.
+
+    Stale entries are returned immediately while a refresh runs in the
+    background; only the very first call waits for the Bot API.
+    """
+    contacts = admin_contacts_cache['contacts']
+    if contacts is None:
+        try:
+            return await asyncio.shield(start_admin_contacts_refresh(context.bot))
+        except Exception as e:
+            logger.warning(f"Error resolving admin contacts: {e}")
+            return get_admin_contacts()
+    if time.monotonic() - admin_contacts_cache['fetched_at'] > ADMIN_CONTACTS_TTL:
+        start_admin_contacts_refresh(context.bot)
+    return contacts
+
+def admin_contact_text(admin_contacts):
+    """Build the 'Contact Admin' section appended to block notices."""
+    if not admin_contacts:
+        return "\n\nIf you believe this is an error, please contact the bot administrator."
+    contact_text = "\n\n**Contact Admin:**\n"
+    for contact in admin_contacts:
+        contact_text += f"• {contact}\n"
+    return contact_text
+
+def should_send_blocked_reply(user_id):
+    """Rate-limit the block notice to one per BLOCKED_REPLY_INTERVAL per user."""
+    now = time.monotonic()
+    last = blocked_reply_times.get(user_id)
+    if last is not None and now - last < BLOCKED_REPLY_INTERVAL:
+        return False
+    if len(blocked_reply_times) > 10000:
+        # Forget users whose window has expired so the table stays small
+        for uid, sent_at in list(blocked_reply_times.items()):
+            if now - sent_at >= BLOCKED_REPLY_INTERVAL:
+                del blocked_reply_times[uid]
+    blocked_reply_times[user_id] = now
+    return True
+
+# Admin check function
+def is_admin(user_id):
+    """Check if user is admin."""
+    return user_id in ADMIN_IDS
+
+async def admin_only(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Check if user is admin."""
+    user = update.effective_user
+    if not user or not is_admin(user.id):
+        await update.message.reply_text(
+            "❌ **Access Denied**\n\n"
+            "🔒 This command is only available for administrators.",
+            parse_mode='Markdown'
+        )
+        return False
+    return True
+
+async def check_user_blocked(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Check if user is blocked and return True if blocked, False if not."""
+    user = update.effective_user
+    if not user:
+        return False
+    
+    user_id = user.id
+    if is_user_blocked(user_id):
+        if not should_send_blocked_reply(user_id):
+            return True
+        admin_contacts = await get_admin_contacts_async(context)
+        contact_text = admin_contact_text(admin_contacts)
+        
+        try:
+            await update.effective_message.reply_text(
+                f"🚫 **Access Denied**\n\n"
+                f"❌ You have been blocked from using this bot.{contact_text}",
+                parse_mode='Markdown'
+            )
+        except Exception as e:
+            logger.warning(f"Could not send block message: {e}")
+        
+        return True
+    return False
+
+def is_command_update(update: Update):
+    """True for a message that invokes a bot command."""
+    message = update.message
+    return bool(message and message.text and message.text.startswith('/'))
+
+def is_unordered_command_update(update: Update):
+    """True for commands that skip per-user ordering: heavy jobs and /cancel."""
+    if not is_command_update(update):
+        return False
+    command = update.message.text.split(maxsplit=1)[0][1:].split('@')[0].lower()
+    return command in heavy_commands or command == 'cancel'
+
+async def activity_middleware(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs before every handler: rejects blocked users and records activity once per update."""
+    user = update.effective_user
+    if not user or not (update.message or update.edited_message or update.callback_query):
+        return
+    
+    if is_user_blocked(user.id):
+        await check_user_blocked(update, context)
+        raise ApplicationHandlerStop
+    
+    # Persistence is batched by the journal / write-behind layer
+    track_user(user.id, username=user.username, first_name=user.first_name, last_name=user.last_name)
+    if is_command_update(update):
+        increment_command_count(user.id)
+
+# Concurrent update processing - updates run in parallel up to a global cap, but
+# updates from the same user are processed one after another, in arrival order
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently while keeping each user's updates sequential."""
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self.user_locks = {}  # user/chat id -> [asyncio.Lock, number of updates holding or waiting]
+
+    async def process_update(self, update, coroutine):
+        # The per-user lock is taken before a global slot, so a user with a queue
+        # of pending updates waits on their own lock without starving everyone else.
+        # PTB marks process_update @final and expects subclasses to override only
+        # do_process_update, but a lock taken there would be waited on while holding
+        # a global slot. This relies on process_update being the entry point that
+        # wraps do_process_update in the semaphore; python-telegram-bot is pinned in
+        # requirements.txt for that reason - recheck this before raising the pin.
+        key = None
+        if isinstance(update, Update):
+            if update.effective_user:
+                key = update.effective_user.id
+            elif update.effective_chat:
+                key = update.effective_chat.id
+        if key is None or is_unordered_command_update(update):
+            # Heavy commands are queued as jobs instead, so a refusal or queue position
+            # is sent at once rather than after the user's earlier jobs; /cancel must
+            # not wait behind the job it cancels
+            await super().process_update(update, coroutine)
+            return
+        entry = self.user_locks.get(key)
+        if entry is None:
+            entry = self.user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.user_locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+# Heavy commands (downloads, cloning, AI generation, conversions) run as jobs.
+# Admission: per-user rate and in-flight limits plus a global cap on running and
+# queued jobs; requests over a limit get an immediate "busy" reply. Admitted jobs
+# wait in a priority queue, see their position and progress in one status message,
+# and can be stopped with /cancel.
+HEAVY_MAX_ACTIVE = int(os.getenv("HEAVY_MAX_ACTIVE", "8"))  # heavy jobs running at once
+HEAVY_MAX_QUEUE = int(os.getenv("HEAVY_MAX_QUEUE", "24"))  # heavy jobs waiting for a slot
+HEAVY_MAX_PER_USER = int(os.getenv("HEAVY_MAX_PER_USER", "2"))  # heavy jobs in flight per user
+HEAVY_USER_RATE = float(os.getenv("HEAVY_USER_RATE", "6"))  # heavy jobs per user per minute
+HEAVY_USER_BURST = int(os.getenv("HEAVY_USER_BURST", "3"))
+JOB_STATUS_INTERVAL = 3  # seconds between progress edits of a job's status message
+PRIORITY_INTERACTIVE = 0  # short conversions the user is waiting for
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2  # long downloads and crawls
+heavy_commands = set()  # command names with a heavy handler (filled in when handlers are registered)
+current_job = contextvars.ContextVar('current_job', default=None)
+
+class JobCancelled(Exception):
+    """Raised in worker code when the job it works for was cancelled."""
+
+class Job:
+    """One admitted heavy command: queue state, status message and cancellation handles."""
+
+    def __init__(self, job_id, user_id, name, priority, message):
+        self.id = job_id
+        self.user_id = user_id
+        self.name = name
+        self.priority = priority
+        self.message = message  # the user's message that started the job
+        self.state = 'queued'  # queued -> running -> done, or cancelled
+        self.position = None
+        self.progress = None  # written by worker code, shown in the status message
+        self.shown = None
+        self.status_message = None
+        self.status_lock = asyncio.Lock()
+        self.cancel_event = threading.Event()  # checked by worker threads
+        self.processes = []  # subprocesses to kill when the job is stopped
+        self.task = None
+        self.slot = None  # future resolved when a queued job is given a slot
+
+    def stop_work(self):
+        """Tell worker code to give up and kill the job's subprocesses."""
+        self.cancel_event.set()
+        for process in list(self.processes):
+            try:
+                process.kill()
+            except Exception:
+                pass
+
+    def status_text(self):
+        label = f"`/{self.name}` job #{self.id}"
+        if self.state == 'queued':
+            return (
+                f"⏳ **Queued** - {label}, position {self.position}\n\n"
+                f"It will start automatically. Use `/cancel {self.id}` to cancel it."
+            )
+        if self.state == 'running' and self.progress:
+            return f"⚙️ **Working** - {label}\n{self.progress}\n\nUse `/cancel {self.id}` to stop it."
+        if self.state == 'cancelled':
+            return f"🛑 **Cancelled** - {label}"
+        return None
+
+    async def show_status(self):
+        """Send or edit the job's status message when its text changed."""
+        async with self.status_lock:
+            text = self.status_text()
+            if not text or text == self.shown:
+                return
+            self.shown = text
+            try:
+                if self.status_message is None:
+                    self.status_message = await self.message.reply_text(text, parse_mode='Markdown')
+                else:
+                    await self.status_message.edit_text(text, parse_mode='Markdown')
+            except Exception as e:
+                logger.debug(f"Could not update status of job {self.id}: {e}")
+
+    async def follow_progress(self):
+        """Mirror progress reported by worker code into the status message."""
+        while True:
+            await asyncio.sleep(JOB_STATUS_INTERVAL)
+            await self.show_status()
+
+    async def finish(self):
+        """Leave a note on cancelled jobs, remove the status message of finished ones."""
+        if self.status_message is None:
+            return
+        if self.state == 'cancelled':
+            await self.show_status()
+        else:
+            try:
+                await self.status_message.delete()
+            except Exception:
+                pass
+
+class HeavyJobQueue:
+    """Admission control and priority scheduling of heavy jobs."""
+
+    def __init__(self, max_active, max_queue, max_per_user, user_rate, user_burst):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.user_rate = user_rate / 60.0  # tokens per second
+        self.user_burst = user_burst
+        self.queue = []  # heap of (priority, job id, job); cancelled entries are skipped
+        self.jobs = {}  # job id -> Job, queued or running
+        self.next_id = 1
+        self.in_flight = 0  # admitted jobs, running or waiting for a slot
+        self.active = 0
+        self.user_jobs = {}  # user_id -> heavy jobs admitted and not finished
+        self.user_tokens = {}  # user_id -> (tokens, monotonic time of last update)
+        self.admitted = 0
+        self.refused = 0
+        self.cancelled = 0
+
+    @property
+    def waiting(self):
+        return sum(1 for job in self.jobs.values() if job.state == 'queued')
+
+    def take_user_token(self, user_id):
+        """Per-user token bucket; returns False when the user is over their rate."""
+        now = time.monotonic()
+        tokens, updated = self.user_tokens.get(user_id, (self.user_burst, now))
+        tokens = min(self.user_burst, tokens + (now - updated) * self.user_rate)
+        if tokens < 1:
+            self.user_tokens[user_id] = (tokens, now)
+            return False
+        if len(self.user_tokens) > 10000:
+            # Full buckets carry no information, forget them
+            refill = self.user_burst / self.user_rate
+            for uid, (_, at) in list(self.user_tokens.items()):
+                if now - at >= refill:
+                    del self.user_tokens[uid]
+        self.user_tokens[user_id] = (tokens - 1, now)
+        return True
+
+    def admit(self, user_id):
+        """Reserve a place for a job; returns None, or the reason it was refused."""
+        running = self.user_jobs.get(user_id, 0)
+        if running >= self.max_per_user:
+            reason = f"⏳ You already have {running} heavy jobs in progress. Please wait for them to finish."
+        elif self.in_flight >= self.max_active + self.max_queue:
+            reason = "🚦 The bot is very busy right now. Please try again in a few minutes."
+        elif not self.take_user_token(user_id):
+            reason = "🐢 You're sending heavy requests too fast. Please wait a minute and try again."
+        else:
+            self.user_jobs[user_id] = running + 1
+            self.in_flight += 1
+            self.admitted += 1
+            return None
+        self.refused += 1
+        return reason
 
-async def get_admin_contacts_async(context):
-    """Get admin usernames for contact information (async version with bot context)."""
-    admin_contacts = []
-    for admin_id in ADMIN_IDS:
+    def create_job(self, user_id, name, priority, message):
+        job = Job(self.next_id, user_id, name, priority, message)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        return job
+
+    def refresh_positions(self):
+        """Tell queued jobs whose place in the queue changed."""
+        queued = sorted(entry for entry in self.queue if entry[2].state == 'queued')
+        for position, (_, _, job) in enumerate(queued, 1):
+            if job.position != position:
+                job.position = position
+                start_background_task(job.show_status())
+
+    def release_slot(self):
+        """Hand a freed slot to the highest-priority queued job."""
+        self.active -= 1
+        while self.queue and self.active < self.max_active:
+            _, _, job = heapq.heappop(self.queue)
+            if job.state != 'queued' or job.slot.done():
+                continue
+            self.active += 1
+            job.slot.set_result(True)
+        self.refresh_positions()
+
+    async def run(self, job, func, *args):
+        """Run an admitted job once a slot is free; returns None if it was cancelled."""
         try:
-            # Try to get user info from Telegram API
-            user_chat = await context.bot.get_chat(admin_id)
-            if user_chat.username:
-                admin_contacts.append(f"@{user_chat.username}")
+            if self.active >= self.max_active:
+                job.slot = asyncio.get_running_loop().create_future()
+                heapq.heappush(self.queue, (job.priority, job.id, job))
+                self.refresh_positions()
+                try:
+                    await job.slot
+                except asyncio.CancelledError:
+                    if job.slot.done() and not job.slot.cancelled():
+                        self.release_slot()  # the slot arrived together with the cancel
+                    raise
             else:
-                # If no username, try to get from user_data or show name
-                admin_info = user_data.get(str(admin_id), {})
-                username = admin_info.get('username', None)
-                if username and username != 'N/A' and username:
-                    admin_contacts.append(f"@{username}")
-                else:
-                    name = user_chat.first_name or "Admin"
-                    admin_contacts.append(f"{name} (ID: `{admin_id}`)")
-        except Exception as e:
-            # If API call fails, fall back to user_data
-            logger.warning(f"Could not fetch admin info for {admin_id}: {e}")
-            admin_info = user_data.get(str(admin_id), {})
-            username = admin_info.get('username', None)
-            if username and username != 'N/A' and username:
-                admin_contacts.append(f"@{username}")
+                self.active += 1
+            job.state = 'running'
+            token = current_job.set(job)
+            progress_task = asyncio.create_task(job.follow_progress())
+            try:
+                job.task = asyncio.create_task(func(*args))
+                return await job.task
+            finally:
+                progress_task.cancel()
+                current_job.reset(token)
+                self.release_slot()
+        except asyncio.CancelledError:
+            if job.state != 'cancelled':
+                raise
+            return None
+        finally:
+            if job.state != 'cancelled':
+                job.state = 'done'
+            self.jobs.pop(job.id, None)
+            self.in_flight -= 1
+            remaining = self.user_jobs.get(job.user_id, 1) - 1
+            if remaining > 0:
+                self.user_jobs[job.user_id] = remaining
             else:
-                admin_contacts.append(f"User ID: `{admin_id}`")
-    return admin_contacts
+                self.user_jobs.pop(job.user_id, None)
+            start_background_task(job.finish())
 
-# Admin check function
-def is_admin(user_id):
-    """Check if user is admin."""
-    return user_id in ADMIN_IDS
+    def cancel(self, job):
+        """Cancel a queued or running job; its slot goes to the next job at once."""
+        if job.state not in ('queued', 'running'):
+            return False
+        was_running = job.state == 'running'
+        job.state = 'cancelled'
+        job.stop_work()
+        if was_running:
+            job.task.cancel()
+        else:
+            job.slot.cancel()
+            self.refresh_positions()
+        self.cancelled += 1
+        logger.info(f"Cancelled job #{job.id} (/{job.name}) of user {job.user_id}")
+        return True
 
-async def admin_only(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Check if user is admin."""
-    user = update.effective_user
-    if not user or not is_admin(user.id):
-        await update.message.reply_text(
-            "❌ **Access Denied**\n\n"
-            "🔒 This command is only available for administrators.",
-            parse_mode='Markdown'
-        )
-        return False
-    return True
+    def cancel_user_jobs(self, user_id, job_id=None):
+        """Cancel the user's jobs (or just job_id); returns the cancelled jobs."""
+        cancelled = []
+        for job in list(self.jobs.values()):
+            if job.user_id == user_id and (job_id is None or job.id == job_id) and self.cancel(job):
+                cancelled.append(job)
+        return cancelled
 
-async def check_user_blocked(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Check if user is blocked and return True if blocked, False if not."""
+heavy_jobs = HeavyJobQueue(HEAVY_MAX_ACTIVE, HEAVY_MAX_QUEUE, HEAVY_MAX_PER_USER, HEAVY_USER_RATE, HEAVY_USER_BURST)
+
+def check_cancelled():
+    """Raise JobCancelled if the job this code works for was stopped (call at safe points)."""
+    job = current_job.get()
+    if job is not None and job.cancel_event.is_set():
+        raise JobCancelled(f"Job #{job.id} was cancelled")
+
+def run_job_subprocess(cmd, timeout=None, **kwargs):
+    """Like subprocess.run(), but the current job can kill the process when cancelled."""
+    process = subprocess.Popen(cmd, **kwargs)
+    job = current_job.get()
+    if job is not None:
+        job.processes.append(process)
+        if job.cancel_event.is_set():
+            process.kill()
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        raise
+    finally:
+        if job is not None:
+            job.processes.remove(process)
+    check_cancelled()
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+def job_progress_hook(d):
+    """yt-dlp progress hook: reports download progress and aborts cancelled jobs."""
+    job = current_job.get()
+    if job is None:
+        return
+    if job.cancel_event.is_set():
+        raise DownloadCancelled(f"Job #{job.id} was cancelled")
+    if d['status'] == 'downloading':
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        downloaded_mb = d.get('downloaded_bytes', 0) / (1024 * 1024)
+        if total:
+            job.progress = f"⬇️ Downloading: {downloaded_mb * 1024 * 1024 / total * 100:.0f}% ({downloaded_mb:.1f}/{total / (1024 * 1024):.1f} MB)"
+        else:
+            job.progress = f"⬇️ Downloading: {downloaded_mb:.1f} MB"
+    elif d['status'] == 'finished':
+        job.progress = "📦 Download finished, processing..."
+
+if ProgressBarLogger is not None:
+    class JobMoviePyLogger(ProgressBarLogger):
+        """MoviePy logger that reports progress to a job and aborts it when cancelled."""
+
+        def __init__(self, job):
+            super().__init__()
+            self.job = job
+
+        def bars_callback(self, bar, attr, value, old_value=None):
+            if self.job.cancel_event.is_set():
+                raise JobCancelled(f"Job #{self.job.id} was cancelled")
+            total = self.bars[bar].get('total')
+            if attr == 'index' and total:
+                self.job.progress = f"🎵 Converting: {value / total * 100:.0f}%"
+
+def job_moviepy_logger():
+    """MoviePy logger for the current job (None outside a job, which silences MoviePy)."""
+    job = current_job.get()
+    if job is None or ProgressBarLogger is None:
+        return None
+    return JobMoviePyLogger(job)
+
+def has_job_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """False for bare invocations that only print usage help."""
+    message = update.effective_message
+    return bool(
+        context.args or message.reply_to_message or message.photo or message.video
+        or message.document or message.audio or message.voice or message.video_note
+    )
+
+def heavy_command(priority):
+    """Decorator for heavy handlers: runs them as queued, cancellable jobs."""
+    def decorator(func):
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            user = update.effective_user
+            message = update.effective_message
+            if not user or not message or not has_job_input(update, context):
+                return await func(update, context)
+            
+            refusal = heavy_jobs.admit(user.id)
+            if refusal:
+                await message.reply_text(refusal)
+                return
+            
+            text = message.text or message.caption or ''
+            if text.startswith('/'):
+                name = text.split(maxsplit=1)[0][1:].split('@')[0].lower()
+            else:
+                name = func.__name__.replace('_command', '')
+            job = heavy_jobs.create_job(user.id, name, priority, message)
+            return await heavy_jobs.run(job, func, update, context)
+        wrapper.heavy = True
+        return wrapper
+    return decorator
+
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancel the user's queued or running jobs: /cancel [job_id]."""
     user = update.effective_user
     if not user:
-        return False
+        return
     
-    user_id = user.id
-    if is_user_blocked(user_id):
-        try:
-            admin_contacts = await get_admin_contacts_async(context)
-            contact_text = ""
-            if admin_contacts:
-                contact_text = "\n\n**Contact Admin:**\n"
-                for contact in admin_contacts:
-                    contact_text += f"• {contact}\n"
-            else:
-                contact_text = "\n\nIf you believe this is an error, please contact the bot administrator."
-        except Exception as e:
-            logger.warning(f"Error getting admin contacts: {e}")
-            admin_contacts = get_admin_contacts()
-            contact_text = ""
-            if admin_contacts:
-                contact_text = "\n\n**Contact Admin:**\n"
-                for contact in admin_contacts:
-                    contact_text += f"• {contact}\n"
-            else:
-                contact_text = "\n\nIf you believe this is an error, please contact the bot administrator."
-        
+    job_id = None
+    if context.args:
         try:
-            await update.message.reply_text(
-                f"🚫 **Access Denied**\n\n"
-                f"❌ You have been blocked from using this bot.{contact_text}",
-                parse_mode='Markdown'
-            )
-        except Exception as e:
-            logger.warning(f"Could not send block message: {e}")
-        
-        return True
-    return False
-
-def block_check_decorator(func):
-    """Decorator to add block check to command functions."""
-    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if await check_user_blocked(update, context):
+            job_id = int(context.args[0].lstrip('#'))
+        except ValueError:
+            await update.message.reply_text("❌ Usage: `/cancel` or `/cancel <job_id>`", parse_mode='Markdown')
             return
-        return await func(update, context)
-    return wrapper
+    
+    cancelled = heavy_jobs.cancel_user_jobs(user.id, job_id)
+    if not cancelled:
+        if job_id is None:
+            await update.message.reply_text("ℹ️ You have no running or queued jobs.")
+        else:
+            await update.message.reply_text(f"ℹ️ You have no running or queued job #{job_id}.")
+        return
+    
+    jobs_text = ", ".join(f"#{job.id} (/{job.name})" for job in cancelled)
+    await update.message.reply_text(f"🛑 Cancelled {len(cancelled)} job(s): {jobs_text}")
 
 # Blocked users management functions
 def load_blocked_users():
     """Load blocked users from JSON file."""
     global blocked_users
+    if storage is not None:
+        try:
+            blocked_users = set(storage.load('blocked_users'))
+        except Exception as e:
+            logger.error(f"Error loading blocked users: {e}")
+            blocked_users = set()
+        return
     if os.path.exists(BLOCKED_USERS_FILE):
         try:
             with open(BLOCKED_USERS_FILE, 'r', encoding='utf-8') as f:
@@ -441,41 +2455,47 @@ def load_blocked_users():
         blocked_users = set()
 
 def save_blocked_users():
-    """Save blocked users to JSON file."""
-    try:
-        with open(BLOCKED_USERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(list(blocked_users), f, indent=2)
-    except Exception as e:
-        logger.error(f"Error saving blocked users: {e}")
+    """Schedule a write of the blocked users list."""
+    persistence.mark_dirty('blocked_users')
 
 def is_user_blocked(user_id):
     """Check if user is blocked."""
     return str(user_id) in blocked_users
 
+def save_blocked_user(user_id):
+    """Schedule a write of the blocked state of a single user."""
+    persistence.mark_dirty('blocked_users', user_id)
+
 def block_user(user_id):
     """Block a user."""
     blocked_users.add(str(user_id))
-    save_blocked_users()
+    blocked_reply_times.pop(int(user_id), None)
+    save_blocked_user(user_id)
 
 def unblock_user(user_id):
     """Unblock a user."""
     blocked_users.discard(str(user_id))
-    save_blocked_users()
+    blocked_reply_times.pop(int(user_id), None)
+    save_blocked_user(user_id)
 
 # Load user data and blocked users on startup
+init_storage()
+register_persistent_stores()
 load_user_data()
+replay_activity_journal()
+rebuild_user_stats()
+rebuild_user_indexes()
 load_blocked_users()
 load_alarms()
-
-# Referral system storage
-REFERRAL_DATA_FILE = "referrals.json"
-referral_data = {}
+load_price_alerts()
 
 def load_referral_data():
     """Load referral data from file."""
     global referral_data
     try:
-        if os.path.exists(REFERRAL_DATA_FILE):
+        if storage is not None:
+            referral_data = storage.load('referrals')
+        elif os.path.exists(REFERRAL_DATA_FILE):
             with open(REFERRAL_DATA_FILE, 'r', encoding='utf-8') as f:
                 referral_data = json.load(f)
         else:
@@ -483,20 +2503,52 @@ def load_referral_data():
     except Exception as e:
         logger.warning(f"Error loading referral data: {e}")
         referral_data = {}
+    build_referral_code_index()
 
 def save_referral_data():
-    """Save referral data to file."""
-    try:
-        with open(REFERRAL_DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(referral_data, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        logger.error(f"Error saving referral data: {e}")
+    """Schedule a write of all referral data."""
+    persistence.mark_dirty('referrals')
+
+def save_referral(user_id):
+    """Schedule a write of the referral entry of a single user."""
+    persistence.mark_dirty('referrals', user_id)
+
+def unique_referral_code(user_id):
+    """Return the short REFxxxx code for a user, or REF<user_id> if it is taken."""
+    code = f"REF{user_id % 10000:04d}"
+    owner = referral_code_index.get(code)
+    if owner is None or owner == str(user_id):
+        return code
+    # user_id % 10000 collides once there are more than 10k users; the full ID cannot
+    return f"REF{user_id}"
+
+def build_referral_code_index():
+    """Rebuild the code -> user_id index, re-issuing codes that collide."""
+    referral_code_index.clear()
+    collisions = []
+    for uid, data in referral_data.items():
+        code = str(data.get('code', '')).upper().strip()
+        if not code:
+            continue
+        if code in referral_code_index:
+            collisions.append(uid)
+        else:
+            referral_code_index[code] = uid
+    # The first owner keeps the code, as with the old linear scan
+    for uid in collisions:
+        old_code = referral_data[uid].get('code')
+        new_code = f"REF{uid}"
+        referral_data[uid]['code'] = new_code
+        referral_code_index[new_code] = uid
+        save_referral(uid)
+        logger.warning(f"Referral code {old_code} of user {uid} is already used by user "
+                       f"{referral_code_index.get(str(old_code).upper().strip())}; re-issued as {new_code}")
 
 def generate_referral_code(user_id, user_name=None):
     """Generate or get referral code for user."""
     if str(user_id) not in referral_data:
         # Generate uppercase code
-        code = f"REF{user_id % 10000:04d}".upper()
+        code = unique_referral_code(user_id).upper()
         referral_data[str(user_id)] = {
             'code': code,
             'referrals': [],
@@ -504,18 +2556,20 @@ def generate_referral_code(user_id, user_name=None):
             'joined_at': datetime.now().isoformat(),
             'name': user_name or f"User{user_id % 10000}"
         }
-        save_referral_data()
+        referral_code_index[code] = str(user_id)
+        save_referral(user_id)
         logger.info(f"Generated referral code {code} for user {user_id}")
     elif user_name and referral_data[str(user_id)].get('name') != user_name:
         # Update name if provided and different
         referral_data[str(user_id)]['name'] = user_name
-        save_referral_data()
+        save_referral(user_id)
     
     # Ensure code is uppercase
     code = referral_data[str(user_id)]['code'].upper()
     if referral_data[str(user_id)]['code'] != code:
         referral_data[str(user_id)]['code'] = code
-        save_referral_data()
+        save_referral(user_id)
+    referral_code_index.setdefault(code, str(user_id))
     
     return code
 
@@ -527,18 +2581,13 @@ async def add_referral(context, referrer_code, new_user_id, new_user_name):
         
         logger.info(f"Looking for referral code: {referrer_code} for user {new_user_id}")
         
-        # Find referrer by code (case-insensitive comparison)
-        referrer_id = None
-        for uid, data in referral_data.items():
-            stored_code = data.get('code', '').upper().strip()
-            if stored_code == referrer_code:
-                referrer_id = uid
-                logger.info(f"Found referrer {referrer_id} for code {referrer_code}")
-                break
+        # Find referrer by code (index keys are uppercase)
+        referrer_id = referral_code_index.get(referrer_code)
         
         if not referrer_id:
-            logger.warning(f"Referral code '{referrer_code}' not found in referral_data. Available codes: {[data.get('code') for data in referral_data.values()]}")
+            logger.warning(f"Referral code '{referrer_code}' not found in referral_data")
             return False
+        logger.info(f"Found referrer {referrer_id} for code {referrer_code}")
         
         if str(new_user_id) == referrer_id:
             logger.info(f"User {new_user_id} tried to use their own referral code")
@@ -562,7 +2611,7 @@ async def add_referral(context, referrer_code, new_user_id, new_user_name):
             actual_count = len(referrals_list)
             if referral_data[referrer_id].get('total_referrals', 0) != actual_count:
                 referral_data[referrer_id]['total_referrals'] = actual_count
-                save_referral_data()
+                save_referral(referrer_id)
             return False
         
         # Add to referrer's list
@@ -574,14 +2623,14 @@ async def add_referral(context, referrer_code, new_user_id, new_user_name):
         referral_data[referrer_id]['total_referrals'] = new_total
         
         # Force save immediately
-        save_referral_data()
+        save_referral(referrer_id)
         
         # Verify the save was successful
         if referral_data[referrer_id]['total_referrals'] != new_total:
             logger.error(f"Count mismatch after save! Expected {new_total}, got {referral_data[referrer_id]['total_referrals']}")
             # Force correct it
             referral_data[referrer_id]['total_referrals'] = new_total
-            save_referral_data()
+            save_referral(referrer_id)
         
         logger.info(f"Added referral: User {new_user_id} added to referrer {referrer_id}'s list. Total referrals: {new_total} (List length: {len(referrals_list)})")
         
@@ -618,72 +2667,65 @@ async def add_referral(context, referrer_code, new_user_id, new_user_name):
 # Load referral data on startup
 load_referral_data()
 
-async def check_channel_membership(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Check if user is a member of the required channel."""
+MEMBER_STATUSES = ('member', 'administrator', 'creator')
+MEMBERSHIP_MEMBER_TTL = int(os.getenv("MEMBERSHIP_MEMBER_TTL", "21600"))  # seconds a confirmed member is trusted
+MEMBERSHIP_NON_MEMBER_TTL = int(os.getenv("MEMBERSHIP_NON_MEMBER_TTL", "60"))  # seconds a negative answer is trusted
+membership_cache = {}  # user_id -> (is_member, expires_at monotonic)
+
+def cache_membership(user_id, is_member):
+    """Remember a user's channel membership for the TTL matching the answer."""
+    now = time.monotonic()
+    if len(membership_cache) > 50000:
+        for uid, (_, expires_at) in list(membership_cache.items()):
+            if expires_at <= now:
+                del membership_cache[uid]
+    ttl = MEMBERSHIP_MEMBER_TTL if is_member else MEMBERSHIP_NON_MEMBER_TTL
+    membership_cache[user_id] = (is_member, now + ttl)
+
+async def check_channel_membership(update: Update, context: ContextTypes.DEFAULT_TYPE, recheck_non_member=False):
+    """Check if user is a member of the required channel.
+
+    Answers are cached per user; pass recheck_non_member=True to skip a
+    cached negative (e.g. right after the user says they joined).
+    """
     user = update.effective_user
     if not user:
         return False
     
+    cached = membership_cache.get(user.id)
+    if cached and cached[1] > time.monotonic() and (cached[0] or not recheck_non_member):
+        return cached[0]
+    
     try:
         # Check if user is member of the channel
         member = await context.bot.get_chat_member(REQUIRED_CHANNEL, user.id)
-        # Member status can be: member, administrator, creator, left, kicked, restricted
-        if member.status in ['member', 'administrator', 'creator']:
-            return True
     except Exception as e:
         # If bot is not admin or channel doesn't exist, we can't check
         # For now, we'll allow access but log the error
         logger.warning(f"Could not check channel membership: {e}")
-        # In production, you might want to return False here
-        # For now, return True to allow access if check fails
+        # Remember the fallback briefly so a broken check doesn't cost a call per message
+        membership_cache[user.id] = (True, time.monotonic() + MEMBERSHIP_NON_MEMBER_TTL)
         return True
     
-    return False
+    # Member status can be: member, administrator, creator, left, kicked, restricted
+    is_member = member.status in MEMBER_STATUSES
+    cache_membership(user.id, is_member)
+    return is_member
+
+async def channel_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Keep the membership cache in sync with join/leave events from the required channel."""
+    change = update.chat_member
+    if not change or not change.chat.username:
+        return
+    if change.chat.username.lower() != REQUIRED_CHANNEL.lstrip('@').lower():
+        return
+    cache_membership(change.new_chat_member.user.id, change.new_chat_member.status in MEMBER_STATUSES)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /start is issued."""
     user = update.effective_user
     user_id = user.id if user else None
     
-    # Check if user is blocked
-    if user_id and is_user_blocked(user_id):
-        try:
-            admin_contacts = await get_admin_contacts_async(context)
-            contact_text = ""
-            if admin_contacts:
-                contact_text = "\n\n**Contact Admin:**\n"
-                for contact in admin_contacts:
-                    contact_text += f"• {contact}\n"
-            else:
-                contact_text = "\n\nIf you believe this is an error, please contact the bot administrator."
-        except Exception as e:
-            logger.warning(f"Error getting admin contacts: {e}")
-            # Fallback to simple function
-            admin_contacts = get_admin_contacts()
-            contact_text = ""
-            if admin_contacts:
-                contact_text = "\n\n**Contact Admin:**\n"
-                for contact in admin_contacts:
-                    contact_text += f"• {contact}\n"
-            else:
-                contact_text = "\n\nIf you believe this is an error, please contact the bot administrator."
-        
-        await update.message.reply_text(
-            f"🚫 **Access Denied**\n\n"
-            f"❌ You have been blocked from using this bot.{contact_text}",
-            parse_mode='Markdown'
-        )
-        return
-    
-    # Track user
-    if user_id:
-        track_user(
-            user_id,
-            username=user.username,
-            first_name=user.first_name,
-            last_name=user.last_name
-        )
-    
     # Check if user has joined the required channel
     is_member = await check_channel_membership(update, context)
     
@@ -850,7 +2892,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         '   └─ `/crypto <coin>` - Get cryptocurrency price\n'
         '   └─ `/crypto <coin> <currency>` - Price in specific currency\n'
         '   └─ Example: `/crypto bitcoin` or `/crypto btc inr`\n'
-        '   └─ Shows price, 24h change, market cap, volume\n\n'
+        '   └─ Shows price, 24h change, market cap, volume\n'
+        '   └─ `/pricealert <coin> <above|below> <value>` - Price alert\n'
+        '   └─ `/pricealerts` - List alerts, `/delpricealert <id>` - Delete one\n\n'
         '✨ **Image Enhancement**\n'
         '   └─ `/enhance` - Professional AI-style enhancement\n'
         '   └─ Remini-style quality boost\n\n'
@@ -971,7 +3015,7 @@ async def check_join_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = user.id if user else None
     
     # Check if user has joined the channel
-    is_member = await check_channel_membership(update, context)
+    is_member = await check_channel_membership(update, context, recheck_non_member=True)
     
     if is_member:
         # User has joined, show welcome message
@@ -1187,10 +3231,6 @@ async def check_join_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /help is issued."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     # Split help into multiple shorter messages to avoid Telegram's 4096 char limit
     help_part1 = (
         '🤖 *Bot Commands & Features*\n\n'
@@ -1202,6 +3242,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         '• /alarm <time> [message] - Set an alarm\n'
         '• /alarms - List all your alarms\n'
         '• /deletealarm <id> - Delete an alarm\n'
+        '• /cancel [job_id] - Cancel your running or queued downloads/conversions\n'
         '• /calc <expr> - Calculate math (advanced functions)\n'
         '• /solve <equation> - Solve linear/quadratic equations\n'
         '• /convert <value> <from> <to> - Unit conversion\n'
@@ -1227,6 +3268,9 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         '• /iplookup <IP> - Get IP address information\n'
         '• /crypto <coin> [currency] - Get cryptocurrency price\n'
         '   └─ Example: /crypto bitcoin or /crypto btc inr\n'
+        '• /pricealert <coin> <above|below> <value> - Alert on a price\n'
+        '• /pricealerts - List your price alerts\n'
+        '• /delpricealert <id> - Delete a price alert\n'
         '• /audiototext - Convert voice/audio to text\n'
         '• /translate <lang> <text> - Translate\n\n'
         '🎨 *Image & Media:*\n'
@@ -1380,10 +3424,6 @@ async def calendar_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def time_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send current time."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     now = datetime.now()
     current_time = now.strftime("%I:%M:%S %p")  # 12-hour format with AM/PM
     current_time_24 = now.strftime("%H:%M:%S")  # 24-hour format
@@ -1398,10 +3438,6 @@ async def time_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def date_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send current date."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     now = datetime.now()
     date_text = (
         f'📅 **Current Date:**\n\n'
@@ -1413,9 +3449,6 @@ async def date_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def alarm_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Set an alarm for a specific time."""
-    if await check_user_blocked(update, context):
-        return
-    
     user_id = update.message.from_user.id
     
     if not context.args or len(context.args) < 1:
@@ -1493,7 +3526,8 @@ async def alarm_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         'created_at': datetime.now().isoformat()
     }
     alarms[user_id].append(alarm_data)
-    save_alarms()
+    save_user_alarms(user_id)
+    schedule_alarm(user_id, alarm_data)
     
     # Format time for display
     hour, minute = map(int, alarm_time.split(':'))
@@ -1512,9 +3546,6 @@ async def alarm_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def alarms_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """List all alarms for the user."""
-    if await check_user_blocked(update, context):
-        return
-    
     user_id = update.message.from_user.id
     
     if user_id not in alarms or not alarms[user_id]:
@@ -1559,9 +3590,6 @@ async def alarms_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def deletealarm_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Delete an alarm by ID."""
-    if await check_user_blocked(update, context):
-        return
-    
     user_id = update.message.from_user.id
     
     if not context.args or len(context.args) < 1:
@@ -1590,7 +3618,8 @@ async def deletealarm_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     if len(alarms[user_id]) < original_count:
         if not alarms[user_id]:
             del alarms[user_id]
-        save_alarms()
+        save_user_alarms(user_id)
+        cancel_alarm(alarm_id)
         await update.message.reply_text(
             f"✅ **Alarm Deleted!**\n\n"
             f"Alarm ID: `{alarm_id}`\n\n"
@@ -1905,10 +3934,6 @@ async def leapyear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def refer_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show referral code and statistics."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     user = update.effective_user
     if not user:
         await update.message.reply_text("❌ Could not get user information.")
@@ -1930,7 +3955,7 @@ async def refer_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'joined_at': datetime.now().isoformat(),
             'name': user_name
         }
-        save_referral_data()
+        save_referral(user_id)
     
     user_data = referral_data.get(str(user_id), {})
     
@@ -1947,7 +3972,7 @@ async def refer_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Always update total_referrals to match actual list length (fix any inconsistencies)
     if user_data.get('total_referrals', 0) != total_refs:
         referral_data[str(user_id)]['total_referrals'] = total_refs
-        save_referral_data()
+        save_referral(user_id)
         logger.info(f"Fixed referral count for user {user_id}: was {user_data.get('total_referrals', 0)}, now {total_refs}")
     
     # Double-check: use actual count from list
@@ -1992,31 +4017,16 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await admin_only(update, context):
         return
     
-    # Track admin command usage
-    user = update.effective_user
-    if user:
-        increment_command_count(user.id)
-    
     # Get statistics
     total_users = len(user_data)
     total_referrals = len(referral_data)
     total_referral_count = sum(data.get('total_referrals', 0) for data in referral_data.values())
     
     # Calculate active users (last 7 days)
-    active_users = 0
-    seven_days_ago = datetime.now().timestamp() - (7 * 24 * 60 * 60)
-    for user_id, data in user_data.items():
-        last_seen = data.get('last_seen', '')
-        if last_seen:
-            try:
-                last_seen_dt = datetime.fromisoformat(last_seen)
-                if last_seen_dt.timestamp() > seven_days_ago:
-                    active_users += 1
-            except:
-                pass
+    active_users = active_user_count(7)
     
     # Total commands executed
-    total_commands = sum(data.get('command_count', 0) for data in user_data.values())
+    total_commands = total_command_count
     
     # Count blocked users
     blocked_count = len(blocked_users) if blocked_users else 0
@@ -2052,7 +4062,12 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "`/admin_list` - List all admins\n\n"
         
         "📢 **Communication:**\n"
-        "`/admin_broadcast <message>` - Broadcast to all users\n\n"
+        "`/admin_broadcast <message>` - Broadcast to all users\n"
+        "`/admin_prune` - Remove users unreachable during broadcasts\n\n"
+        
+        "🖥️ **System:**\n"
+        "`/admin_load` - Worker pool load and saturation\n"
+        "`/admin_health` - External provider health and circuit breakers\n\n"
         
         "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
         "💡 **Quick Actions:**\n"
@@ -2083,41 +4098,18 @@ async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not await admin_only(update, context):
         return
     
-    user = update.effective_user
-    if user:
-        increment_command_count(user.id)
-    
     # Basic stats
     total_users = len(user_data)
     total_referrals = len(referral_data)
     total_referral_count = sum(data.get('total_referrals', 0) for data in referral_data.values())
-    total_commands = sum(data.get('command_count', 0) for data in user_data.values())
+    total_commands = total_command_count
     
     # Active users (last 7, 30 days)
-    active_7d = 0
-    active_30d = 0
-    seven_days_ago = datetime.now().timestamp() - (7 * 24 * 60 * 60)
-    thirty_days_ago = datetime.now().timestamp() - (30 * 24 * 60 * 60)
-    
-    for user_id, data in user_data.items():
-        last_seen = data.get('last_seen', '')
-        if last_seen:
-            try:
-                last_seen_dt = datetime.fromisoformat(last_seen)
-                ts = last_seen_dt.timestamp()
-                if ts > seven_days_ago:
-                    active_7d += 1
-                if ts > thirty_days_ago:
-                    active_30d += 1
-            except:
-                pass
+    active_7d = active_user_count(7)
+    active_30d = active_user_count(30)
     
     # Top users by commands
-    top_users = sorted(
-        [(uid, data.get('command_count', 0)) for uid, data in user_data.items()],
-        key=lambda x: x[1],
-        reverse=True
-    )[:5]
+    top_users = get_top_command_users()
     
     stats_text = (
         "📊 **Detailed Statistics**\n"
@@ -2159,71 +4151,162 @@ async def admin_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not await admin_only(update, context):
         return
     
-    user = update.effective_user
-    if user:
-        increment_command_count(user.id)
-    
     if not user_data:
         await update.message.reply_text("📭 No users found.")
         return
     
-    # Get page number from args (default: 1)
+    # Optional sort order and page number: /admin_users [recent|new|old|active] [page]
+    sort = 'recent'
     page = 1
-    if context.args:
-        try:
-            page = int(context.args[0])
-        except:
-            pass
-    
-    users_per_page = 10
-    total_pages = (len(user_data) + users_per_page - 1) // users_per_page
+    for arg in context.args or []:
+        if arg.lower() in USER_SORTS:
+            sort = arg.lower()
+        else:
+            try:
+                page = int(arg)
+            except ValueError:
+                pass
     
+    total_pages = (len(user_data) + 9) // 10
     if page < 1 or page > total_pages:
         page = 1
     
-    start_idx = (page - 1) * users_per_page
-    end_idx = start_idx + users_per_page
-    
-    users_list = list(user_data.items())[start_idx:end_idx]
-    
-    users_text = (
-        f"👥 **All Users** (Page {page}/{total_pages})\n"
-        "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
+    users_text, reply_markup = render_users_page(sort, offset=(page - 1) * 10)
+    await update.message.reply_text(users_text, parse_mode='Markdown', reply_markup=reply_markup)
+
+# Broadcast jobs - a broadcast runs as a background job that checkpoints its
+# progress, so a restart resumes it instead of starting over
+BROADCAST_STATE_FILE = "broadcast_state.json"
+BROADCAST_RECIPIENTS_FILE = "broadcast_recipients.json"
+PRUNE_QUEUE_FILE = "prune_queue.json"
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_CHUNK_SIZE = 200  # recipients sent between two checkpoints
+BROADCAST_PROGRESS_INTERVAL = 5  # seconds between status message edits
+broadcast_task = None
+
+def load_prune_queue():
+    """Load the users queued for pruning (unreachable during a broadcast)."""
+    try:
+        if os.path.exists(PRUNE_QUEUE_FILE):
+            with open(PRUNE_QUEUE_FILE, 'r', encoding='utf-8') as f:
+                return set(json.load(f))
+    except Exception as e:
+        logger.warning(f"Error loading prune queue: {e}")
+    return set()
+
+prune_queue = load_prune_queue()
+
+def is_unreachable_error(error):
+    """True if a send failure means the chat is gone (blocked, deactivated, deleted)."""
+    if isinstance(error, Forbidden):
+        return True
+    text = str(error).lower()
+    return isinstance(error, BadRequest) and ("chat not found" in text or "user is deactivated" in text)
+
+def broadcast_progress_text(state, finished=False):
+    """Status text for the broadcast progress message."""
+    done = state['cursor']
+    total = state['total']
+    title = "✅ **Broadcast Complete!**" if finished else "📢 **Broadcasting...**"
+    return (
+        f"{title}\n\n"
+        f"📊 Progress: {done}/{total} ({done * 100 // total if total else 100}%)\n"
+        f"✅ Success: {state['success']}\n"
+        f"❌ Failed: {state['failed']}\n"
+        f"🚫 Unreachable: {state['unreachable']}\n"
+        + ("" if finished else "\n⏳ You can keep using the bot while this runs.")
+        + (f"\n\n🧹 {len(prune_queue)} unreachable users queued - use `/admin_prune` to remove them"
+           if finished and prune_queue else "")
     )
-    
-    for uid, data in users_list:
-        username = data.get('username', 'N/A')
-        name = data.get('first_name', 'Unknown')
-        commands = data.get('command_count', 0)
-        last_seen = data.get('last_seen', 'N/A')
-        
-        # Escape special characters to avoid Markdown parsing errors
-        escaped_name = escape_markdown(str(name))
-        escaped_username = escape_markdown(str(username))
-        escaped_last_seen = escape_markdown(last_seen[:10] if len(last_seen) > 10 else str(last_seen))
-        
-        users_text += (
-            f"👤 **{escaped_name}**\n"
-            f"   ID: `{uid}`\n"
-            f"   Username: @{escaped_username}\n"
-            f"   Commands: {commands}\n"
-            f"   Last Seen: {escaped_last_seen}\n\n"
+
+async def update_broadcast_status(bot, state, finished=False):
+    """Edit the admin's status message with the current progress."""
+    try:
+        await bot.edit_message_text(
+            chat_id=state['status_chat_id'],
+            message_id=state['status_message_id'],
+            text=broadcast_progress_text(state, finished),
+            parse_mode='Markdown'
         )
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            logger.warning(f"Could not update broadcast status: {e}")
+    except Exception as e:
+        logger.warning(f"Could not update broadcast status: {e}")
+
+async def save_broadcast_checkpoint(state):
+    """Persist broadcast progress and the prune queue off the event loop."""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, atomic_write_json, BROADCAST_STATE_FILE, dict(state))
+    await loop.run_in_executor(None, atomic_write_json, PRUNE_QUEUE_FILE, sorted(prune_queue))
+
+async def run_broadcast(bot, state, recipients):
+    """Send a broadcast to ``recipients`` starting at ``state['cursor']``."""
+    global broadcast_task
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    text = f"📢 **Broadcast Message**\n\n{state['message']}"
+    
+    async def send(user_id_str):
+        async with semaphore:
+            try:
+                await send_message_limited(bot, int(user_id_str), text, parse_mode='Markdown')
+                state['success'] += 1
+            except Exception as e:
+                if is_unreachable_error(e):
+                    state['unreachable'] += 1
+                    prune_queue.add(user_id_str)
+                else:
+                    state['failed'] += 1
+                    logger.warning(f"Failed to send broadcast to {user_id_str}: {e}")
     
-    users_text += f"━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-    users_text += f"💡 Use `/admin_users <page>` to see more pages"
-    
-    await update.message.reply_text(users_text, parse_mode='Markdown')
+    try:
+        last_status = 0
+        while state['cursor'] < len(recipients):
+            chunk = recipients[state['cursor']:state['cursor'] + BROADCAST_CHUNK_SIZE]
+            await asyncio.gather(*(send(uid) for uid in chunk))
+            state['cursor'] += len(chunk)
+            await save_broadcast_checkpoint(state)
+            if time.monotonic() - last_status >= BROADCAST_PROGRESS_INTERVAL:
+                last_status = time.monotonic()
+                await update_broadcast_status(bot, state)
+        
+        state['status'] = 'done'
+        await save_broadcast_checkpoint(state)
+        await update_broadcast_status(bot, state, finished=True)
+        logger.info(f"Broadcast finished: {state['success']} sent, {state['failed']} failed, "
+                    f"{state['unreachable']} unreachable")
+    except asyncio.CancelledError:
+        # Shutdown - the checkpoint lets the next start resume from here
+        raise
+    except Exception as e:
+        logger.error(f"Broadcast job failed: {e}", exc_info=True)
+    finally:
+        broadcast_task = None
+
+def resume_broadcast(bot):
+    """Resume an unfinished broadcast after a restart."""
+    global broadcast_task
+    try:
+        if not os.path.exists(BROADCAST_STATE_FILE):
+            return
+        with open(BROADCAST_STATE_FILE, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('status') != 'running':
+            return
+        with open(BROADCAST_RECIPIENTS_FILE, 'r', encoding='utf-8') as f:
+            recipients = json.load(f)
+    except Exception as e:
+        logger.error(f"Could not resume broadcast: {e}")
+        return
+    logger.info(f"Resuming broadcast at {state['cursor']}/{state['total']}")
+    broadcast_task = asyncio.create_task(run_broadcast(bot, state, recipients))
 
 async def admin_broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Broadcast message to all users."""
+    global broadcast_task
     if not await admin_only(update, context):
         return
     
-    user = update.effective_user
-    if user:
-        increment_command_count(user.id)
-    
     if not context.args:
         await update.message.reply_text(
             "📢 **Broadcast Message**\n\n"
@@ -2240,49 +4323,126 @@ async def admin_broadcast_command(update: Update, context: ContextTypes.DEFAULT_
         await update.message.reply_text("❌ No users to broadcast to.")
         return
     
-    # Send confirmation
+    if broadcast_task is not None and not broadcast_task.done():
+        await update.message.reply_text("⏳ A broadcast is already running. Please wait for it to finish.")
+        return
+    
+    recipients = list(user_data.keys())
+    state = {
+        'message': message,
+        'total': len(recipients),
+        'cursor': 0,
+        'success': 0,
+        'failed': 0,
+        'unreachable': 0,
+        'status': 'running',
+        'started_at': datetime.now().isoformat(),
+        'status_chat_id': update.effective_chat.id,
+        'status_message_id': None,
+    }
+    
+    # Send confirmation; this message is edited with live progress
+    status_message = await update.message.reply_text(broadcast_progress_text(state), parse_mode='Markdown')
+    state['status_message_id'] = status_message.message_id
+    
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, atomic_write_json, BROADCAST_RECIPIENTS_FILE, recipients)
+    await save_broadcast_checkpoint(state)
+    broadcast_task = asyncio.create_task(run_broadcast(context.bot, state, recipients))
+
+async def admin_prune_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Remove users that were unreachable during broadcasts."""
+    if not await admin_only(update, context):
+        return
+    
+    if not prune_queue:
+        await update.message.reply_text("📭 No unreachable users queued for pruning.")
+        return
+    
+    removed = 0
+    for user_id_str in list(prune_queue):
+        if int(user_id_str) in ADMIN_IDS:
+            continue
+        if user_id_str in user_data:
+            delete_user(user_id_str)
+            removed += 1
+    prune_queue.clear()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, atomic_write_json, PRUNE_QUEUE_FILE, [])
+    
     await update.message.reply_text(
-        f"📢 **Broadcasting...**\n\n"
-        f"Message: {message}\n\n"
-        f"Recipients: {len(user_data)} users\n\n"
-        f"⏳ This may take a while..."
+        f"🧹 **Prune Complete!**\n\n"
+        f"🗑️ Removed {removed} unreachable users.",
+        parse_mode='Markdown'
+    )
+
+async def admin_load_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show load and saturation of the workload executors."""
+    if not await admin_only(update, context):
+        return
+    
+    text = (
+        f"🚦 **Heavy Jobs**\n"
+        f"• Running: {heavy_jobs.active}/{heavy_jobs.max_active} | Queued: {heavy_jobs.waiting}/{heavy_jobs.max_queue}\n"
+        f"• Admitted: {heavy_jobs.admitted} | Refused: {heavy_jobs.refused} | Cancelled: {heavy_jobs.cancelled}\n\n"
+        f"🖥️ **Worker Pools**\n\n"
+    )
+    for executor in WORKLOAD_EXECUTORS:
+        stats = executor.stats()
+        text += (
+            f"**{stats['name'].capitalize()}** ({stats['workers']} {stats['kind']})\n"
+            f"• Active: {stats['active']} | Queued: {stats['queued']}/{stats['queue_limit']} | Peak: {stats['peak']}\n"
+            f"• Done: {stats['completed']} | Failed: {stats['failed']} | Rejected: {stats['rejected']}\n"
+            f"• Avg wait: {stats['avg_wait']:.1f}s | Avg run: {stats['avg_run']:.1f}s\n\n"
+        )
+    text += "🌐 **Translation Providers** (fastest expected first)\n"
+    for provider in translation_race.ranked():
+        latency = f"{provider.latency:.2f}s" if provider.latency is not None else "n/a"
+        text += f"• {provider.name}: {latency} avg, {provider.success_rate:.0%} ok ({provider.successes}✓/{provider.failures}✗)\n"
+    text += "\n"
+    
+    cache_stats = media_cache.stats()
+    text += (
+        f"🗂️ **Media Cache**\n"
+        f"• Memory: {cache_stats['memory_items']} files, {cache_stats['memory_mb']:.1f} MB | "
+        f"Disk: {cache_stats['disk_items']} files, {cache_stats['disk_mb']:.1f} MB\n"
+        f"• Hits: {cache_stats['memory_hits']} memory, {cache_stats['disk_hits']} disk | Misses: {cache_stats['misses']}\n"
     )
+    await update.message.reply_text(text, parse_mode='Markdown')
+
+async def admin_health_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the circuit breaker state and recent health of each external provider."""
+    if not await admin_only(update, context):
+        return
     
-    # Broadcast to all users
-    success_count = 0
-    failed_count = 0
+    if not circuit_breakers:
+        await update.message.reply_text("📭 No external provider has been called yet.")
+        return
     
-    for user_id_str in user_data.keys():
-        try:
-            await context.bot.send_message(
-                chat_id=int(user_id_str),
-                text=f"📢 **Broadcast Message**\n\n{message}",
-                parse_mode='Markdown'
+    state_icons = {'closed': '🟢', 'half-open': '🟡', 'open': '🔴'}
+    text = "🩺 **Provider Health**\n\n"
+    for breaker in sorted(circuit_breakers.values(), key=lambda b: b.name.lower()):
+        stats = breaker.stats()
+        text += f"{state_icons[stats['state']]} **{stats['name']}** - {stats['state']}"
+        if stats['state'] == 'open':
+            text += f" (probe in {stats['retry_in']:.0f}s)"
+        text += "\n"
+        if stats['window']:
+            text += (
+                f"• Last {stats['window']}: {stats['success_rate']:.0%} ok | "
+                f"p50 {stats['p50']:.2f}s | p95 {stats['p95']:.2f}s\n"
             )
-            success_count += 1
-            # Small delay to avoid rate limiting
-            await asyncio.sleep(0.05)
-        except Exception as e:
-            failed_count += 1
-            logger.warning(f"Failed to send broadcast to {user_id_str}: {e}")
-    
-    # Send summary
-    await update.message.reply_text(
-        f"✅ **Broadcast Complete!**\n\n"
-        f"✅ Success: {success_count}\n"
-        f"❌ Failed: {failed_count}\n"
-        f"📊 Total: {len(user_data)}"
-    )
+        text += (
+            f"• Calls: {stats['calls']} | Failed: {stats['failures']} | "
+            f"Skipped: {stats['rejected']} | Trips: {stats['trips']}\n\n"
+        )
+    await update.message.reply_text(text, parse_mode='Markdown')
 
 async def admin_referrals_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """View referral statistics for admin."""
     if not await admin_only(update, context):
         return
     
-    user = update.effective_user
-    if user:
-        increment_command_count(user.id)
-    
     if not referral_data:
         await update.message.reply_text("📭 No referral data found.")
         return
@@ -2301,7 +4461,7 @@ async def admin_referrals_command(update: Update, context: ContextTypes.DEFAULT_
         # Always fix if total_referrals doesn't match actual list
         if data.get('total_referrals', 0) != actual_count:
             referral_data[uid]['total_referrals'] = actual_count
-            save_referral_data()
+            save_referral(uid)
             logger.info(f"Fixed referral count for user {uid} in admin view: was {data.get('total_referrals', 0)}, now {actual_count}")
         
         referral_counts.append((uid, actual_count))
@@ -2341,10 +4501,6 @@ async def admin_add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await admin_only(update, context):
         return
     
-    user = update.effective_user
-    if user:
-        increment_command_count(user.id)
-    
     if not context.args:
         await update.message.reply_text(
             "➕ **Add Admin**\n\n"
@@ -2361,6 +4517,7 @@ async def admin_add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(f"ℹ️ User {new_admin_id} is already an admin.")
         else:
             ADMIN_IDS.append(new_admin_id)
+            start_admin_contacts_refresh(context.bot)
             await update.message.reply_text(
                 f"✅ **Admin Added Successfully!**\n\n"
                 f"👤 User ID: `{new_admin_id}`\n"
@@ -2375,10 +4532,6 @@ async def admin_remove_command(update: Update, context: ContextTypes.DEFAULT_TYP
     if not await admin_only(update, context):
         return
     
-    user = update.effective_user
-    if user:
-        increment_command_count(user.id)
-    
     if not context.args:
         await update.message.reply_text(
             "➖ **Remove Admin**\n\n"
@@ -2393,6 +4546,7 @@ async def admin_remove_command(update: Update, context: ContextTypes.DEFAULT_TYP
         admin_id = int(context.args[0])
         if admin_id in ADMIN_IDS:
             ADMIN_IDS.remove(admin_id)
+            start_admin_contacts_refresh(context.bot)
             await update.message.reply_text(
                 f"✅ **Admin Removed Successfully!**\n\n"
                 f"👤 User ID: `{admin_id}`\n"
@@ -2409,10 +4563,6 @@ async def admin_list_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not await admin_only(update, context):
         return
     
-    user = update.effective_user
-    if user:
-        increment_command_count(user.id)
-    
     if not ADMIN_IDS:
         await update.message.reply_text("📭 No admins configured.")
         return
@@ -2444,10 +4594,6 @@ async def admin_block_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not await admin_only(update, context):
         return
     
-    user = update.effective_user
-    if user:
-        increment_command_count(user.id)
-    
     # Check if replying to a message
     target_user_id = None
     if update.message.reply_to_message:
@@ -2515,13 +4661,7 @@ async def admin_block_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         # Try to notify the blocked user
         try:
             admin_contacts = await get_admin_contacts_async(context)
-            contact_text = ""
-            if admin_contacts:
-                contact_text = "\n\n**Contact Admin:**\n"
-                for contact in admin_contacts:
-                    contact_text += f"• {contact}\n"
-            else:
-                contact_text = "\n\nIf you believe this is an error, please contact the bot administrator."
+            contact_text = admin_contact_text(admin_contacts)
             
             await context.bot.send_message(
                 chat_id=target_user_id,
@@ -2542,10 +4682,6 @@ async def admin_unblock_command(update: Update, context: ContextTypes.DEFAULT_TY
     if not await admin_only(update, context):
         return
     
-    user = update.effective_user
-    if user:
-        increment_command_count(user.id)
-    
     # Check if replying to a message
     target_user_id = None
     if update.message.reply_to_message:
@@ -2622,10 +4758,6 @@ async def admin_blocked_command(update: Update, context: ContextTypes.DEFAULT_TY
     if not await admin_only(update, context):
         return
     
-    user = update.effective_user
-    if user:
-        increment_command_count(user.id)
-    
     if not blocked_users:
         await update.message.reply_text("📭 No users are currently blocked.")
         return
@@ -2681,20 +4813,10 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
         total_referrals = len(referral_data)
         total_referral_count = sum(data.get('total_referrals', 0) for data in referral_data.values())
         blocked_count = len(blocked_users) if blocked_users else 0
-        total_commands = sum(data.get('command_count', 0) for data in user_data.values())
+        total_commands = total_command_count
         
         # Calculate active users (last 7 days)
-        active_users = 0
-        seven_days_ago = datetime.now().timestamp() - (7 * 24 * 60 * 60)
-        for user_id, data in user_data.items():
-            last_seen = data.get('last_seen', '')
-            if last_seen:
-                try:
-                    last_seen_dt = datetime.fromisoformat(last_seen)
-                    if last_seen_dt.timestamp() > seven_days_ago:
-                        active_users += 1
-                except:
-                    pass
+        active_users = active_user_count(7)
         
         stats_text = (
             "📊 **Detailed Statistics**\n"
@@ -2715,41 +4837,27 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
             await message.reply_text("📭 No users found.")
             return
         
-        page = 1
-        users_per_page = 10
-        total_pages = (len(user_data) + users_per_page - 1) // users_per_page
-        
-        start_idx = 0
-        end_idx = users_per_page
-        users_list = list(user_data.items())[start_idx:end_idx]
-        
-        users_text = (
-            f"👥 **All Users** (Page {page}/{total_pages})\n"
-            "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
-        )
-        
-        for uid, data in users_list:
-            username = data.get('username', 'N/A')
-            name = data.get('first_name', 'Unknown')
-            commands = data.get('command_count', 0)
-            last_seen = data.get('last_seen', 'N/A')
-            
-            escaped_name = escape_markdown(str(name))
-            escaped_username = escape_markdown(str(username))
-            escaped_last_seen = escape_markdown(last_seen[:10] if len(last_seen) > 10 else str(last_seen))
-            
-            users_text += (
-                f"👤 **{escaped_name}**\n"
-                f"   ID: `{uid}`\n"
-                f"   Username: @{escaped_username}\n"
-                f"   Commands: {commands}\n"
-                f"   Last Seen: {escaped_last_seen}\n\n"
-            )
-        
-        users_text += f"━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-        users_text += f"💡 Use `/admin_users <page>` to see more pages"
-        
-        await message.reply_text(users_text, parse_mode='Markdown')
+        users_text, reply_markup = render_users_page('recent')
+        await message.reply_text(users_text, parse_mode='Markdown', reply_markup=reply_markup)
+        
+    elif callback_data.startswith("admin_users:"):
+        # Paging / sorting buttons: admin_users:<sort>[:<n|p>:<cursor>]
+        parts = callback_data.split(':', 3)
+        sort = next((name for name, (code, _, _) in USER_SORTS.items() if code == parts[1]), 'recent')
+        cursor = None
+        direction = 'next'
+        if len(parts) == 4:
+            direction = 'prev' if parts[2] == 'p' else 'next'
+            try:
+                cursor = decode_user_cursor(USER_SORTS[sort][1], parts[3])
+            except ValueError:
+                cursor = None
+        users_text, reply_markup = render_users_page(sort, cursor, direction)
+        try:
+            await query.edit_message_text(users_text, parse_mode='Markdown', reply_markup=reply_markup)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
         
     elif callback_data == "admin_blocked":
         # Show blocked users
@@ -2843,7 +4951,7 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
             # Always fix if total_referrals doesn't match actual list
             if data.get('total_referrals', 0) != actual_count:
                 referral_data[user_id]['total_referrals'] = actual_count
-                save_referral_data()
+                save_referral(user_id)
                 logger.info(f"Fixed referral count for user {user_id} in callback: was {data.get('total_referrals', 0)}, now {actual_count}")
             
             referral_counts.append((user_id, data, actual_count))
@@ -2879,10 +4987,6 @@ async def admin_delete_user_command(update: Update, context: ContextTypes.DEFAUL
     if not await admin_only(update, context):
         return
     
-    user = update.effective_user
-    if user:
-        increment_command_count(user.id)
-    
     # Check if replying to a message
     target_user_id = None
     if update.message.reply_to_message:
@@ -2941,8 +5045,7 @@ async def admin_delete_user_command(update: Update, context: ContextTypes.DEFAUL
         name = user_info.get('first_name', 'Unknown')
         
         # Delete user data
-        del user_data[target_user_id_str]
-        save_user_data()
+        delete_user(target_user_id_str)
         
         # Keep referral data intact so user can rejoin with same referral link
         # Only remove this user from other referrers' referral lists (if they were referred)
@@ -2958,7 +5061,7 @@ async def admin_delete_user_command(update: Update, context: ContextTypes.DEFAUL
                 # Update total_referrals based on actual list length
                 new_total = len(referrals_list)
                 referral_data[referrer_id]['total_referrals'] = new_total
-                save_referral_data()
+                save_referral(referrer_id)
                 logger.info(f"Removed user {target_user_id_str} from referrer {referrer_id}'s list. New total: {new_total}")
         
         # Note: We keep the user's own referral entry in referral_data
@@ -4764,12 +6867,9 @@ async def texttoemoji_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             parse_mode='Markdown'
         )
 
+@heavy_command(PRIORITY_INTERACTIVE)
 async def mp4tomp3_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Convert MP4 video files to MP3 audio files."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     try:
         # Check if MoviePy is available
         if not MOVIEPY_AVAILABLE or VideoFileClip is None:
@@ -4809,7 +6909,7 @@ async def mp4tomp3_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         file_name = "video.mp4"
         
         if update.message.video:
-            video_file = await context.bot.get_file(update.message.video.file_id)
+            video_file = update.message.video
             file_name = update.message.video.file_name or "video.mp4"
         elif update.message.document:
             # Check if document is a video
@@ -4820,7 +6920,7 @@ async def mp4tomp3_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     "The file you sent is not a video file."
                 )
                 return
-            video_file = await context.bot.get_file(update.message.document.file_id)
+            video_file = update.message.document
             file_name = update.message.document.file_name or "video.mp4"
         
         if not video_file:
@@ -4843,68 +6943,26 @@ async def mp4tomp3_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         try:
-            # Get file path and bot token for download
-            file_path = video_file.file_path
-            bot_token = context.bot.token
-            
-            # Download video to temporary file
-            loop = asyncio.get_event_loop()
+            # Stream the video to a temporary file; the conversion below owns and removes it
+            try:
+                video_path = await spool_telegram_file(
+                    context.bot, video_file.file_id, suffix='.mp4',
+                    file_size=video_file.file_size, max_bytes=50 * 1024 * 1024
+                )
+            except MediaTooLarge:
+                await processing_msg.edit_text(
+                    "❌ Video file is too large (>50MB).\n\n"
+                    "Please send a smaller video file (under 50MB)."
+                )
+                return
             
             def convert_video_to_mp3():
-                video_path = None
                 audio_path = None
                 try:
-                    # Create temporary files
-                    video_fd, video_path = tempfile.mkstemp(suffix='.mp4')
+                    # Create temporary file for the audio
                     audio_fd, audio_path = tempfile.mkstemp(suffix='.mp3')
-                    os.close(video_fd)
                     os.close(audio_fd)
                     
-                    # Download video using requests
-                    # Construct download URL
-                    # file_path from Telegram API should be relative (e.g., "videos/file_18.mp4")
-                    # But sometimes it might contain partial URL, so handle both cases
-                    
-                    # Get the actual file_path value (closure variable)
-                    actual_file_path = file_path
-                    
-                    # Check if file_path already contains the full URL
-                    if actual_file_path.startswith('https://api.telegram.org/file/bot'):
-                        # Already contains full URL - extract just the path part
-                        # Format: https://api.telegram.org/file/bot{token}/path
-                        # Extract path after /file/bot{token}/
-                        if f'/file/bot{bot_token}/' in actual_file_path:
-                            # Extract path after token
-                            path_part = actual_file_path.split(f'/file/bot{bot_token}/', 1)[-1]
-                            download_url = f"https://api.telegram.org/file/bot{bot_token}/{path_part}"
-                        else:
-                            # Extract path after any /file/bot/ pattern
-                            import re
-                            match = re.search(r'/file/bot[^/]+/(.+)$', actual_file_path)
-                            if match:
-                                path_part = match.group(1)
-                                download_url = f"https://api.telegram.org/file/bot{bot_token}/{path_part}"
-                            else:
-                                # Fallback: use as is
-                                download_url = actual_file_path
-                    elif actual_file_path.startswith('http://') or actual_file_path.startswith('https://'):
-                        # Other HTTP URL - use as is
-                        download_url = actual_file_path
-                    else:
-                        # Relative path - construct full URL
-                        download_url = f"https://api.telegram.org/file/bot{bot_token}/{actual_file_path}"
-                    
-                    logger.info(f"Downloading video from: {download_url}")
-                    
-                    # Download file
-                    response = requests.get(download_url, stream=True, timeout=60)
-                    response.raise_for_status()
-                    
-                    with open(video_path, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                    
                     # Convert to MP3
                     video_clip = VideoFileClip(video_path)
                     audio_clip = video_clip.audio
@@ -4917,7 +6975,7 @@ async def mp4tomp3_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         audio_path,
                         codec='mp3',
                         bitrate='192k',
-                        logger=None  # Suppress moviepy logs
+                        logger=job_moviepy_logger()  # Progress and /cancel for the job (None suppresses moviepy logs)
                     )
                     
                     # Clean up
@@ -4944,7 +7002,12 @@ async def mp4tomp3_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         logger.warning(f"Error cleaning up temp files: {cleanup_error}")
             
             # Run conversion in executor
-            audio_data = await loop.run_in_executor(None, convert_video_to_mp3)
+            try:
+                audio_data = await transcode_executor.run(convert_video_to_mp3)
+            finally:
+                # Also covers a job cancelled before the conversion started
+                if os.path.exists(video_path):
+                    os.unlink(video_path)
             
             # Delete processing message
             try:
@@ -5077,10 +7140,6 @@ async def fancyfont_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def removeduplicates_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Remove duplicate lines from text."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     # Get text from message or reply
     text = ""
     
@@ -5224,10 +7283,6 @@ async def removeduplicates_command(update: Update, context: ContextTypes.DEFAULT
 
 async def hash_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Generate MD5, SHA1, SHA256, SHA512 hashes for text."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     # Get text and hash type
     text = ""
     hash_type = "all"  # Default
@@ -5414,10 +7469,6 @@ async def hash_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def shorturl_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Shorten URLs using free API."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     # Get URL from message or reply
     url = ""
     
@@ -5492,10 +7543,10 @@ async def shorturl_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         processing_msg = await update.message.reply_text("🔗 Shortening URL...")
         
         # Use is.gd API (free, no API key needed)
-        def shorten_url(url_to_shorten):
+        async def shorten_url(url_to_shorten):
             try:
                 api_url = f"https://is.gd/create.php?format=json&url={quote(url_to_shorten)}"
-                response = requests.get(api_url, timeout=10)
+                response = await get_http_client().get(api_url, timeout=10)
                 
                 if response.status_code == 200:
                     data = response.json()
@@ -5510,17 +7561,16 @@ async def shorturl_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 # Try alternative API (v.gd)
                 try:
                     api_url = f"https://v.gd/create.php?format=json&url={quote(url_to_shorten)}"
-                    response = requests.get(api_url, timeout=10)
+                    response = await get_http_client().get(api_url, timeout=10)
                     if response.status_code == 200:
                         data = response.json()
                         if 'shorturl' in data:
                             return data['shorturl']
-                except:
+                except Exception:
                     pass
                 raise
         
-        loop = asyncio.get_event_loop()
-        short_url = await loop.run_in_executor(None, shorten_url, url)
+        short_url = await shorten_url(url)
         
         # Delete processing message
         try:
@@ -5560,12 +7610,9 @@ async def shorturl_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "💡 Please make sure the URL is valid and try again."
             )
 
+@heavy_command(PRIORITY_INTERACTIVE)
 async def screenshot_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Take screenshot of a website."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     # Get URL from message or reply
     url = ""
     
@@ -5670,7 +7717,7 @@ async def screenshot_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
             for api in apis:
                 try:
                     logger.info(f"Trying screenshot API: {api['name']}")
-                    response = requests.get(api['url'], timeout=30, allow_redirects=True, headers={
+                    response = http_session.get(api['url'], timeout=30, allow_redirects=True, headers={
                         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
                     })
                     
@@ -5706,8 +7753,7 @@ async def screenshot_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
             # If all APIs failed, raise exception
             raise Exception("All screenshot APIs failed. Please try again later or check the URL.")
         
-        loop = asyncio.get_event_loop()
-        screenshot_image = await loop.run_in_executor(None, take_screenshot, url)
+        screenshot_image = await io_executor.run(take_screenshot, url)
         
         # Delete processing message
         try:
@@ -5786,10 +7832,6 @@ async def screenshot_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def ip_lookup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Get IP address information."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     # Get IP from message or reply
     ip_address = ""
     
@@ -5899,11 +7941,11 @@ async def ip_lookup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         processing_msg = await update.message.reply_text("🌐 Looking up IP information...")
         
         # Use free IP lookup API (ip-api.com - free tier, no API key needed)
-        def lookup_ip(ip_to_lookup):
+        async def lookup_ip(ip_to_lookup):
             try:
                 # ip-api.com free tier (no API key needed)
                 api_url = f"http://ip-api.com/json/{ip_to_lookup}?fields=status,message,country,countryCode,region,regionName,city,zip,lat,lon,timezone,isp,org,as,query"
-                response = requests.get(api_url, timeout=10)
+                response = await get_http_client().get(api_url, timeout=10)
                 
                 if response.status_code == 200:
                     data = response.json()
@@ -5918,8 +7960,7 @@ async def ip_lookup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 logger.error(f"IP lookup error: {e}")
                 raise
         
-        loop = asyncio.get_event_loop()
-        ip_data = await loop.run_in_executor(None, lookup_ip, ip_address)
+        ip_data = await lookup_ip(ip_address)
         
         # Delete processing message
         try:
@@ -6027,12 +8068,9 @@ async def ip_lookup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "💡 Please make sure the IP address is valid and try again."
             )
 
+@heavy_command(PRIORITY_INTERACTIVE)
 async def audio_to_text_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Convert audio/voice message to text using speech recognition."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     # Get language from command arguments (e.g., /audiototext bn or /audiototext en)
     language = 'bn-BD'  # Default to Bangla
     if context.args and len(context.args) > 0:
@@ -6107,31 +8145,9 @@ async def audio_to_text_command(update: Update, context: ContextTypes.DEFAULT_TY
         
         processing_msg = await update.message.reply_text("🎤 Converting audio to text...")
         
-        # Download file first (async)
-        file_id = voice.file_id if voice else audio.file_id
-        file = await context.bot.get_file(file_id)
-        
-        # Download to temporary file
-        import tempfile
-        import os
-        
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.ogg') as temp_audio:
-            temp_path = temp_audio.name
-        
-        # Download file content
-        file_path = file.file_path
-        if file_path.startswith('http'):
-            download_url = file_path
-        else:
-            download_url = f"https://api.telegram.org/file/bot{context.bot.token}/{file_path}"
-        
-        # Download file
-        response = requests.get(download_url, timeout=30)
-        response.raise_for_status()
-        
-        with open(temp_path, 'wb') as f:
-            f.write(response.content)
+        # Download file first (async) to a temporary file
+        media = voice or audio
+        temp_path = await spool_telegram_file(context.bot, media.file_id, suffix='.ogg', file_size=media.file_size)
         
         # Convert audio to text
         def convert_audio_to_text(lang=language):
@@ -6237,7 +8253,7 @@ async def audio_to_text_command(update: Update, context: ContextTypes.DEFAULT_TY
                                 # CREATE_NO_WINDOW not available in this Python version
                                 pass
                         
-                        result = subprocess.run(convert_cmd, **subprocess_kwargs)
+                        result = run_job_subprocess(convert_cmd, **subprocess_kwargs)
                         
                         if result.returncode != 0:
                             error_msg = result.stderr.decode('utf-8', errors='ignore')
@@ -6323,8 +8339,7 @@ async def audio_to_text_command(update: Update, context: ContextTypes.DEFAULT_TY
                     pass
                 raise
         
-        loop = asyncio.get_event_loop()
-        recognized_text = await loop.run_in_executor(None, convert_audio_to_text, language)
+        recognized_text = await transcode_executor.run(convert_audio_to_text, language)
         
         # Delete processing message
         try:
@@ -6585,10 +8600,6 @@ async def repeat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def qr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Generate QR code for text/URL using online API."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     if not context.args:
         await update.message.reply_text(
             "❌ Please provide text or URL to generate QR code!\n"
@@ -6605,7 +8616,6 @@ async def qr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         # Use online QR code API (no PIL/Pillow needed)
-        loop = asyncio.get_event_loop()
         
         def generate_qr():
             try:
@@ -6615,7 +8625,7 @@ async def qr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 qr_url = f"https://api.qrserver.com/v1/create-qr-code/?size=300x300&data={encoded_data}"
                 
                 # Download QR code image
-                response = requests.get(qr_url, timeout=10)
+                response = http_session.get(qr_url, timeout=10)
                 if response.status_code == 200:
                     img_buffer = io.BytesIO(response.content)
                     img_buffer.seek(0)
@@ -6627,7 +8637,7 @@ async def qr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 raise
         
         # Run QR generation in executor
-        qr_image = await loop.run_in_executor(None, generate_qr)
+        qr_image = await image_executor.run(generate_qr)
         
         # Delete processing message
         try:
@@ -6681,26 +8691,19 @@ async def blur_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         processing_msg = await update.message.reply_text("🎨 Blurring image...")
         
-        loop = asyncio.get_event_loop()
         try:
-            file = await context.bot.get_file(photo.file_id)
-            file_path = file.file_path
+            image_bytes = await media_cache.get(context.bot, photo)
         except Exception as e:
             await processing_msg.delete()
             await update.message.reply_text(f"❌ Error downloading image: {str(e)}")
             return
         
-        def process_blur(file_path_url):
+        def process_blur(image_bytes):
             try:
                 if not PIL_AVAILABLE:
                     raise ImportError("PIL not available")
                 
-                img_buffer = io.BytesIO()
-                response = requests.get(file_path_url, timeout=30)
-                if response.status_code != 200:
-                    raise Exception(f"Failed to download image: HTTP {response.status_code}")
-                img_buffer.write(response.content)
-                img_buffer.seek(0)
+                img_buffer = io.BytesIO(image_bytes)
                 
                 img = Image.open(img_buffer)
                 blurred_img = img.filter(ImageFilter.GaussianBlur(radius=5))
@@ -6715,7 +8718,7 @@ async def blur_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 logger.error(f"Blur processing error: {e}", exc_info=True)
                 raise
         
-        blurred_image = await loop.run_in_executor(None, process_blur, file_path)
+        blurred_image = await image_executor.run(process_blur, image_bytes)
         
         try:
             await processing_msg.delete()
@@ -6739,10 +8742,6 @@ async def blur_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def watermark_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Add watermark text to an image."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     if not PIL_AVAILABLE:
         await update.message.reply_text(
             "❌ Image watermark feature requires Pillow library.\n"
@@ -6801,27 +8800,19 @@ async def watermark_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         processing_msg = await update.message.reply_text("💧 Adding watermark...")
         
-        loop = asyncio.get_event_loop()
         try:
-            file = await context.bot.get_file(photo.file_id)
-            file_path = file.file_path
+            image_bytes = await media_cache.get(context.bot, photo)
         except Exception as e:
             await processing_msg.delete()
             await update.message.reply_text(f"❌ Error downloading image: {str(e)}")
             return
         
-        def add_watermark(file_path_url):
+        def add_watermark(image_bytes):
             try:
                 if not PIL_AVAILABLE:
                     raise ImportError("PIL not available")
                 
-                # Download image
-                img_buffer = io.BytesIO()
-                response = requests.get(file_path_url, timeout=30)
-                if response.status_code != 200:
-                    raise Exception(f"Failed to download image: HTTP {response.status_code}")
-                img_buffer.write(response.content)
-                img_buffer.seek(0)
+                img_buffer = io.BytesIO(image_bytes)
                 
                 img = Image.open(img_buffer)
                 if img.mode != 'RGB':
@@ -6929,7 +8920,7 @@ async def watermark_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 logger.error(f"Watermark processing error: {e}", exc_info=True)
                 raise
         
-        watermarked_image = await loop.run_in_executor(None, add_watermark, file_path)
+        watermarked_image = await image_executor.run(add_watermark, image_bytes)
         
         try:
             await processing_msg.delete()
@@ -6955,12 +8946,178 @@ async def watermark_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "💡 Please try again or check your command format."
         )
 
+def apply_image_filter(image_bytes, filter_type):
+    """Apply a named colour filter to an image and return PNG bytes (runs in the CPU pool)."""
+    try:
+        if not PIL_AVAILABLE:
+            raise ImportError("PIL not available")
+        
+        img = Image.open(io.BytesIO(image_bytes))
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        
+        width, height = img.size
+        
+        # Apply filter based on type
+        if filter_type == 'grayscale':
+            # Grayscale filter
+            filtered_img = img.convert('L').convert('RGB')
+            
+        elif filter_type == 'sepia':
+            # Sepia filter - apply brown vintage tone
+            filtered_img = img.copy()
+            pixels = filtered_img.load()
+            
+            for y in range(height):
+                for x in range(width):
+                    r, g, b = pixels[x, y]
+                    
+                    # Sepia formula
+                    tr = int(0.393 * r + 0.769 * g + 0.189 * b)
+                    tg = int(0.349 * r + 0.686 * g + 0.168 * b)
+                    tb = int(0.272 * r + 0.534 * g + 0.131 * b)
+                    
+                    # Clamp values to 0-255
+                    tr = min(255, max(0, tr))
+                    tg = min(255, max(0, tg))
+                    tb = min(255, max(0, tb))
+                    
+                    pixels[x, y] = (tr, tg, tb)
+            
+        elif filter_type == 'vintage':
+            # Vintage filter - combination of sepia + slight contrast/desaturation
+            filtered_img = img.copy()
+            pixels = filtered_img.load()
+            
+            for y in range(height):
+                for x in range(width):
+                    r, g, b = pixels[x, y]
+                    
+                    # Vintage effect: sepia + slight desaturation + slight darkening
+                    # Sepia tone
+                    tr = int(0.393 * r + 0.769 * g + 0.189 * b)
+                    tg = int(0.349 * r + 0.686 * g + 0.168 * b)
+                    tb = int(0.272 * r + 0.534 * g + 0.131 * b)
+                    
+                    # Add slight darkening and contrast
+                    tr = int(tr * 0.9)  # Slight darkening
+                    tg = int(tg * 0.88)
+                    tb = int(tb * 0.85)
+                    
+                    # Add slight yellow tint (vintage look)
+                    tr = min(255, int(tr * 1.05))
+                    tg = min(255, int(tg * 1.02))
+                    tb = min(255, int(tb * 0.95))
+                    
+                    # Clamp values
+                    tr = min(255, max(0, tr))
+                    tg = min(255, max(0, tg))
+                    tb = min(255, max(0, tb))
+                    
+                    pixels[x, y] = (tr, tg, tb)
+                    
+        elif filter_type == 'bright':
+            # Bright filter - brighten the image
+            from PIL import ImageEnhance
+            enhancer = ImageEnhance.Brightness(img)
+            filtered_img = enhancer.enhance(1.5)  # 50% brighter
+            
+        elif filter_type == 'dark':
+            # Dark filter - darken the image
+            from PIL import ImageEnhance
+            enhancer = ImageEnhance.Brightness(img)
+            filtered_img = enhancer.enhance(0.6)  # 40% darker
+            
+        elif filter_type == 'contrast':
+            # High contrast filter
+            from PIL import ImageEnhance
+            enhancer = ImageEnhance.Contrast(img)
+            filtered_img = enhancer.enhance(1.8)  # 80% more contrast
+            
+        elif filter_type == 'saturate':
+            # Increase color saturation
+            from PIL import ImageEnhance
+            enhancer = ImageEnhance.Color(img)
+            filtered_img = enhancer.enhance(1.6)  # 60% more saturation
+            
+        elif filter_type == 'invert':
+            # Invert/Negative filter
+            from PIL import ImageOps
+            filtered_img = ImageOps.invert(img)
+            
+        elif filter_type == 'warm':
+            # Warm filter - add warm tones (orange/yellow)
+            filtered_img = img.copy()
+            pixels = filtered_img.load()
+            
+            for y in range(height):
+                for x in range(width):
+                    r, g, b = pixels[x, y]
+                    
+                    # Add warm tones (increase red and yellow)
+                    tr = min(255, int(r * 1.2))
+                    tg = min(255, int(g * 1.1))
+                    tb = max(0, int(b * 0.9))
+                    
+                    pixels[x, y] = (tr, tg, tb)
+            
+        elif filter_type == 'cool':
+            # Cool filter - add cool tones (blue/cyan)
+            filtered_img = img.copy()
+            pixels = filtered_img.load()
+            
+            for y in range(height):
+                for x in range(width):
+                    r, g, b = pixels[x, y]
+                    
+                    # Add cool tones (increase blue, decrease red)
+                    tr = max(0, int(r * 0.9))
+                    tg = min(255, int(g * 1.05))
+                    tb = min(255, int(b * 1.15))
+                    
+                    pixels[x, y] = (tr, tg, tb)
+            
+        elif filter_type == 'vibrant':
+            # Vibrant filter - increase saturation and contrast
+            from PIL import ImageEnhance
+            # First increase saturation
+            color_enhancer = ImageEnhance.Color(img)
+            filtered_img = color_enhancer.enhance(1.5)
+            # Then increase contrast
+            contrast_enhancer = ImageEnhance.Contrast(filtered_img)
+            filtered_img = contrast_enhancer.enhance(1.3)
+            
+        elif filter_type == 'faded':
+            # Faded filter - desaturate and reduce contrast
+            from PIL import ImageEnhance
+            # First desaturate
+            color_enhancer = ImageEnhance.Color(img)
+            filtered_img = color_enhancer.enhance(0.5)  # 50% less saturation
+            # Then reduce contrast
+            contrast_enhancer = ImageEnhance.Contrast(filtered_img)
+            filtered_img = contrast_enhancer.enhance(0.7)  # 30% less contrast
+            
+        elif filter_type == 'sharp':
+            # Sharpen filter
+            from PIL import ImageFilter
+            filtered_img = img.filter(ImageFilter.SHARPEN)
+            # Apply additional sharpening
+            try:
+                filtered_img = filtered_img.filter(ImageFilter.UnsharpMask(radius=1, percent=150, threshold=3))
+            except:
+                # Fallback if UnsharpMask not available
+                filtered_img = filtered_img.filter(ImageFilter.SHARPEN)
+        
+        # Save to buffer
+        output_buffer = io.BytesIO()
+        filtered_img.save(output_buffer, format='PNG', quality=95)
+        return output_buffer.getvalue()
+    except Exception as e:
+        logger.error(f"Filter processing error: {e}", exc_info=True)
+        raise
+
 async def filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Apply filters (Grayscale, Sepia, Vintage, Bright, Dark, Contrast, Saturate, Invert, Warm, Cool, Vibrant, Faded, Sharp) to an image."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     if not PIL_AVAILABLE:
         await update.message.reply_text(
             "❌ Image filter feature requires Pillow library.\n"
@@ -7101,194 +9258,14 @@ async def filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         processing_msg = await update.message.reply_text(f"🎨 Applying {filter_names[filter_type]} filter...")
         
-        loop = asyncio.get_event_loop()
         try:
-            file = await context.bot.get_file(photo.file_id)
-            file_path = file.file_path
+            image_bytes = await media_cache.get(context.bot, photo)
         except Exception as e:
             await processing_msg.delete()
             await update.message.reply_text(f"❌ Error downloading image: {str(e)}")
             return
         
-        def apply_filter(file_path_url):
-            try:
-                if not PIL_AVAILABLE:
-                    raise ImportError("PIL not available")
-                
-                # Download image
-                img_buffer = io.BytesIO()
-                response = requests.get(file_path_url, timeout=30)
-                if response.status_code != 200:
-                    raise Exception(f"Failed to download image: HTTP {response.status_code}")
-                img_buffer.write(response.content)
-                img_buffer.seek(0)
-                
-                img = Image.open(img_buffer)
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                width, height = img.size
-                
-                # Apply filter based on type
-                if filter_type == 'grayscale':
-                    # Grayscale filter
-                    filtered_img = img.convert('L').convert('RGB')
-                    
-                elif filter_type == 'sepia':
-                    # Sepia filter - apply brown vintage tone
-                    filtered_img = img.copy()
-                    pixels = filtered_img.load()
-                    
-                    for y in range(height):
-                        for x in range(width):
-                            r, g, b = pixels[x, y]
-                            
-                            # Sepia formula
-                            tr = int(0.393 * r + 0.769 * g + 0.189 * b)
-                            tg = int(0.349 * r + 0.686 * g + 0.168 * b)
-                            tb = int(0.272 * r + 0.534 * g + 0.131 * b)
-                            
-                            # Clamp values to 0-255
-                            tr = min(255, max(0, tr))
-                            tg = min(255, max(0, tg))
-                            tb = min(255, max(0, tb))
-                            
-                            pixels[x, y] = (tr, tg, tb)
-                    
-                elif filter_type == 'vintage':
-                    # Vintage filter - combination of sepia + slight contrast/desaturation
-                    filtered_img = img.copy()
-                    pixels = filtered_img.load()
-                    
-                    for y in range(height):
-                        for x in range(width):
-                            r, g, b = pixels[x, y]
-                            
-                            # Vintage effect: sepia + slight desaturation + slight darkening
-                            # Sepia tone
-                            tr = int(0.393 * r + 0.769 * g + 0.189 * b)
-                            tg = int(0.349 * r + 0.686 * g + 0.168 * b)
-                            tb = int(0.272 * r + 0.534 * g + 0.131 * b)
-                            
-                            # Add slight darkening and contrast
-                            tr = int(tr * 0.9)  # Slight darkening
-                            tg = int(tg * 0.88)
-                            tb = int(tb * 0.85)
-                            
-                            # Add slight yellow tint (vintage look)
-                            tr = min(255, int(tr * 1.05))
-                            tg = min(255, int(tg * 1.02))
-                            tb = min(255, int(tb * 0.95))
-                            
-                            # Clamp values
-                            tr = min(255, max(0, tr))
-                            tg = min(255, max(0, tg))
-                            tb = min(255, max(0, tb))
-                            
-                            pixels[x, y] = (tr, tg, tb)
-                            
-                elif filter_type == 'bright':
-                    # Bright filter - brighten the image
-                    from PIL import ImageEnhance
-                    enhancer = ImageEnhance.Brightness(img)
-                    filtered_img = enhancer.enhance(1.5)  # 50% brighter
-                    
-                elif filter_type == 'dark':
-                    # Dark filter - darken the image
-                    from PIL import ImageEnhance
-                    enhancer = ImageEnhance.Brightness(img)
-                    filtered_img = enhancer.enhance(0.6)  # 40% darker
-                    
-                elif filter_type == 'contrast':
-                    # High contrast filter
-                    from PIL import ImageEnhance
-                    enhancer = ImageEnhance.Contrast(img)
-                    filtered_img = enhancer.enhance(1.8)  # 80% more contrast
-                    
-                elif filter_type == 'saturate':
-                    # Increase color saturation
-                    from PIL import ImageEnhance
-                    enhancer = ImageEnhance.Color(img)
-                    filtered_img = enhancer.enhance(1.6)  # 60% more saturation
-                    
-                elif filter_type == 'invert':
-                    # Invert/Negative filter
-                    from PIL import ImageOps
-                    filtered_img = ImageOps.invert(img)
-                    
-                elif filter_type == 'warm':
-                    # Warm filter - add warm tones (orange/yellow)
-                    filtered_img = img.copy()
-                    pixels = filtered_img.load()
-                    
-                    for y in range(height):
-                        for x in range(width):
-                            r, g, b = pixels[x, y]
-                            
-                            # Add warm tones (increase red and yellow)
-                            tr = min(255, int(r * 1.2))
-                            tg = min(255, int(g * 1.1))
-                            tb = max(0, int(b * 0.9))
-                            
-                            pixels[x, y] = (tr, tg, tb)
-                    
-                elif filter_type == 'cool':
-                    # Cool filter - add cool tones (blue/cyan)
-                    filtered_img = img.copy()
-                    pixels = filtered_img.load()
-                    
-                    for y in range(height):
-                        for x in range(width):
-                            r, g, b = pixels[x, y]
-                            
-                            # Add cool tones (increase blue, decrease red)
-                            tr = max(0, int(r * 0.9))
-                            tg = min(255, int(g * 1.05))
-                            tb = min(255, int(b * 1.15))
-                            
-                            pixels[x, y] = (tr, tg, tb)
-                    
-                elif filter_type == 'vibrant':
-                    # Vibrant filter - increase saturation and contrast
-                    from PIL import ImageEnhance
-                    # First increase saturation
-                    color_enhancer = ImageEnhance.Color(img)
-                    filtered_img = color_enhancer.enhance(1.5)
-                    # Then increase contrast
-                    contrast_enhancer = ImageEnhance.Contrast(filtered_img)
-                    filtered_img = contrast_enhancer.enhance(1.3)
-                    
-                elif filter_type == 'faded':
-                    # Faded filter - desaturate and reduce contrast
-                    from PIL import ImageEnhance
-                    # First desaturate
-                    color_enhancer = ImageEnhance.Color(img)
-                    filtered_img = color_enhancer.enhance(0.5)  # 50% less saturation
-                    # Then reduce contrast
-                    contrast_enhancer = ImageEnhance.Contrast(filtered_img)
-                    filtered_img = contrast_enhancer.enhance(0.7)  # 30% less contrast
-                    
-                elif filter_type == 'sharp':
-                    # Sharpen filter
-                    from PIL import ImageFilter
-                    filtered_img = img.filter(ImageFilter.SHARPEN)
-                    # Apply additional sharpening
-                    try:
-                        filtered_img = filtered_img.filter(ImageFilter.UnsharpMask(radius=1, percent=150, threshold=3))
-                    except:
-                        # Fallback if UnsharpMask not available
-                        filtered_img = filtered_img.filter(ImageFilter.SHARPEN)
-                
-                # Save to buffer
-                output_buffer = io.BytesIO()
-                filtered_img.save(output_buffer, format='PNG', quality=95)
-                output_buffer.seek(0)
-                return output_buffer
-            except Exception as e:
-                logger.error(f"Filter processing error: {e}", exc_info=True)
-                raise
-        
-        filtered_image = await loop.run_in_executor(None, apply_filter, file_path)
+        filtered_image = io.BytesIO(await cpu_executor.run(apply_image_filter, image_bytes, filter_type))
         
         try:
             await processing_msg.delete()
@@ -7303,15 +9280,186 @@ async def filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
     
     except Exception as e:
-        logger.error(f"Filter command error: {e}", exc_info=True)
-        try:
-            await processing_msg.delete()
-        except:
-            pass
-        await update.message.reply_text(
-            f"❌ **Error:** {str(e)}\n\n"
-            "💡 Please try again or check your command format."
-        )
+        logger.error(f"Filter command error: {e}", exc_info=True)
+        try:
+            await processing_msg.delete()
+        except:
+            pass
+        await update.message.reply_text(
+            f"❌ **Error:** {str(e)}\n\n"
+            "💡 Please try again or check your command format."
+        )
+
+def blur_image_background(image_bytes):
+    """Blur the background of an image, keeping the subject sharp; returns PNG bytes (runs in the CPU pool)."""
+    try:
+        if not PIL_AVAILABLE:
+            raise ImportError("PIL not available")
+        
+        img = Image.open(io.BytesIO(image_bytes))
+        img = img.convert('RGB')
+        width, height = img.size
+        
+        # Create blurred version
+        blurred_img = img.filter(ImageFilter.GaussianBlur(radius=10))
+        
+        # Create mask - keep foreground (subject) sharp, blur background
+        # Strategy: Use edge detection + color analysis to identify subject
+        if NUMPY_AVAILABLE:
+            # Edge detection using PIL filter
+            edge_img = img.convert('L').filter(ImageFilter.FIND_EDGES)
+            edge_array = np.array(edge_img)
+            
+            # Create mask based on edge density and position
+            # Subject is usually in center-upper area with more edges
+            mask_array = np.zeros((height, width), dtype=np.uint8)
+            
+            # Method 1: Edge-based detection
+            # Areas with more edges are likely to be subject
+            edge_threshold = np.percentile(edge_array, 60)
+            edge_mask = edge_array > edge_threshold
+            
+            # Method 2: Center-biased (subject is usually in center)
+            y_coords, x_coords = np.ogrid[:height, :width]
+            center_x, center_y = width // 2, height // 2
+            
+            # Create distance from center (normalized)
+            dist_x = np.abs(x_coords - center_x) / (width / 2)
+            dist_y = np.abs(y_coords - center_y) / (height / 2)
+            dist_from_center = np.sqrt(dist_x**2 + dist_y**2)
+            
+            # Method 3: Bottom area is usually background
+            # Assume bottom 25% is likely background
+            bottom_threshold = height * 0.75
+            is_bottom = y_coords > bottom_threshold
+            
+            # Combine methods to create mask
+            # Subject = high edges + center area + not bottom
+            subject_score = (
+                (edge_mask.astype(float) * 0.4) +  # Edge importance
+                ((1 - np.clip(dist_from_center, 0, 1)) * 0.4) +  # Center importance
+                ((1 - is_bottom.astype(float)) * 0.2)  # Not bottom importance
+            )
+            
+            # Normalize and threshold
+            subject_score = (subject_score - subject_score.min()) / (subject_score.max() - subject_score.min() + 1e-8)
+            
+            # Threshold: keep top 50% as subject
+            threshold = np.percentile(subject_score, 50)
+            mask_array = (subject_score > threshold).astype(np.uint8) * 255
+            
+            # Expand subject area slightly to avoid cutting edges
+            # Use simple numpy-based expansion if scipy not available
+            try:
+                from scipy import ndimage
+                mask_array = ndimage.binary_dilation(mask_array > 0, iterations=3).astype(np.uint8) * 255
+            except (ImportError, ModuleNotFoundError):
+                # If scipy not available, use optimized numpy-based expansion
+                # Create expanded mask by shifting and ORing
+                expanded_mask = mask_array.copy()
+                # Expand horizontally and vertically
+                for shift in range(1, 4):
+                    # Shift left, right, up, down and combine
+                    expanded_mask = np.maximum(expanded_mask, np.roll(mask_array, shift, axis=1))
+                    expanded_mask = np.maximum(expanded_mask, np.roll(mask_array, -shift, axis=1))
+                    expanded_mask = np.maximum(expanded_mask, np.roll(mask_array, shift, axis=0))
+                    expanded_mask = np.maximum(expanded_mask, np.roll(mask_array, -shift, axis=0))
+                mask_array = expanded_mask
+            except Exception:
+                # If any error, skip expansion
+                pass
+            
+            mask = Image.fromarray(mask_array, mode='L')
+            
+        elif IMAGEDRAW_AVAILABLE:
+            # Fallback: Use edge detection + center area
+            mask = Image.new('L', (width, height), 0)
+            
+            # Get edge image
+            gray = img.convert('L')
+            edge_img = gray.filter(ImageFilter.FIND_EDGES)
+            
+            # Create mask: subject is in center with edges
+            draw = ImageDraw.Draw(mask)
+            
+            # Draw ellipse in center (subject area)
+            center_x, center_y = width // 2, height // 2
+            ellipse_width = int(width * 0.7)
+            ellipse_height = int(height * 0.8)
+            
+            # Create ellipse but exclude bottom 20%
+            ellipse_top = max(0, center_y - ellipse_height // 2)
+            ellipse_bottom = min(height * 0.8, center_y + ellipse_height // 2)
+            
+            draw.ellipse([
+                center_x - ellipse_width // 2,
+                ellipse_top,
+                center_x + ellipse_width // 2,
+                ellipse_bottom
+            ], fill=255)
+            
+            # Also mark areas with high edge density
+            edge_pixels = edge_img.load()
+            mask_pixels = mask.load()
+            edge_threshold = 50  # Threshold for edge detection
+            
+            for y in range(height):
+                for x in range(width):
+                    if edge_pixels[x, y] > edge_threshold:
+                        # If near center, keep it
+                        dist_x = abs(x - center_x) / (width / 2)
+                        dist_y = abs(y - center_y) / (height / 2)
+                        if dist_x < 0.6 and dist_y < 0.7 and y < height * 0.85:
+                            mask_pixels[x, y] = 255
+        else:
+            # Simple fallback: center area only
+            mask = Image.new('L', (width, height), 0)
+            center_x, center_y = width // 2, height // 2
+            radius = min(width, height) * 0.4
+            
+            for y in range(height):
+                for x in range(width):
+                    dist = ((x - center_x)**2 + (y - center_y)**2)**0.5
+                    # Keep center area, exclude bottom
+                    if dist < radius and y < height * 0.8:
+                        mask.putpixel((x, y), 255)
+                    elif dist < radius * 1.2 and y < height * 0.8:
+                        fade = 1 - (dist - radius) / (radius * 0.2)
+                        mask.putpixel((x, y), int(255 * fade))
+        
+        # Smooth the mask edges
+        mask = mask.filter(ImageFilter.GaussianBlur(radius=20))
+        
+        # Apply mask: 255 = keep sharp (subject), 0 = blur (background)
+        if NUMPY_AVAILABLE:
+            img_array = np.array(img, dtype=np.float32)
+            blurred_array = np.array(blurred_img, dtype=np.float32)
+            mask_array = np.array(mask, dtype=np.float32) / 255.0
+            
+            # Expand mask to 3D if needed
+            if len(img_array.shape) == 3:
+                mask_array = np.expand_dims(mask_array, axis=2)
+            
+            # Blend: mask=1 (white/subject) = sharp, mask=0 (black/background) = blurred
+            result_array = img_array * mask_array + blurred_array * (1 - mask_array)
+            result_img = Image.fromarray(result_array.astype(np.uint8))
+        else:
+            # PIL composite: mask=white keeps original (sharp), mask=black uses blurred
+            result_img = Image.composite(img, blurred_img, mask)
+        
+        output_buffer = io.BytesIO()
+        if result_img.mode != 'RGB':
+            result_img = result_img.convert('RGB')
+        result_img.save(output_buffer, format='PNG', quality=95)
+        output_buffer.seek(0)
+        
+        if len(output_buffer.getvalue()) == 0:
+            raise Exception("Failed to generate output image")
+        
+        return output_buffer.getvalue()
+    except Exception as e:
+        logger.error(f"Background blur processing error: {e}", exc_info=True)
+        raise
 
 async def bgblur_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Blur only the background of an image, keeping foreground sharp."""
@@ -7341,193 +9489,14 @@ async def bgblur_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         processing_msg = await update.message.reply_text("🎨 Blurring background (keeping subject sharp)...")
         
-        loop = asyncio.get_event_loop()
         try:
-            file = await context.bot.get_file(photo.file_id)
-            file_path = file.file_path
+            image_bytes = await media_cache.get(context.bot, photo)
         except Exception as e:
             await processing_msg.delete()
             await update.message.reply_text(f"❌ Error downloading image: {str(e)}")
             return
         
-        def process_bgblur(file_path_url):
-            try:
-                if not PIL_AVAILABLE:
-                    raise ImportError("PIL not available")
-                
-                img_buffer = io.BytesIO()
-                response = requests.get(file_path_url, timeout=30)
-                if response.status_code != 200:
-                    raise Exception(f"Failed to download image: HTTP {response.status_code}")
-                img_buffer.write(response.content)
-                img_buffer.seek(0)
-                
-                img = Image.open(img_buffer)
-                img = img.convert('RGB')
-                width, height = img.size
-                
-                # Create blurred version
-                blurred_img = img.filter(ImageFilter.GaussianBlur(radius=10))
-                
-                # Create mask - keep foreground (subject) sharp, blur background
-                # Strategy: Use edge detection + color analysis to identify subject
-                if NUMPY_AVAILABLE:
-                    # Edge detection using PIL filter
-                    edge_img = img.convert('L').filter(ImageFilter.FIND_EDGES)
-                    edge_array = np.array(edge_img)
-                    
-                    # Create mask based on edge density and position
-                    # Subject is usually in center-upper area with more edges
-                    mask_array = np.zeros((height, width), dtype=np.uint8)
-                    
-                    # Method 1: Edge-based detection
-                    # Areas with more edges are likely to be subject
-                    edge_threshold = np.percentile(edge_array, 60)
-                    edge_mask = edge_array > edge_threshold
-                    
-                    # Method 2: Center-biased (subject is usually in center)
-                    y_coords, x_coords = np.ogrid[:height, :width]
-                    center_x, center_y = width // 2, height // 2
-                    
-                    # Create distance from center (normalized)
-                    dist_x = np.abs(x_coords - center_x) / (width / 2)
-                    dist_y = np.abs(y_coords - center_y) / (height / 2)
-                    dist_from_center = np.sqrt(dist_x**2 + dist_y**2)
-                    
-                    # Method 3: Bottom area is usually background
-                    # Assume bottom 25% is likely background
-                    bottom_threshold = height * 0.75
-                    is_bottom = y_coords > bottom_threshold
-                    
-                    # Combine methods to create mask
-                    # Subject = high edges + center area + not bottom
-                    subject_score = (
-                        (edge_mask.astype(float) * 0.4) +  # Edge importance
-                        ((1 - np.clip(dist_from_center, 0, 1)) * 0.4) +  # Center importance
-                        ((1 - is_bottom.astype(float)) * 0.2)  # Not bottom importance
-                    )
-                    
-                    # Normalize and threshold
-                    subject_score = (subject_score - subject_score.min()) / (subject_score.max() - subject_score.min() + 1e-8)
-                    
-                    # Threshold: keep top 50% as subject
-                    threshold = np.percentile(subject_score, 50)
-                    mask_array = (subject_score > threshold).astype(np.uint8) * 255
-                    
-                    # Expand subject area slightly to avoid cutting edges
-                    # Use simple numpy-based expansion if scipy not available
-                    try:
-                        from scipy import ndimage
-                        mask_array = ndimage.binary_dilation(mask_array > 0, iterations=3).astype(np.uint8) * 255
-                    except (ImportError, ModuleNotFoundError):
-                        # If scipy not available, use optimized numpy-based expansion
-                        # Create expanded mask by shifting and ORing
-                        expanded_mask = mask_array.copy()
-                        # Expand horizontally and vertically
-                        for shift in range(1, 4):
-                            # Shift left, right, up, down and combine
-                            expanded_mask = np.maximum(expanded_mask, np.roll(mask_array, shift, axis=1))
-                            expanded_mask = np.maximum(expanded_mask, np.roll(mask_array, -shift, axis=1))
-                            expanded_mask = np.maximum(expanded_mask, np.roll(mask_array, shift, axis=0))
-                            expanded_mask = np.maximum(expanded_mask, np.roll(mask_array, -shift, axis=0))
-                        mask_array = expanded_mask
-                    except Exception:
-                        # If any error, skip expansion
-                        pass
-                    
-                    mask = Image.fromarray(mask_array, mode='L')
-                    
-                elif IMAGEDRAW_AVAILABLE:
-                    # Fallback: Use edge detection + center area
-                    mask = Image.new('L', (width, height), 0)
-                    
-                    # Get edge image
-                    gray = img.convert('L')
-                    edge_img = gray.filter(ImageFilter.FIND_EDGES)
-                    
-                    # Create mask: subject is in center with edges
-                    draw = ImageDraw.Draw(mask)
-                    
-                    # Draw ellipse in center (subject area)
-                    center_x, center_y = width // 2, height // 2
-                    ellipse_width = int(width * 0.7)
-                    ellipse_height = int(height * 0.8)
-                    
-                    # Create ellipse but exclude bottom 20%
-                    ellipse_top = max(0, center_y - ellipse_height // 2)
-                    ellipse_bottom = min(height * 0.8, center_y + ellipse_height // 2)
-                    
-                    draw.ellipse([
-                        center_x - ellipse_width // 2,
-                        ellipse_top,
-                        center_x + ellipse_width // 2,
-                        ellipse_bottom
-                    ], fill=255)
-                    
-                    # Also mark areas with high edge density
-                    edge_pixels = edge_img.load()
-                    mask_pixels = mask.load()
-                    edge_threshold = 50  # Threshold for edge detection
-                    
-                    for y in range(height):
-                        for x in range(width):
-                            if edge_pixels[x, y] > edge_threshold:
-                                # If near center, keep it
-                                dist_x = abs(x - center_x) / (width / 2)
-                                dist_y = abs(y - center_y) / (height / 2)
-                                if dist_x < 0.6 and dist_y < 0.7 and y < height * 0.85:
-                                    mask_pixels[x, y] = 255
-                else:
-                    # Simple fallback: center area only
-                    mask = Image.new('L', (width, height), 0)
-                    center_x, center_y = width // 2, height // 2
-                    radius = min(width, height) * 0.4
-                    
-                    for y in range(height):
-                        for x in range(width):
-                            dist = ((x - center_x)**2 + (y - center_y)**2)**0.5
-                            # Keep center area, exclude bottom
-                            if dist < radius and y < height * 0.8:
-                                mask.putpixel((x, y), 255)
-                            elif dist < radius * 1.2 and y < height * 0.8:
-                                fade = 1 - (dist - radius) / (radius * 0.2)
-                                mask.putpixel((x, y), int(255 * fade))
-                
-                # Smooth the mask edges
-                mask = mask.filter(ImageFilter.GaussianBlur(radius=20))
-                
-                # Apply mask: 255 = keep sharp (subject), 0 = blur (background)
-                if NUMPY_AVAILABLE:
-                    img_array = np.array(img, dtype=np.float32)
-                    blurred_array = np.array(blurred_img, dtype=np.float32)
-                    mask_array = np.array(mask, dtype=np.float32) / 255.0
-                    
-                    # Expand mask to 3D if needed
-                    if len(img_array.shape) == 3:
-                        mask_array = np.expand_dims(mask_array, axis=2)
-                    
-                    # Blend: mask=1 (white/subject) = sharp, mask=0 (black/background) = blurred
-                    result_array = img_array * mask_array + blurred_array * (1 - mask_array)
-                    result_img = Image.fromarray(result_array.astype(np.uint8))
-                else:
-                    # PIL composite: mask=white keeps original (sharp), mask=black uses blurred
-                    result_img = Image.composite(img, blurred_img, mask)
-                
-                output_buffer = io.BytesIO()
-                if result_img.mode != 'RGB':
-                    result_img = result_img.convert('RGB')
-                result_img.save(output_buffer, format='PNG', quality=95)
-                output_buffer.seek(0)
-                
-                if len(output_buffer.getvalue()) == 0:
-                    raise Exception("Failed to generate output image")
-                
-                return output_buffer
-            except Exception as e:
-                logger.error(f"Background blur processing error: {e}", exc_info=True)
-                raise
-        
-        result_image = await loop.run_in_executor(None, process_bgblur, file_path)
+        result_image = io.BytesIO(await cpu_executor.run(blur_image_background, image_bytes))
         
         try:
             await processing_msg.delete()
@@ -7684,26 +9653,19 @@ async def enhance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "⏳ This may take a few seconds..."
         )
         
-        loop = asyncio.get_event_loop()
         try:
-            file = await context.bot.get_file(photo.file_id)
-            file_path = file.file_path
+            image_bytes = await media_cache.get(context.bot, photo)
         except Exception as e:
             await processing_msg.delete()
             await update.message.reply_text(f"❌ Error downloading image: {str(e)}")
             return
         
-        def process_professional_enhance(file_path_url):
+        def process_professional_enhance(image_bytes):
             try:
                 if not PIL_AVAILABLE:
                     raise ImportError("PIL not available")
                 
-                img_buffer = io.BytesIO()
-                response = requests.get(file_path_url, timeout=30)
-                if response.status_code != 200:
-                    raise Exception(f"Failed to download image: HTTP {response.status_code}")
-                img_buffer.write(response.content)
-                img_buffer.seek(0)
+                img_buffer = io.BytesIO(image_bytes)
                 
                 img = Image.open(img_buffer)
                 original_size = img.size
@@ -7726,7 +9688,7 @@ async def enhance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 logger.error(f"Professional enhance processing error: {e}", exc_info=True)
                 raise
         
-        result_image = await loop.run_in_executor(None, process_professional_enhance, file_path)
+        result_image = await image_executor.run(process_professional_enhance, image_bytes)
         
         try:
             await processing_msg.delete()
@@ -7814,26 +9776,19 @@ async def resize_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         processing_msg = await update.message.reply_text(f"📏 Resizing image to {width}x{height}...")
         
-        loop = asyncio.get_event_loop()
         try:
-            file = await context.bot.get_file(photo.file_id)
-            file_path = file.file_path
+            image_bytes = await media_cache.get(context.bot, photo)
         except Exception as e:
             await processing_msg.delete()
             await update.message.reply_text(f"❌ Error downloading image: {str(e)}")
             return
         
-        def process_resize(file_path_url, w, h):
+        def process_resize(image_bytes, w, h):
             try:
                 if not PIL_AVAILABLE:
                     raise ImportError("PIL not available")
                 
-                img_buffer = io.BytesIO()
-                response = requests.get(file_path_url, timeout=30)
-                if response.status_code != 200:
-                    raise Exception(f"Failed to download image: HTTP {response.status_code}")
-                img_buffer.write(response.content)
-                img_buffer.seek(0)
+                img_buffer = io.BytesIO(image_bytes)
                 
                 img = Image.open(img_buffer)
                 resized_img = img.resize((w, h), Image.Resampling.LANCZOS)
@@ -7855,7 +9810,7 @@ async def resize_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 logger.error(f"Resize processing error: {e}", exc_info=True)
                 raise
         
-        resized_image = await loop.run_in_executor(None, process_resize, file_path, width, height)
+        resized_image = await image_executor.run(process_resize, image_bytes, width, height)
         
         try:
             await processing_msg.delete()
@@ -7916,26 +9871,19 @@ async def tojpg_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         processing_msg = await update.message.reply_text("🖼️ Converting image to JPG...")
         
-        loop = asyncio.get_event_loop()
         try:
-            file = await context.bot.get_file(photo.file_id)
-            file_path = file.file_path
+            image_bytes = await media_cache.get(context.bot, photo)
         except Exception as e:
             await processing_msg.delete()
             await update.message.reply_text(f"❌ Error downloading image: {str(e)}")
             return
         
-        def process_to_jpg(file_path_url):
+        def process_to_jpg(image_bytes):
             try:
                 if not PIL_AVAILABLE:
                     raise ImportError("PIL not available")
                 
-                img_buffer = io.BytesIO()
-                response = requests.get(file_path_url, timeout=30)
-                if response.status_code != 200:
-                    raise Exception(f"Failed to download image: HTTP {response.status_code}")
-                img_buffer.write(response.content)
-                img_buffer.seek(0)
+                img_buffer = io.BytesIO(image_bytes)
                 
                 img = Image.open(img_buffer)
                 if img.mode != 'RGB':
@@ -7949,7 +9897,7 @@ async def tojpg_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 logger.error(f"ToJPG processing error: {e}", exc_info=True)
                 raise
         
-        jpg_image = await loop.run_in_executor(None, process_to_jpg, file_path)
+        jpg_image = await image_executor.run(process_to_jpg, image_bytes)
         
         try:
             await processing_msg.delete()
@@ -8012,30 +9960,19 @@ async def sticker_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         processing_msg = await update.message.reply_text("🎨 Converting image to sticker...")
         
-        loop = asyncio.get_event_loop()
         try:
-            file = await context.bot.get_file(photo.file_id)
-            # Build a fully-qualified Telegram file URL
-            if file.file_path and str(file.file_path).startswith('http'):
-                file_path = file.file_path
-            else:
-                file_path = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file.file_path}"
+            image_bytes = await media_cache.get(context.bot, photo)
         except Exception as e:
             await processing_msg.delete()
             await update.message.reply_text(f"❌ Error downloading image: {str(e)}")
             return
         
-        def process_to_sticker(file_path_url):
+        def process_to_sticker(image_bytes):
             try:
                 if not PIL_AVAILABLE:
                     raise ImportError("PIL not available")
                 
-                img_buffer = io.BytesIO()
-                response = requests.get(file_path_url, timeout=30)
-                if response.status_code != 200:
-                    raise Exception(f"Failed to download image: HTTP {response.status_code}")
-                img_buffer.write(response.content)
-                img_buffer.seek(0)
+                img_buffer = io.BytesIO(image_bytes)
                 
                 img = Image.open(img_buffer)
                 
@@ -8110,7 +10047,7 @@ async def sticker_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 logger.error(f"Sticker processing error: {e}", exc_info=True)
                 raise
         
-        sticker_image = await loop.run_in_executor(None, process_to_sticker, file_path)
+        sticker_image = await image_executor.run(process_to_sticker, image_bytes)
         
         try:
             await processing_msg.delete()
@@ -8169,10 +10106,6 @@ def detect_language(text):
 
 async def wiki_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Search Wikipedia for a topic."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     if not context.args:
         await update.message.reply_text(
             "❌ Please provide a topic to search!\n"
@@ -8188,7 +10121,7 @@ async def wiki_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     processing_msg = await update.message.reply_text(f"🔍 Searching Wikipedia ({lang_name}) for: {query}...")
     
     try:
-        search_result = search_wikipedia(query, lang=lang)
+        search_result = await search_wikipedia(query, lang=lang)
         
         try:
             await processing_msg.delete()
@@ -8229,94 +10162,116 @@ async def wiki_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Please try again later."
         )
 
-def search_wikipedia(query, lang='en'):
+# Wikipedia lookups are cached per (normalized query, language), including "no such page"
+WIKI_CACHE_SIZE = int(os.getenv("WIKI_CACHE_SIZE", "2048"))
+WIKI_CACHE_TTL = int(os.getenv("WIKI_CACHE_TTL", "21600"))  # seconds a found summary is reused
+WIKI_NEGATIVE_TTL = int(os.getenv("WIKI_NEGATIVE_TTL", "900"))  # seconds a miss is reused
+wikipedia_cache = TTLCache(WIKI_CACHE_SIZE, WIKI_CACHE_TTL, WIKI_NEGATIVE_TTL)
+
+async def search_wikipedia(query, lang='en'):
     """Search Wikipedia and return summary in specified language."""
+    clean_query = query.strip()
+    cache_key = (' '.join(clean_query.casefold().split()), lang)
+    try:
+        return await wikipedia_cache.get(cache_key, lambda: fetch_wikipedia_summary(clean_query, lang))
+    except httpx.TimeoutException:
+        logger.error("Wikipedia API timeout")
+        return None
+    except httpx.HTTPError as e:
+        logger.error(f"Wikipedia API request error: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"Wikipedia search unexpected error: {e}", exc_info=True)
+        return None
+
+async def fetch_wikipedia_summary(clean_query, lang):
+    """Look a query up on Wikipedia. Returns None when there is no such page and
+    raises when Wikipedia could not be asked, so that only real misses get cached."""
     headers = {
         'User-Agent': 'TelegramBot/1.0 (https://t.me/yourbot; contact@example.com)'
     }
     
+    client = get_http_client()
+    error = None
+    logger.info(f"Wikipedia search for: {clean_query} (language: {lang})")
+    
+    if lang == 'bn':
+        wiki_domain = "bn.wikipedia.org"
+    else:
+        wiki_domain = "en.wikipedia.org"
+    
+    search_api_url = f"https://{wiki_domain}/w/api.php"
+    base_url = f"https://{wiki_domain}/api/rest_v1/page/summary/"
+    
+    params = {
+        'action': 'query',
+        'format': 'json',
+        'list': 'search',
+        'srsearch': clean_query,
+        'srlimit': 1,
+        'srprop': 'snippet'
+    }
+    
     try:
-        clean_query = query.strip()
-        logger.info(f"Wikipedia search for: {clean_query} (language: {lang})")
-        
-        if lang == 'bn':
-            wiki_domain = "bn.wikipedia.org"
-        else:
-            wiki_domain = "en.wikipedia.org"
-        
-        search_api_url = f"https://{wiki_domain}/w/api.php"
-        base_url = f"https://{wiki_domain}/api/rest_v1/page/summary/"
-        
-        params = {
-            'action': 'query',
-            'format': 'json',
-            'list': 'search',
-            'srsearch': clean_query,
-            'srlimit': 1,
-            'srprop': 'snippet'
-        }
+        search_resp = await client.get(search_api_url, params=params, headers=headers, timeout=10)
+        logger.info(f"Search API status: {search_resp.status_code} (lang: {lang})")
+        search_resp.raise_for_status()
         
-        try:
-            search_resp = requests.get(search_api_url, params=params, headers=headers, timeout=10)
-            logger.info(f"Search API status: {search_resp.status_code} (lang: {lang})")
+        if search_resp.status_code == 200:
+            search_data = search_resp.json()
+            searches = search_data.get('query', {}).get('search', [])
             
-            if search_resp.status_code == 200:
-                search_data = search_resp.json()
-                searches = search_data.get('query', {}).get('search', [])
+            if searches and len(searches) > 0:
+                page_title = searches[0]['title']
+                logger.info(f"Found page: {page_title}")
                 
-                if searches and len(searches) > 0:
-                    page_title = searches[0]['title']
-                    logger.info(f"Found page: {page_title}")
-                    
-                    page_title_formatted = page_title.replace(' ', '_')
-                    encoded_title = quote(page_title_formatted, safe='')
-                    summary_url = base_url + encoded_title
-                    
-                    summary_resp = requests.get(summary_url, headers=headers, timeout=10)
-                    logger.info(f"Summary API status: {summary_resp.status_code}")
-                    
-                    if summary_resp.status_code == 200:
-                        data = summary_resp.json()
-                        result = {
-                            'title': data.get('title', page_title),
-                            'extract': data.get('extract', 'No summary available.'),
-                            'content_urls': data.get('content_urls', {})
-                        }
-                        logger.info(f"Successfully retrieved: {result.get('title')}")
-                        return result
-        except Exception as e:
-            logger.error(f"Search API error: {e}")
-        
-        if lang == 'en':
-            formatted_title = clean_query.title().replace(' ', '_')
-            encoded_title1 = quote(formatted_title, safe='')
-            url1 = base_url + encoded_title1
-            
-            try:
-                resp1 = requests.get(url1, headers=headers, timeout=10)
-                if resp1.status_code == 200:
-                    data = resp1.json()
-                    logger.info(f"Direct access success: {formatted_title}")
-                    return {
-                        'title': data.get('title', clean_query),
+                page_title_formatted = page_title.replace(' ', '_')
+                encoded_title = quote(page_title_formatted, safe='')
+                summary_url = base_url + encoded_title
+                
+                summary_resp = await client.get(summary_url, headers=headers, timeout=10)
+                logger.info(f"Summary API status: {summary_resp.status_code}")
+                if summary_resp.status_code != 404:
+                    summary_resp.raise_for_status()
+                
+                if summary_resp.status_code == 200:
+                    data = summary_resp.json()
+                    result = {
+                        'title': data.get('title', page_title),
                         'extract': data.get('extract', 'No summary available.'),
                         'content_urls': data.get('content_urls', {})
                     }
-            except Exception as e:
-                logger.error(f"Direct access error 1: {e}")
-        
-        logger.warning(f"Wikipedia search failed for: {clean_query} (lang: {lang})")
-        return None
-        
-    except requests.exceptions.Timeout:
-        logger.error("Wikipedia API timeout")
-        return None
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Wikipedia API request error: {e}")
-        return None
+                    logger.info(f"Successfully retrieved: {result.get('title')}")
+                    return result
     except Exception as e:
-        logger.error(f"Wikipedia search unexpected error: {e}", exc_info=True)
-        return None
+        logger.error(f"Search API error: {e}")
+        error = e
+    
+    if lang == 'en':
+        formatted_title = clean_query.title().replace(' ', '_')
+        encoded_title1 = quote(formatted_title, safe='')
+        url1 = base_url + encoded_title1
+        
+        try:
+            resp1 = await client.get(url1, headers=headers, timeout=10)
+            if resp1.status_code == 200:
+                data = resp1.json()
+                logger.info(f"Direct access success: {formatted_title}")
+                return {
+                    'title': data.get('title', clean_query),
+                    'extract': data.get('extract', 'No summary available.'),
+                    'content_urls': data.get('content_urls', {})
+                }
+            if resp1.status_code != 404:
+                resp1.raise_for_status()
+        except Exception as e:
+            logger.error(f"Direct access error 1: {e}")
+            error = error or e
+    
+    if error is not None:
+        raise error
+    logger.warning(f"Wikipedia search failed for: {clean_query} (lang: {lang})")
+    return None
 
 def calculate_math(expression, show_steps=False):
     """Safely calculate math expression with advanced features."""
@@ -8482,10 +10437,6 @@ def looks_like_image_prompt(text):
 
 async def text_to_speech(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Smart text handler - auto-detect if it's image generation or text-to-speech."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     try:
         text = update.message.text.strip()
         
@@ -8737,7 +10688,6 @@ async def text_to_speech(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         processing_msg = await update.message.reply_text("🎙️ Converting text to speech...")
         
-        loop = asyncio.get_event_loop()
         
         def generate_speech():
             tts = gTTS(text=text, lang='en', slow=False)
@@ -8746,7 +10696,7 @@ async def text_to_speech(update: Update, context: ContextTypes.DEFAULT_TYPE):
             audio_buffer.seek(0)
             return audio_buffer
         
-        audio_buffer = await loop.run_in_executor(None, generate_speech)
+        audio_buffer = await io_executor.run(generate_speech)
         
         await update.message.reply_audio(
             audio=audio_buffer,
@@ -8781,7 +10731,6 @@ async def auto_generate_image(update: Update, prompt: str):
             f"⏳ This may take 15-30 seconds..."
         )
         
-        loop = asyncio.get_event_loop()
         
         def generate_image():
             try:
@@ -8800,13 +10749,14 @@ async def auto_generate_image(update: Update, prompt: str):
                     try:
                         logger.info(f"Trying API {idx + 1}/{len(api_urls)}: {image_url[:80]}...")
                         
-                        response = requests.get(image_url, timeout=90, stream=True, headers=headers, allow_redirects=True)
+                        response = http_session.get(image_url, timeout=90, stream=True, headers=headers, allow_redirects=True)
                         
                         logger.info(f"Response status: {response.status_code}, Content-Type: {response.headers.get('Content-Type', 'unknown')}")
                         
                         if response.status_code == 200:
                             img_buffer = io.BytesIO()
                             for chunk in response.iter_content(chunk_size=8192):
+                                check_cancelled()
                                 if chunk:
                                     img_buffer.write(chunk)
                             
@@ -8854,7 +10804,7 @@ async def auto_generate_image(update: Update, prompt: str):
                 logger.error(f"Image generation error: {e}", exc_info=True)
                 raise
         
-        image_buffer = await loop.run_in_executor(None, generate_image)
+        image_buffer = await io_executor.run(generate_image)
         
         try:
             await processing_msg.delete()
@@ -8983,6 +10933,7 @@ async def auto_generate_image(update: Update, prompt: str):
             "• Or use `/generate <prompt>` command"
         )
 
+@heavy_command(PRIORITY_NORMAL)
 async def generate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Generate image from text prompt using free AI."""
     if not context.args:
@@ -9014,7 +10965,6 @@ async def generate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     try:
-        loop = asyncio.get_event_loop()
         
         def generate_image():
             try:
@@ -9042,7 +10992,7 @@ async def generate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         logger.info(f"Trying API {idx + 1}/{len(api_urls)}: {image_url[:80]}...")
                         
                         # Download the generated image
-                        response = requests.get(
+                        response = http_session.get(
                             image_url, 
                             timeout=90, 
                             stream=True,
@@ -9055,6 +11005,7 @@ async def generate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         if response.status_code == 200:
                             img_buffer = io.BytesIO()
                             for chunk in response.iter_content(chunk_size=8192):
+                                check_cancelled()
                                 if chunk:
                                     img_buffer.write(chunk)
                             
@@ -9123,7 +11074,7 @@ async def generate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 raise
         
         # Generate image in executor (blocking operation)
-        image_buffer = await loop.run_in_executor(None, generate_image)
+        image_buffer = await io_executor.run(generate_image)
         
         try:
             await processing_msg.delete()
@@ -9165,6 +11116,178 @@ async def generate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "🔄 The service may be busy, please try again shortly."
         )
 
+# Translation providers - instead of trying them one after another, the best-ranked
+# provider is asked first and the next one is hedged in if no answer came within
+# TRANSLATE_HEDGE_DELAY (or straight away if it failed); the first answer wins
+TRANSLATE_TIMEOUT = 10  # seconds per provider
+TRANSLATE_HEDGE_DELAY = float(os.getenv("TRANSLATE_HEDGE_DELAY", "1.5"))
+TRANSLATE_CACHE_SIZE = int(os.getenv("TRANSLATE_CACHE_SIZE", "4096"))
+TRANSLATE_CACHE_TTL = int(os.getenv("TRANSLATE_CACHE_TTL", "86400"))  # seconds a translation is reused
+
+class UpstreamProvider:
+    """One interchangeable upstream API with its observed latency and success rate."""
+
+    def __init__(self, name, call):
+        self.name = name
+        self.call = call  # async function(*args, timeout) returning a result, or None when it had no answer
+        self.latency = None  # moving average, seconds
+        self.success_rate = 1.0  # moving average
+        self.successes = 0
+        self.failures = 0
+
+    def record(self, elapsed, success=None):
+        """Add one observation; success=None for a call cut short (only its latency so far is known)."""
+        self.latency = elapsed if self.latency is None else 0.7 * self.latency + 0.3 * elapsed
+        if success is None:
+            return
+        self.success_rate = 0.7 * self.success_rate + 0.3 * (1.0 if success else 0.0)
+        if success:
+            self.successes += 1
+        else:
+            self.failures += 1
+
+    def expected_cost(self):
+        # Untried providers rank first once, so every provider gets measured
+        return (self.latency or 0.0) / max(self.success_rate, 0.05)
+
+class ProviderRace:
+    """Races a list of UpstreamProviders, best expected cost first, with hedged requests."""
+
+    def __init__(self, providers, hedge_delay, timeout):
+        self.providers = providers
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+
+    def ranked(self):
+        return sorted(self.providers, key=UpstreamProvider.expected_cost)
+
+    async def attempt(self, provider, args):
+        started = time.monotonic()
+        try:
+            # The timeout goes to the HTTP client rather than wait_for, so a hung provider
+            # fails with httpx.TimeoutException and counts against its circuit breaker;
+            # only hedge losers end by cancellation
+            result = await provider.call(*args, timeout=self.timeout)
+        except asyncio.CancelledError:
+            provider.record(time.monotonic() - started)
+            raise
+        except Exception as e:
+            logger.warning(f"{provider.name} failed: {e}")
+            result = None
+        provider.record(time.monotonic() - started, result is not None)
+        return result
+
+    async def run(self, *args):
+        """Return the first result any provider gives for args, or None if all fail."""
+        queue = self.ranked()
+        running = set()
+        try:
+            while queue or running:
+                if queue:
+                    running.add(asyncio.create_task(self.attempt(queue.pop(0), args)))
+                done, running = await asyncio.wait(
+                    running, timeout=self.hedge_delay if queue else None, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result() is not None:
+                        return task.result()
+            return None
+        finally:
+            for task in running:
+                task.cancel()
+            # Let the losers record how long they had been running
+            await asyncio.gather(*running, return_exceptions=True)
+
+async def translate_mymemory(text, target_lang, timeout=TRANSLATE_TIMEOUT):
+    """MyMemory Translation API (free, no API key needed)."""
+    params = {
+        'q': text,
+        'langpair': f'auto|{target_lang}'
+    }
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    }
+    response = await get_http_client().get("https://api.mymemory.translated.net/get", params=params, headers=headers, timeout=timeout)
+    if response.status_code == 200:
+        data = response.json()
+        if data.get('responseStatus') == 200:
+            translated_text = data['responseData']['translatedText']
+            if translated_text:
+                return {
+                    'translated': translated_text,
+                    'detected': data.get('responseData', {}).get('detectedSourceLanguage', 'auto'),
+                    'target': target_lang
+                }
+    return None
+
+async def translate_libre(text, target_lang, timeout=TRANSLATE_TIMEOUT):
+    """LibreTranslate (free alternative)."""
+    payload = {
+        'q': text,
+        'source': 'auto',
+        'target': target_lang,
+        'format': 'text'
+    }
+    headers = {
+        'Content-Type': 'application/json',
+        'User-Agent': 'Mozilla/5.0'
+    }
+    response = await get_http_client().post("https://libretranslate.com/translate", json=payload, headers=headers, timeout=timeout)
+    if response.status_code == 200:
+        data = response.json()
+        if data.get('translatedText'):
+            return {
+                'translated': data['translatedText'],
+                'detected': data.get('detectedLanguage', {}).get('language', 'auto'),
+                'target': target_lang
+            }
+    return None
+
+async def translate_google(text, target_lang, timeout=TRANSLATE_TIMEOUT):
+    """Google Translate web endpoint."""
+    params = {
+        'client': 'gtx',
+        'sl': 'auto',
+        'tl': target_lang,
+        'dt': 't',
+        'q': text
+    }
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    }
+    response = await get_http_client().get("https://translate.googleapis.com/translate_a/single", params=params, headers=headers, timeout=timeout)
+    if response.status_code == 200:
+        data = response.json()
+        if data and len(data) > 0 and data[0]:
+            translated_text = ''.join(item[0] for item in data[0] if item[0])
+            if translated_text:
+                return {
+                    'translated': translated_text,
+                    'detected': data[2] if len(data) > 2 else 'auto',
+                    'target': target_lang
+                }
+    return None
+
+translation_race = ProviderRace(
+    [
+        UpstreamProvider('MyMemory', translate_mymemory),
+        UpstreamProvider('LibreTranslate', translate_libre),
+        UpstreamProvider('Google Translate', translate_google),
+    ],
+    TRANSLATE_HEDGE_DELAY, TRANSLATE_TIMEOUT)
+translation_cache = TTLCache(TRANSLATE_CACHE_SIZE, TRANSLATE_CACHE_TTL)
+
+async def translate_text(text, target_lang):
+    """Translate text, from the cache when the same text was translated recently."""
+    cache_key = (hashlib.sha256(text.encode('utf-8')).hexdigest(), target_lang)
+    return await translation_cache.get(cache_key, lambda: race_translation(text, target_lang))
+
+async def race_translation(text, target_lang):
+    result = await translation_race.run(text, target_lang)
+    if result is None:
+        logger.error(f"Translation error: all providers failed for target '{target_lang}'")
+        raise Exception("All translation APIs failed. Please check the language code and try again.")
+    return result
+
 async def translate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Translate text between languages."""
     if not context.args or len(context.args) < 2:
@@ -9204,112 +11327,7 @@ async def translate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     processing_msg = await update.message.reply_text(f"🌐 Translating to {target_lang.upper()}...")
     
     try:
-        loop = asyncio.get_event_loop()
-        
-        def translate_text():
-            try:
-                # Method 1: Try MyMemory Translation API (free, no API key needed)
-                try:
-                    api_url = "https://api.mymemory.translated.net/get"
-                    
-                    params = {
-                        'q': text_to_translate,
-                        'langpair': f'auto|{target_lang}'
-                    }
-                    
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                    }
-                    
-                    response = requests.get(api_url, params=params, headers=headers, timeout=10)
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        
-                        if data.get('responseStatus') == 200:
-                            translated_text = data['responseData']['translatedText']
-                            detected_lang = data.get('responseData', {}).get('detectedSourceLanguage', 'auto')
-                            
-                            # Clean up translation (sometimes API returns extra text)
-                            if translated_text and len(translated_text) > 0:
-                                return {
-                                    'translated': translated_text,
-                                    'detected': detected_lang,
-                                    'target': target_lang
-                                }
-                except Exception as e:
-                    logger.warning(f"MyMemory API failed: {e}")
-                
-                # Method 2: Try LibreTranslate (free alternative)
-                try:
-                    libre_url = "https://libretranslate.com/translate"
-                    
-                    payload = {
-                        'q': text_to_translate,
-                        'source': 'auto',
-                        'target': target_lang,
-                        'format': 'text'
-                    }
-                    
-                    headers = {
-                        'Content-Type': 'application/json',
-                        'User-Agent': 'Mozilla/5.0'
-                    }
-                    
-                    response = requests.post(libre_url, json=payload, headers=headers, timeout=10)
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        if data.get('translatedText'):
-                            return {
-                                'translated': data['translatedText'],
-                                'detected': data.get('detectedLanguage', {}).get('language', 'auto'),
-                                'target': target_lang
-                            }
-                except Exception as e:
-                    logger.warning(f"LibreTranslate API failed: {e}")
-                
-                # Method 3: Try Google Translate via web scraping (fallback)
-                try:
-                    # Use a simple translation service
-                    google_url = f"https://translate.googleapis.com/translate_a/single"
-                    params = {
-                        'client': 'gtx',
-                        'sl': 'auto',
-                        'tl': target_lang,
-                        'dt': 't',
-                        'q': text_to_translate
-                    }
-                    
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                    }
-                    
-                    response = requests.get(google_url, params=params, headers=headers, timeout=10)
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        if data and len(data) > 0 and len(data[0]) > 0:
-                            translated_parts = [item[0] for item in data[0] if item[0]]
-                            translated_text = ''.join(translated_parts)
-                            
-                            if translated_text:
-                                return {
-                                    'translated': translated_text,
-                                    'detected': data[2] if len(data) > 2 else 'auto',
-                                    'target': target_lang
-                                }
-                except Exception as e:
-                    logger.warning(f"Google Translate API failed: {e}")
-                
-                # All methods failed
-                raise Exception("All translation APIs failed. Please check the language code and try again.")
-            
-            except Exception as e:
-                logger.error(f"Translation error: {e}", exc_info=True)
-                raise
-        
-        result = await loop.run_in_executor(None, translate_text)
+        result = await translate_text(text_to_translate, target_lang)
         
         try:
             await processing_msg.delete()
@@ -9426,25 +11444,18 @@ async def ocr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         processing_msg = await update.message.reply_text("📸 Extracting text from image...")
         
-        loop = asyncio.get_event_loop()
         try:
-            file = await context.bot.get_file(photo.file_id)
-            # Build a fully-qualified Telegram file URL for external OCR services
-            if file.file_path and str(file.file_path).startswith('http'):
-                file_url_for_ocr = file.file_path
-            else:
-                file_url_for_ocr = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file.file_path}"
+            image_bytes = await media_cache.get(context.bot, photo)
         except Exception as e:
             await processing_msg.delete()
             await update.message.reply_text(f"❌ Error downloading image: {str(e)}")
             return
         
-        def extract_text_from_image(file_path_url):
+        def extract_text_from_image(image_bytes):
             try:
                 # Method 0: Local Tesseract OCR first (no API key)
                 try:
                     import io as _io
-                    import requests as _req
                     import shutil as _shutil
                     import os as _os
                     try:
@@ -9458,9 +11469,8 @@ async def ocr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             tesseract_exe = default_win_path
                         if tesseract_exe:
                             _pyt.pytesseract.tesseract_cmd = tesseract_exe
-                            img_resp = _req.get(file_path_url, timeout=30)
-                            if img_resp.status_code == 200 and img_resp.content:
-                                buf = _io.BytesIO(img_resp.content)
+                            if image_bytes:
+                                buf = _io.BytesIO(image_bytes)
                                 pil_img = Image.open(buf)
                                 try:
                                     from PIL import ImageOps
@@ -9489,13 +11499,15 @@ async def ocr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 except Exception as _e:
                     logger.warning(f"Local Tesseract OCR attempt failed: {_e}")
 
-                # Method 1: Try OCR.space API (free tier)
+                # Method 1: Try OCR.space API (free tier), uploading the photo as-is
                 try:
-                    ocr_url = "https://api.ocr.space/parse/imageurl"
+                    ocr_url = "https://api.ocr.space/parse/image"
+                    files = {
+                        'file': ('image.jpg', image_bytes, 'image/jpeg')
+                    }
                     
                     payload = {
                         'apikey': OCR_SPACE_API_KEY,
-                        'url': file_path_url,
                         'language': ocr_lang_primary,  # Use primary to avoid API E201
                         'isOverlayRequired': False,
                         'detectOrientation': True,
@@ -9507,7 +11519,7 @@ async def ocr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         'User-Agent': 'Mozilla/5.0'
                     }
                     
-                    response = requests.post(ocr_url, data=payload, headers=headers, timeout=45)
+                    response = http_session.post(ocr_url, files=files, data=payload, headers=headers, timeout=45)
                     
                     if response.status_code == 200:
                         data = response.json()
@@ -9521,7 +11533,7 @@ async def ocr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                     try:
                                         retry_payload = payload.copy()
                                         retry_payload['language'] = candidate
-                                        retry_resp = requests.post(ocr_url, data=retry_payload, headers=headers, timeout=45)
+                                        retry_resp = http_session.post(ocr_url, files=files, data=retry_payload, headers=headers, timeout=45)
                                         if retry_resp.status_code == 200:
                                             retry_data = retry_resp.json()
                                             if retry_data.get('ParsedResults') and len(retry_data['ParsedResults']) > 0:
@@ -9539,13 +11551,12 @@ async def ocr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 except Exception as e:
                     logger.warning(f"OCR.space API failed: {e}")
                 
-                # Method 2: Download image and try alternative OCR
+                # Method 2: Preprocess the image and try alternative OCR
                 try:
-                    img_response = requests.get(file_path_url, timeout=30)
-                    if img_response.status_code == 200:
+                    if image_bytes:
                         # Try using PIL to process image if available
                         if PIL_AVAILABLE:
-                            img_buffer = io.BytesIO(img_response.content)
+                            img_buffer = io.BytesIO(image_bytes)
                             img = Image.open(img_buffer)
                             
                             # Convert to RGB if needed
@@ -9587,7 +11598,7 @@ async def ocr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                 'OCREngine': 2
                             }
                             
-                            response = requests.post(ocr_url, files=files, data=payload, timeout=45)
+                            response = http_session.post(ocr_url, files=files, data=payload, timeout=45)
                             
                             if response.status_code == 200:
                                 data = response.json()
@@ -9599,7 +11610,7 @@ async def ocr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                             try:
                                                 retry_payload = payload.copy()
                                                 retry_payload['language'] = candidate
-                                                retry_resp = requests.post(ocr_url, files=files, data=retry_payload, timeout=45)
+                                                retry_resp = http_session.post(ocr_url, files=files, data=retry_payload, timeout=45)
                                                 if retry_resp.status_code == 200:
                                                     retry_data = retry_resp.json()
                                                     if retry_data.get('ParsedResults') and len(retry_data['ParsedResults']) > 0:
@@ -9618,7 +11629,6 @@ async def ocr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 # Method 3: Local Tesseract OCR fallback (if available)
                 try:
                     import io as _io
-                    import requests as _req
                     import shutil as _shutil
                     import os as _os
                     try:
@@ -9633,10 +11643,8 @@ async def ocr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             tesseract_exe = default_win_path
                         if tesseract_exe:
                             _pyt.pytesseract.tesseract_cmd = tesseract_exe
-                            # Download image bytes
-                            img_resp = _req.get(file_path_url, timeout=30)
-                            if img_resp.status_code == 200 and img_resp.content:
-                                buf = _io.BytesIO(img_resp.content)
+                            if image_bytes:
+                                buf = _io.BytesIO(image_bytes)
                                 pil_img = Image.open(buf)
                                 # Preprocess for OCR
                                 try:
@@ -9676,7 +11684,7 @@ async def ocr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 logger.error(f"OCR extraction error: {e}", exc_info=True)
                 raise
         
-        extracted_text = await loop.run_in_executor(None, extract_text_from_image, file_url_for_ocr)
+        extracted_text = await image_executor.run(extract_text_from_image, image_bytes)
         
         try:
             await processing_msg.delete()
@@ -9728,6 +11736,7 @@ async def ocr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "• Try again in a moment"
         )
 
+@heavy_command(PRIORITY_INTERACTIVE)
 async def imagetopdf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Convert image(s) to PDF."""
     if not PIL_AVAILABLE:
@@ -9795,143 +11804,21 @@ async def imagetopdf_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         images_to_process = []
         if photo:
             images_to_process.append(photo)
-        if doc:
-            images_to_process.append(doc)
-        
-        loop = asyncio.get_event_loop()
-        
-        def convert_images_to_pdf(image_list):
-            try:
-                pdf_images = []
-                
-                for img_item in image_list:
-                    try:
-                        # Download image
-                        file = None
-                        if hasattr(img_item, 'file_id'):
-                            # It's a PhotoSize or Document
-                            file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/"
-                            # We need to download it
-                            response = requests.get(f"{file_url}{img_item.file_path if hasattr(img_item, 'file_path') else ''}", timeout=30)
-                            if response.status_code == 200:
-                                img_data = response.content
-                            else:
-                                # Try to get file path
-                                continue
-                        else:
-                            continue
-                        
-                        # Open image with PIL
-                        img_buffer = io.BytesIO(img_data) if 'img_data' in locals() else None
-                        if not img_buffer:
-                            continue
-                        
-                        img = Image.open(img_buffer)
-                        
-                        # Convert to RGB if needed (PDF requires RGB)
-                        if img.mode != 'RGB':
-                            img = img.convert('RGB')
-                        
-                        pdf_images.append(img)
-                        
-                    except Exception as e:
-                        logger.warning(f"Error processing image: {e}")
-                        continue
-                
-                if not pdf_images:
-                    return None
-                
-                # Create PDF
-                pdf_buffer = io.BytesIO()
-                
-                if len(pdf_images) == 1:
-                    # Single image PDF
-                    pdf_images[0].save(pdf_buffer, format='PDF', quality=95)
-                else:
-                    # Multi-page PDF - save first image, then append others
-                    pdf_images[0].save(pdf_buffer, format='PDF', save_all=True, append_images=pdf_images[1:] if len(pdf_images) > 1 else [], quality=95)
-                
-                pdf_buffer.seek(0)
-                return pdf_buffer
-                
-            except Exception as e:
-                logger.error(f"PDF conversion error: {e}", exc_info=True)
-                return None
+        if doc:
+            images_to_process.append(doc)
         
-        # Download images first
+        
+        # Download images first (concurrently); skip any that have expired or fail
+        results = await asyncio.gather(
+            *(media_cache.get(context.bot, img_item) for img_item in images_to_process),
+            return_exceptions=True
+        )
         image_data_list = []
-        for img_item in images_to_process:
-            try:
-                # Get file object
-                file = await context.bot.get_file(img_item.file_id)
-                
-                # Check if file_path is available
-                if not file.file_path:
-                    logger.warning(f"File path is None for file_id: {img_item.file_id}")
-                    # Try to get file info again
-                    raise Exception("File path not available")
-                
-                # Download using file URL (Telegram Bot API)
-                # Construct full URL
-                if file.file_path.startswith('http'):
-                    file_url = file.file_path
-                else:
-                    file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file.file_path}"
-                
-                logger.info(f"Downloading image from: {file_url[:100]}...")
-                response = requests.get(file_url, timeout=30, headers={'User-Agent': 'Mozilla/5.0'}, allow_redirects=True)
-                
-                if response.status_code == 200 and response.content:
-                    img_data = response.content
-                    if len(img_data) > 0:
-                        image_data_list.append(img_data)
-                        logger.info(f"Successfully downloaded image: {len(img_data)} bytes, file_id: {img_item.file_id}")
-                    else:
-                        logger.warning(f"Downloaded image is empty for file_id: {img_item.file_id}")
-                        raise Exception("Downloaded image is empty")
-                elif response.status_code == 404:
-                    logger.warning(f"File not found (404) for file_id: {img_item.file_id} - file may have expired or been deleted")
-                    raise Exception("File not found or expired - please send the image again")
-                else:
-                    raise Exception(f"Failed to download image: HTTP {response.status_code}")
-                    
-            except Exception as e:
-                error_msg = str(e)
-                logger.error(f"Error downloading image: {error_msg}")
-                
-                # If it's a 404 or file not found, skip this image and inform user
-                if "404" in error_msg or "not found" in error_msg.lower() or "expired" in error_msg.lower():
-                    logger.warning(f"Skipping image {img_item.file_id} - file not available")
-                    continue
-                
-                # Try alternative: download using stream
-                try:
-                    file = await context.bot.get_file(img_item.file_id)
-                    if file.file_path:
-                        file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file.file_path}"
-                        response = requests.get(file_url, timeout=30, stream=True, headers={'User-Agent': 'Mozilla/5.0'}, allow_redirects=True)
-                        if response.status_code == 200:
-                            file_buffer = io.BytesIO()
-                            for chunk in response.iter_content(chunk_size=8192):
-                                if chunk:
-                                    file_buffer.write(chunk)
-                            file_buffer.seek(0)
-                            img_data = file_buffer.read()
-                            if len(img_data) > 0:
-                                image_data_list.append(img_data)
-                                logger.info(f"Downloaded via stream fallback: {len(img_data)} bytes")
-                            else:
-                                logger.warning(f"Stream download returned empty data")
-                                continue
-                        else:
-                            logger.warning(f"Stream download failed: HTTP {response.status_code}")
-                            continue
-                    else:
-                        logger.warning(f"No file path available for alternative download")
-                        continue
-                except Exception as e2:
-                    logger.error(f"Alternative download method also failed: {e2}")
-                continue
+        for img_item, result in zip(images_to_process, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"Error downloading image {img_item.file_id}: {result}")
+            elif result:
+                image_data_list.append(result)
         
         if not image_data_list:
             await processing_msg.delete()
@@ -9989,7 +11876,7 @@ async def imagetopdf_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 logger.error(f"PDF conversion error: {e}", exc_info=True)
                 return None
         
-        pdf_file = await loop.run_in_executor(None, create_pdf_from_images, image_data_list)
+        pdf_file = await image_executor.run(create_pdf_from_images, image_data_list)
         
         try:
             await processing_msg.delete()
@@ -10045,6 +11932,67 @@ async def imagetopdf_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
             "• Ensure Pillow is installed correctly"
         )
 
+def render_pdf_pages(pdf_bytes):
+    """Render every page of a PDF to a PNG buffer (runs in the CPU pool)."""
+    try:
+        # Import fitz inside the function to avoid scope issues
+        import fitz as fitz_module
+        # Open PDF with PyMuPDF
+        pdf_buffer = io.BytesIO(pdf_bytes)
+        pdf_document = fitz_module.open(stream=pdf_buffer, filetype="pdf")
+        
+        images = []
+        total_pages = len(pdf_document)
+        
+        logger.info(f"Converting PDF with {total_pages} pages to images...")
+        
+        for page_num in range(total_pages):
+            try:
+                # Get page
+                page = pdf_document[page_num]
+                
+                # Convert page to image (zoom factor 2 for better quality)
+                zoom = 2.0
+                mat = fitz_module.Matrix(zoom, zoom)
+                pix = page.get_pixmap(matrix=mat)
+                
+                # Convert to PIL Image
+                img_data = pix.tobytes("png")
+                img = Image.open(io.BytesIO(img_data))
+                
+                # Convert to RGB if needed
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
+                
+                # Save to buffer
+                img_buffer = io.BytesIO()
+                img.save(img_buffer, format='PNG')
+                img_buffer.seek(0)
+                
+                images.append({
+                    'buffer': img_buffer,
+                    'page_num': page_num + 1,
+                    'size': len(img_data)
+                })
+                
+                logger.info(f"Converted page {page_num + 1}/{total_pages}")
+                
+            except Exception as e:
+                logger.warning(f"Error converting page {page_num + 1}: {e}")
+                continue
+        
+        pdf_document.close()
+        
+        if not images:
+            return None
+        
+        return images
+        
+    except Exception as e:
+        logger.error(f"PDF conversion error: {e}", exc_info=True)
+        return None
+
+@heavy_command(PRIORITY_INTERACTIVE)
 async def pdftoimage_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Convert PDF pages to images."""
     if not PDF_AVAILABLE:
@@ -10152,34 +12100,7 @@ async def pdftoimage_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
         # Download PDF file
         try:
-            file = await context.bot.get_file(pdf_doc.file_id)
-            
-            if not file.file_path:
-                await processing_msg.delete()
-                await update.message.reply_text(
-                    "❌ Could not get PDF file path.\n\n"
-                    "Please try sending the PDF again."
-                )
-                return
-            
-            # Construct file URL
-            if file.file_path.startswith('http'):
-                file_url = file.file_path
-            else:
-                file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file.file_path}"
-            
-            logger.info(f"Downloading PDF from: {file_url[:100]}...")
-            response = requests.get(file_url, timeout=60, headers={'User-Agent': 'Mozilla/5.0'}, allow_redirects=True)
-            
-            if response.status_code != 200:
-                await processing_msg.delete()
-                await update.message.reply_text(
-                    f"❌ Failed to download PDF: HTTP {response.status_code}\n\n"
-                    "Please try again."
-                )
-                return
-            
-            pdf_data = response.content
+            pdf_data = await media_cache.get(context.bot, pdf_doc)
             if len(pdf_data) == 0:
                 await processing_msg.delete()
                 await update.message.reply_text(
@@ -10200,69 +12121,7 @@ async def pdftoimage_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return
         
         # Convert PDF to images
-        loop = asyncio.get_event_loop()
-        
-        def convert_pdf_to_images(pdf_bytes):
-            try:
-                # Import fitz inside the function to avoid scope issues
-                import fitz as fitz_module
-                # Open PDF with PyMuPDF
-                pdf_buffer = io.BytesIO(pdf_bytes)
-                pdf_document = fitz_module.open(stream=pdf_buffer, filetype="pdf")
-                
-                images = []
-                total_pages = len(pdf_document)
-                
-                logger.info(f"Converting PDF with {total_pages} pages to images...")
-                
-                for page_num in range(total_pages):
-                    try:
-                        # Get page
-                        page = pdf_document[page_num]
-                        
-                        # Convert page to image (zoom factor 2 for better quality)
-                        zoom = 2.0
-                        mat = fitz_module.Matrix(zoom, zoom)
-                        pix = page.get_pixmap(matrix=mat)
-                        
-                        # Convert to PIL Image
-                        img_data = pix.tobytes("png")
-                        img = Image.open(io.BytesIO(img_data))
-                        
-                        # Convert to RGB if needed
-                        if img.mode != 'RGB':
-                            img = img.convert('RGB')
-                        
-                        # Save to buffer
-                        img_buffer = io.BytesIO()
-                        img.save(img_buffer, format='PNG')
-                        img_buffer.seek(0)
-                        
-                        images.append({
-                            'buffer': img_buffer,
-                            'page_num': page_num + 1,
-                            'size': len(img_data)
-                        })
-                        
-                        logger.info(f"Converted page {page_num + 1}/{total_pages}")
-                        
-                    except Exception as e:
-                        logger.warning(f"Error converting page {page_num + 1}: {e}")
-                        continue
-                
-                pdf_document.close()
-                
-                if not images:
-                    return None
-                
-                return images
-                
-            except Exception as e:
-                logger.error(f"PDF conversion error: {e}", exc_info=True)
-                return None
-        
-        # Convert PDF to images
-        images = await loop.run_in_executor(None, convert_pdf_to_images, pdf_data)
+        images = await cpu_executor.run(render_pdf_pages, pdf_data)
         
         try:
             await processing_msg.delete()
@@ -10412,17 +12271,16 @@ async def textonimage_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             encoded_text = quote(text)
             image_url = f"https://image.pollinations.ai/prompt/a%20beautiful%20image%20with%20text%20that%20says%20{encoded_text}?width=800&height=400&enhance=true"
             
-            loop = asyncio.get_event_loop()
             
             def download_image():
-                response = requests.get(image_url, timeout=30, headers={'User-Agent': 'Mozilla/5.0'})
+                response = http_session.get(image_url, timeout=30, headers={'User-Agent': 'Mozilla/5.0'})
                 if response.status_code == 200:
                     img_buffer = io.BytesIO(response.content)
                     img_buffer.seek(0)
                     return img_buffer
                 raise Exception("Failed to generate image")
             
-            image_buffer = await loop.run_in_executor(None, download_image)
+            image_buffer = await io_executor.run(download_image)
             
             try:
                 await processing_msg.delete()
@@ -10459,7 +12317,6 @@ async def textonimage_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     processing_msg = await update.message.reply_text("📝 Creating image with text...")
     
     try:
-        loop = asyncio.get_event_loop()
         
         def create_text_image():
             try:
@@ -10614,7 +12471,7 @@ async def textonimage_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         
         try:
             image_buffer = await asyncio.wait_for(
-                loop.run_in_executor(None, create_text_image),
+                image_executor.run(create_text_image),
                 timeout=30.0  # 30 second timeout
             )
         except asyncio.TimeoutError:
@@ -10662,12 +12519,9 @@ async def textonimage_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             "• Try again"
         )
 
+@heavy_command(PRIORITY_BULK)
 async def tiktok_download_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Download TikTok video from URL."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     if not context.args:
         await update.message.reply_text(
             "🎵 **TikTok Video Download**\n\n"
@@ -10699,7 +12553,6 @@ async def tiktok_download_command(update: Update, context: ContextTypes.DEFAULT_
     processing_msg = await update.message.reply_text("🎵 Downloading TikTok video...\n⏳ Please wait...")
     
     try:
-        loop = asyncio.get_event_loop()
         
         def download_tiktok_video(video_url):
             try:
@@ -10717,7 +12570,7 @@ async def tiktok_download_command(update: Update, context: ContextTypes.DEFAULT_
                         'Referer': 'https://tiklydown.eu.org/'
                     }
                     
-                    response = requests.get(api_urls[0], headers=headers, timeout=30, allow_redirects=True)
+                    response = http_session.get(api_urls[0], headers=headers, timeout=30, allow_redirects=True)
                     
                     if response.status_code == 200:
                         try:
@@ -10756,11 +12609,12 @@ async def tiktok_download_command(update: Update, context: ContextTypes.DEFAULT_
                                 
                                 if video_url:
                                     # Download the video
-                                    video_response = requests.get(video_url, headers=headers, timeout=60, stream=True)
+                                    video_response = http_session.get(video_url, headers=headers, timeout=60, stream=True)
                                     
                                     if video_response.status_code == 200:
                                         video_buffer = io.BytesIO()
                                         for chunk in video_response.iter_content(chunk_size=8192):
+                                            check_cancelled()
                                             if chunk:
                                                 video_buffer.write(chunk)
                                         video_buffer.seek(0)
@@ -10787,7 +12641,7 @@ async def tiktok_download_command(update: Update, context: ContextTypes.DEFAULT_
                         'User-Agent': 'com.ss.android.ugc.trill/494 (Linux; U; Android 10; en_US; Pixel 4; Build/QQ3A.200805.001; Cronet/58.0.2991.0)',
                         'Accept': 'application/json',
                     }
-                    response = requests.get(alt_api, headers=headers, timeout=30)
+                    response = http_session.get(alt_api, headers=headers, timeout=30)
                     if response.status_code == 200:
                         data = response.json()
                         # Parse TikTok API response
@@ -10795,10 +12649,11 @@ async def tiktok_download_command(update: Update, context: ContextTypes.DEFAULT_
                             aweme = data['aweme_list'][0]
                             video_url = aweme.get('video', {}).get('play_addr', {}).get('url_list', [])
                             if video_url:
-                                video_response = requests.get(video_url[0], headers=headers, timeout=60, stream=True)
+                                video_response = http_session.get(video_url[0], headers=headers, timeout=60, stream=True)
                                 if video_response.status_code == 200:
                                     video_buffer = io.BytesIO()
                                     for chunk in video_response.iter_content(chunk_size=8192):
+                                        check_cancelled()
                                         if chunk:
                                             video_buffer.write(chunk)
                                     video_buffer.seek(0)
@@ -10821,7 +12676,7 @@ async def tiktok_download_command(update: Update, context: ContextTypes.DEFAULT_
                         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
                         'Accept': 'application/json',
                     }
-                    response = requests.get(downloader_api, headers=headers, timeout=30)
+                    response = http_session.get(downloader_api, headers=headers, timeout=30)
                     
                     if response.status_code == 200:
                         data = response.json()
@@ -10830,10 +12685,11 @@ async def tiktok_download_command(update: Update, context: ContextTypes.DEFAULT_
                             video_url = video_data.get('hdplay') or video_data.get('play') or video_data.get('wmplay')
                             
                             if video_url:
-                                video_response = requests.get(video_url, headers=headers, timeout=60, stream=True)
+                                video_response = http_session.get(video_url, headers=headers, timeout=60, stream=True)
                                 if video_response.status_code == 200:
                                     video_buffer = io.BytesIO()
                                     for chunk in video_response.iter_content(chunk_size=8192):
+                                        check_cancelled()
                                         if chunk:
                                             video_buffer.write(chunk)
                                     video_buffer.seek(0)
@@ -10858,7 +12714,7 @@ async def tiktok_download_command(update: Update, context: ContextTypes.DEFAULT_
         
         # Download video in executor
         result = await asyncio.wait_for(
-            loop.run_in_executor(None, download_tiktok_video, url),
+            download_executor.run(download_tiktok_video, url),
             timeout=120.0  # 2 minute timeout
         )
         
@@ -10926,12 +12782,9 @@ async def tiktok_download_command(update: Update, context: ContextTypes.DEFAULT_
             "• Try again in a few moments"
         )
 
+@heavy_command(PRIORITY_BULK)
 async def youtube_download_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Download YouTube video from URL."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     if not context.args:
         await update.message.reply_text(
             "📺 **YouTube Video Download**\n\n"
@@ -10983,7 +12836,6 @@ async def youtube_download_command(update: Update, context: ContextTypes.DEFAULT
     processing_msg = await update.message.reply_text("📺 Downloading YouTube video...\n⏳ Please wait...")
     
     try:
-        loop = asyncio.get_event_loop()
         
         def download_youtube_video(video_url, requested_quality=None):
             import tempfile
@@ -11091,7 +12943,7 @@ async def youtube_download_command(update: Update, context: ContextTypes.DEFAULT
                     'outtmpl': tmp_path_pattern,
                     'quiet': False,
                     'no_warnings': False,
-                    'progress_hooks': [progress_hook],
+                    'progress_hooks': [progress_hook, job_progress_hook],
                     'noplaylist': True,
                     'max_filesize': max_file_size_mb * 1024 * 1024,  # 30MB limit for reliable uploads
                     'socket_timeout': 30,  # Socket timeout in seconds
@@ -11117,6 +12969,7 @@ async def youtube_download_command(update: Update, context: ContextTypes.DEFAULT
                 current_quality_index = 0
                 
                 while not download_success and current_quality_index < len(quality_levels):
+                    check_cancelled()
                     try:
                         quality = quality_levels[current_quality_index]
                         if isinstance(quality, int):
@@ -11211,7 +13064,7 @@ async def youtube_download_command(update: Update, context: ContextTypes.DEFAULT
         # Download video with longer timeout for larger files
         # Timeout increased to 10 minutes (600 seconds) to handle slower connections and larger files
         result = await asyncio.wait_for(
-            loop.run_in_executor(None, download_youtube_video, url, quality),
+            download_executor.run(download_youtube_video, url, quality),
             timeout=600.0
         )
         
@@ -11363,6 +13216,7 @@ async def youtube_download_command(update: Update, context: ContextTypes.DEFAULT
         
         await update.message.reply_text(detailed_msg)
 
+@heavy_command(PRIORITY_BULK)
 async def facebook_download_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Download Facebook video from URL."""
     if not context.args:
@@ -11397,7 +13251,6 @@ async def facebook_download_command(update: Update, context: ContextTypes.DEFAUL
     processing_msg = await update.message.reply_text("📘 Downloading Facebook video...\n⏳ Please wait...")
     
     try:
-        loop = asyncio.get_event_loop()
         
         def download_facebook_video(video_url):
             import tempfile
@@ -11466,7 +13319,7 @@ async def facebook_download_command(update: Update, context: ContextTypes.DEFAUL
                     'outtmpl': tmp_path_pattern,
                     'quiet': False,
                     'no_warnings': False,
-                    'progress_hooks': [progress_hook],
+                    'progress_hooks': [progress_hook, job_progress_hook],
                     'noplaylist': True,
                     'max_filesize': max_file_size_mb * 1024 * 1024,
                     'socket_timeout': 30,
@@ -11545,7 +13398,7 @@ async def facebook_download_command(update: Update, context: ContextTypes.DEFAUL
         
         # Download video with timeout (600 seconds for larger files)
         result = await asyncio.wait_for(
-            loop.run_in_executor(None, download_facebook_video, url),
+            download_executor.run(download_facebook_video, url),
             timeout=600.0
         )
         
@@ -11680,6 +13533,7 @@ async def facebook_download_command(update: Update, context: ContextTypes.DEFAUL
 
 # Old API-based code removed - now using yt-dlp for Facebook downloads
 
+@heavy_command(PRIORITY_BULK)
 async def instagram_download_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Download Instagram video/image from URL using yt-dlp."""
     if not context.args:
@@ -11712,7 +13566,6 @@ async def instagram_download_command(update: Update, context: ContextTypes.DEFAU
     processing_msg = await update.message.reply_text("📷 Downloading Instagram media...\n⏳ Please wait...")
     
     try:
-        loop = asyncio.get_event_loop()
         
         def download_instagram_media(media_url):
             import tempfile
@@ -11788,7 +13641,7 @@ async def instagram_download_command(update: Update, context: ContextTypes.DEFAU
                     'outtmpl': tmp_path_pattern,
                     'quiet': False,
                     'no_warnings': False,
-                    'progress_hooks': [progress_hook],
+                    'progress_hooks': [progress_hook, job_progress_hook],
                     'noplaylist': True,
                     'max_filesize': max_file_size_mb * 1024 * 1024,
                     'socket_timeout': 30,
@@ -11876,7 +13729,7 @@ async def instagram_download_command(update: Update, context: ContextTypes.DEFAU
         
         # Download media with timeout (600 seconds for larger files)
         result = await asyncio.wait_for(
-            loop.run_in_executor(None, download_instagram_media, url),
+            download_executor.run(download_instagram_media, url),
             timeout=600.0
         )
         
@@ -12032,12 +13885,9 @@ async def instagram_download_command(update: Update, context: ContextTypes.DEFAU
 
 # Old Instagram download function removed - now using yt-dlp based implementation above
 
+@heavy_command(PRIORITY_BULK)
 async def clone_website_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Clone a website by downloading HTML, CSS, JS, and images."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     if not context.args:
         help_text = (
             "🌐 **Website Cloning Tool**\n\n"
@@ -12091,7 +13941,6 @@ async def clone_website_command(update: Update, context: ContextTypes.DEFAULT_TY
     )
     
     try:
-        loop = asyncio.get_event_loop()
         
         def clone_website(website_url):
             """Clone website and extract HTML, CSS, JS as separate files."""
@@ -12117,7 +13966,7 @@ async def clone_website_command(update: Update, context: ContextTypes.DEFAULT_TY
                 # Download main HTML page
                 logger.info(f"Downloading main page: {website_url}")
                 try:
-                    response = requests.get(website_url, headers=headers, timeout=30, allow_redirects=True)
+                    response = http_session.get(website_url, headers=headers, timeout=30, allow_redirects=True)
                     response.raise_for_status()
                     html_content = response.text
                     final_url = response.url  # Get final URL after redirects
@@ -12159,6 +14008,7 @@ async def clone_website_command(update: Update, context: ContextTypes.DEFAULT_TY
                 
                 # Download external CSS files
                 for css_url in css_urls:
+                    check_cancelled()
                     try:
                         if css_url.startswith('//'):
                             css_url = 'https:' + css_url
@@ -12171,7 +14021,7 @@ async def clone_website_command(update: Update, context: ContextTypes.DEFAULT_TY
                         if parsed_css.netloc != parsed_url.netloc:
                             continue  # Skip external CSS
                         
-                        css_response = requests.get(css_url, headers=headers, timeout=10, allow_redirects=True)
+                        css_response = http_session.get(css_url, headers=headers, timeout=10, allow_redirects=True)
                         if css_response.status_code == 200:
                             combined_css.append(f"/* CSS from {css_url} */\n{css_response.text}\n")
                             css_count += 1
@@ -12191,6 +14041,7 @@ async def clone_website_command(update: Update, context: ContextTypes.DEFAULT_TY
                 
                 # Download external JS files
                 for js_url in js_urls:
+                    check_cancelled()
                     try:
                         if js_url.startswith('//'):
                             js_url = 'https:' + js_url
@@ -12203,7 +14054,7 @@ async def clone_website_command(update: Update, context: ContextTypes.DEFAULT_TY
                         if parsed_js.netloc != parsed_url.netloc:
                             continue  # Skip external JS
                         
-                        js_response = requests.get(js_url, headers=headers, timeout=10, allow_redirects=True)
+                        js_response = http_session.get(js_url, headers=headers, timeout=10, allow_redirects=True)
                         if js_response.status_code == 200:
                             combined_js.append(f"// JavaScript from {js_url}\n{js_response.text}\n")
                             js_count += 1
@@ -12277,7 +14128,7 @@ async def clone_website_command(update: Update, context: ContextTypes.DEFAULT_TY
                     logger.warning(f"Error cleaning up temp directory: {cleanup_error}")
         
         # Run cloning in executor
-        result = await loop.run_in_executor(None, clone_website, url)
+        result = await download_executor.run(clone_website, url)
         
         # Delete processing message
         try:
@@ -12413,12 +14264,9 @@ async def clone_website_command(update: Update, context: ContextTypes.DEFAULT_TY
         
         await update.message.reply_text(detailed_msg)
 
+@heavy_command(PRIORITY_NORMAL)
 async def build_website_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Build a ready-made website from user prompt using AI."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     if not context.args:
         help_text = (
             "🌐 **Build My Website** - AI Website Generator\n\n"
@@ -12457,7 +14305,6 @@ async def build_website_command(update: Update, context: ContextTypes.DEFAULT_TY
     )
     
     try:
-        loop = asyncio.get_event_loop()
         
         def generate_website(website_prompt):
             """Generate HTML, CSS, JS from prompt using AI."""
@@ -12498,7 +14345,7 @@ Generate the HTML code:"""
                         }
                     }
                     
-                    response = requests.post(api_url, headers=headers, json=payload, timeout=30)
+                    response = http_session.post(api_url, headers=headers, json=payload, timeout=30)
                     
                     if response.status_code == 200:
                         result = response.json()
@@ -13146,7 +14993,7 @@ animateOnScroll(); // Run once on load'''
             }
         
         # Generate website
-        result = await loop.run_in_executor(None, generate_website, prompt)
+        result = await io_executor.run(generate_website, prompt)
         
         # Delete processing message
         try:
@@ -13241,22 +15088,447 @@ animateOnScroll(); // Run once on load'''
         
         await update.message.reply_text(detailed_msg)
 
+# Crypto prices - quotes come from CoinGecko's /simple/price. Lookups that arrive within
+# CRYPTO_BATCH_WINDOW are sent as one multi-coin request, quotes are reused for
+# CRYPTO_PRICE_TTL, and a coin already being fetched is not asked for again.
+CRYPTO_PRICE_TTL = int(os.getenv("CRYPTO_PRICE_TTL", "60"))  # seconds; CoinGecko's own cache is about this long
+CRYPTO_BATCH_WINDOW = float(os.getenv("CRYPTO_BATCH_WINDOW", "0.25"))  # seconds lookups wait to share a request
+CRYPTO_MAX_BATCH = 100  # coin ids per request
+CRYPTO_MAX_COINS = 10  # coins per /crypto command
+
+CRYPTO_CURRENCIES = ['in', 'inr', 'bdt', 'eur', 'gbp', 'jpy', 'cad', 'aud', 'cny', 'sgd', 'hkd', 'nzd', 'brl', 'mxn', 'krw', 'try', 'rub', 'pln', 'thb', 'idr', 'php', 'zar', 'sek', 'nok', 'dkk', 'chf', 'myr', 'vnd', 'pkr', 'egp', 'aed', 'sar', 'ils', 'clp', 'cop', 'ars', 'pen', 'nzd', 'usd']
+
+CURRENCY_SYMBOLS = {
+    'usd': '$', 'eur': '€', 'gbp': '£', 'jpy': '¥', 'inr': '₹', 'bdt': '৳',
+    'cad': 'C$', 'aud': 'A$', 'cny': '¥', 'sgd': 'S$', 'hkd': 'HK$', 'nzd': 'NZ$',
+    'brl': 'R$', 'mxn': 'Mex$', 'krw': '₩', 'try': '₺', 'rub': '₽', 'pln': 'zł',
+    'thb': '฿', 'idr': 'Rp', 'php': '₱', 'zar': 'R', 'sek': 'kr', 'nok': 'kr',
+    'dkk': 'kr', 'chf': 'CHF', 'myr': 'RM', 'vnd': '₫', 'pkr': '₨', 'egp': 'E£',
+    'aed': 'د.إ', 'sar': '﷼', 'ils': '₪', 'clp': '$', 'cop': '$', 'ars': '$', 'pen': 'S/'
+}
+
+# Coin name mapping (common aliases) - Expanded list with 100+ tokens
+COIN_ALIASES = {
+    # Top 20 Major Cryptocurrencies
+    'btc': 'bitcoin',
+    'bitcoin': 'bitcoin',
+    'eth': 'ethereum',
+    'ethereum': 'ethereum',
+    'bnb': 'binancecoin',
+    'binance': 'binancecoin',
+    'binancecoin': 'binancecoin',
+    'sol': 'solana',
+    'solana': 'solana',
+    'ada': 'cardano',
+    'cardano': 'cardano',
+    'xrp': 'ripple',
+    'ripple': 'ripple',
+    'doge': 'dogecoin',
+    'dogecoin': 'dogecoin',
+    'dot': 'polkadot',
+    'polkadot': 'polkadot',
+    'matic': 'matic-network',
+    'polygon': 'matic-network',
+    'ltc': 'litecoin',
+    'litecoin': 'litecoin',
+    'trx': 'tron',
+    'tron': 'tron',
+    'shib': 'shiba-inu',
+    'shiba': 'shiba-inu',
+    'shibainu': 'shiba-inu',
+    'avax': 'avalanche-2',
+    'avalanche': 'avalanche-2',
+    'link': 'chainlink',
+    'chainlink': 'chainlink',
+    'atom': 'cosmos',
+    'cosmos': 'cosmos',
+    'xlm': 'stellar',
+    'stellar': 'stellar',
+    'etc': 'ethereum-classic',
+    'ethereumclassic': 'ethereum-classic',
+    'icp': 'internet-computer',
+    'internetcomputer': 'internet-computer',
+    'near': 'near',
+    'nearprotocol': 'near',
+    'hbar': 'hedera-hashgraph',
+    'hedera': 'hedera-hashgraph',
+    'fil': 'filecoin',
+    'filecoin': 'filecoin',
+    'algo': 'algorand',
+    'algorand': 'algorand',
+    'xtz': 'tezos',
+    'tezos': 'tezos',
+    'vet': 'vechain',
+    'vechain': 'vechain',
+    'theta': 'theta-token',
+    'thetatoken': 'theta-token',
+    'ftm': 'fantom',
+    'fantom': 'fantom',
+    'eos': 'eos',
+    'xmr': 'monero',
+    'monero': 'monero',
+    'zec': 'zcash',
+    'zcash': 'zcash',
+    'dash': 'dash',
+    
+    # Stablecoins
+    'usdt': 'tether',
+    'tether': 'tether',
+    'usdc': 'usd-coin',
+    'usdcoin': 'usd-coin',
+    'busd': 'binance-usd',
+    'binanceusd': 'binance-usd',
+    'dai': 'dai',
+    'tusd': 'true-usd',
+    'trueusd': 'true-usd',
+    'usdp': 'paxos-standard',
+    'pax': 'paxos-standard',
+    
+    # DeFi Tokens
+    'aave': 'aave',
+    'uni': 'uniswap',
+    'uniswap': 'uniswap',
+    'sushi': 'sushi',
+    'sushiswap': 'sushi',
+    'comp': 'compound-governance-token',
+    'compound': 'compound-governance-token',
+    'mkr': 'maker',
+    'maker': 'maker',
+    'cake': 'pancakeswap-token',
+    'pancakeswap': 'pancakeswap-token',
+    'crv': 'curve-dao-token',
+    'curve': 'curve-dao-token',
+    'snx': 'havven',
+    'synthetix': 'havven',
+    'yfi': 'yearn-finance',
+    'yearn': 'yearn-finance',
+    '1inch': '1inch',
+    '1inch-network': '1inch',
+    'bal': 'balancer',
+    'balancer': 'balancer',
+    'ren': 'republic-protocol',
+    'renbtc': 'renbtc',
+    'knc': 'kyber-network-crystal',
+    'kyber': 'kyber-network-crystal',
+    'zrx': '0x',
+    '0x': '0x',
+    
+    # Layer 2 & Scaling Solutions
+    'arb': 'arbitrum',
+    'arbitrum': 'arbitrum',
+    'op': 'optimism',
+    'optimism': 'optimism',
+    'loopring': 'loopring',
+    'lrc': 'loopring',
+    'imx': 'immutable-x',
+    'immutablex': 'immutable-x',
+    'metis': 'metis-token',
+    
+    # Gaming & NFT Tokens
+    'mana': 'decentraland',
+    'decentraland': 'decentraland',
+    'sand': 'the-sandbox',
+    'sandbox': 'the-sandbox',
+    'axs': 'axie-infinity',
+    'axie': 'axie-infinity',
+    'gala': 'gala',
+    'enj': 'enjincoin',
+    'enjin': 'enjincoin',
+    'flow': 'flow',
+    'illuvium': 'illuvium',
+    'ilv': 'illuvium',
+    'gmt': 'stepn',
+    'stepn': 'stepn',
+    'ape': 'apecoin',
+    'apecoin': 'apecoin',
+    'immutable': 'immutable-x',
+    
+    # Exchange Tokens
+    'ftt': 'ftx-token',
+    'ftx': 'ftx-token',
+    'gt': 'gatechain-token',
+    'gate': 'gatechain-token',
+    'kcs': 'kucoin-shares',
+    'kucoin': 'kucoin-shares',
+    'ht': 'huobi-token',
+    'huobi': 'huobi-token',
+    'okb': 'okb',
+    'okex': 'okb',
+    'leo': 'leo-token',
+    'bitfinex': 'leo-token',
+    'crypto': 'crypto-com-chain',
+    'cro': 'crypto-com-chain',
+    'cel': 'celsius-degree-token',
+    'celsius': 'celsius-degree-token',
+    
+    # Meme Coins
+    'floki': 'floki',
+    'flokinu': 'floki',
+    'pepe': 'pepe',
+    'bonk': 'bonk',
+    'babydoge': 'baby-doge-coin',
+    'babydogecoin': 'baby-doge-coin',
+    'dogelon': 'dogelon-mars',
+    'elon': 'dogelon-mars',
+    'shibarium': 'shibarium',
+    
+    # AI & Big Data
+    'fet': 'fetch-ai',
+    'fetch': 'fetch-ai',
+    'fetchai': 'fetch-ai',
+    'ocean': 'ocean-protocol',
+    'oceanprotocol': 'ocean-protocol',
+    'grt': 'the-graph',
+    'graph': 'the-graph',
+    'rndr': 'render-token',
+    'render': 'render-token',
+    
+    # Infrastructure & Cloud
+    'rune': 'thorchain',
+    'thorchain': 'thorchain',
+    'kava': 'kava',
+    'terra': 'terra-luna',
+    'luna': 'terra-luna',
+    'lunc': 'terra-luna-2',
+    'luna2': 'terra-luna-2',
+    'inj': 'injective-protocol',
+    'injective': 'injective-protocol',
+    
+    # Privacy Coins
+    'zec': 'zcash',
+    'dash': 'dash',
+    'xmr': 'monero',
+    'zcoin': 'firo',
+    'firo': 'firo',
+    
+    # Smart Contract Platforms
+    'avax': 'avalanche-2',
+    'ftm': 'fantom',
+    'matic': 'matic-network',
+    'dot': 'polkadot',
+    'atom': 'cosmos',
+    'sol': 'solana',
+    'ada': 'cardano',
+    'algo': 'algorand',
+    'egld': 'elrond-erd-2',
+    'elrond': 'elrond-erd-2',
+    'multiversx': 'elrond-erd-2',
+    'hbar': 'hedera-hashgraph',
+    'icp': 'internet-computer',
+    'apt': 'aptos',
+    'aptos': 'aptos',
+    'sui': 'sui',
+    'sei': 'sei-network',
+    'seinetwork': 'sei-network',
+    'tia': 'celestia',
+    'celestia': 'celestia',
+    
+    # Oracle & Data
+    'link': 'chainlink',
+    'band': 'band-protocol',
+    'bandprotocol': 'band-protocol',
+    'nest': 'nest-protocol',
+    'nestprotocol': 'nest-protocol',
+    
+    # Social & Content
+    'bat': 'basic-attention-token',
+    'battoken': 'basic-attention-token',
+    'rss3': 'rss3',
+    'mask': 'mask-network',
+    'masknetwork': 'mask-network',
+    
+    # Metaverse & VR
+    'mana': 'decentraland',
+    'sand': 'the-sandbox',
+    'somnium': 'somnium-space-cubes',
+    'vr': 'somnium-space-cubes',
+    
+    # Additional Popular Tokens
+    'qnt': 'quant-network',
+    'quant': 'quant-network',
+    'xym': 'symbol',
+    'symbol': 'symbol',
+    'xdc': 'xdce-crowd-sale',
+    'xdcnetwork': 'xdce-crowd-sale',
+    'hnt': 'helium',
+    'helium': 'helium',
+    'iotex': 'iotex',
+    'iotx': 'iotex',
+    'one': 'harmony',
+    'harmony': 'harmony',
+    'rose': 'oasis-network',
+    'oasis': 'oasis-network',
+    'celo': 'celo',
+    'celodollar': 'celo',
+    'omg': 'omisego',
+    'omisego': 'omisego',
+    'zil': 'zilliqa',
+    'zilliqa': 'zilliqa',
+    'wax': 'wax',
+    'waxp': 'wax',
+    'hive': 'hive',
+    'hiveblockchain': 'hive',
+    'waves': 'waves',
+    'nano': 'nano',
+    'xno': 'nano',
+    'iota': 'iota',
+    'miota': 'iota',
+    'xem': 'nem',
+    'nem': 'nem',
+    'qtum': 'qtum',
+    'ont': 'ontology',
+    'ontology': 'ontology',
+    'zcn': '0chain',
+    '0chain': '0chain',
+    'sc': 'siacoin',
+    'siacoin': 'siacoin',
+    'stx': 'blockstack',
+    'blockstack': 'blockstack',
+    'stacks': 'blockstack',
+    
+    # The Open Network (TON)
+    'ton': 'the-open-network',
+    'toncoin': 'the-open-network',
+    'the-open-network': 'the-open-network',
+    'telegram-open-network': 'the-open-network',
+}
+
+def resolve_coin_id(name):
+    """CoinGecko id for a coin symbol or name (unknown names are used as-is)."""
+    name = name.lower()
+    return COIN_ALIASES.get(name, name)
+
+def format_coin_price(price, currency):
+    """Price with the currency symbol and decimal places suited to its size."""
+    symbol = CURRENCY_SYMBOLS.get(currency, currency.upper())
+    if price >= 1000:
+        return f"{symbol}{price:,.2f}"
+    elif price >= 1:
+        return f"{symbol}{price:,.4f}"
+    elif price >= 0.01:
+        return f"{symbol}{price:,.6f}"
+    else:
+        return f"{symbol}{price:.10f}"
+
+class CryptoPriceService:
+    """Batched, cached and coalesced CoinGecko price quotes."""
+
+    def __init__(self, ttl, batch_window, max_batch):
+        self.ttl = ttl
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.quotes = {}  # (coin_id, currency) -> (quote dict or None if unknown, expires_at monotonic)
+        self.pending = {}  # (coin_id, currency) -> future of the batch that will fetch it
+        self.in_flight = {}  # (coin_id, currency) -> future of a request already sent for it
+        self.flush_task = None
+        self.requests = 0
+        self.cache_hits = 0
+
+    async def get_quotes(self, coin_ids, currency):
+        """Return {coin_id: quote dict, or None if CoinGecko does not know the coin}."""
+        now = time.monotonic()
+        results = {}
+        waiting = {}
+        for coin_id in coin_ids:
+            key = (coin_id, currency)
+            cached = self.quotes.get(key)
+            if cached is not None and cached[1] > now:
+                results[coin_id] = cached[0]
+                self.cache_hits += 1
+                continue
+            future = self.in_flight.get(key) or self.pending.get(key)
+            if future is None:
+                future = asyncio.get_running_loop().create_future()
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                self.pending[key] = future
+                if self.flush_task is None:
+                    self.flush_task = asyncio.create_task(self.flush_after_window())
+            waiting[coin_id] = future
+        for coin_id, future in waiting.items():
+            # Shielded: one impatient caller must not cancel a lookup others are waiting for
+            results[coin_id] = await asyncio.shield(future)
+        return results
+
+    async def flush_after_window(self):
+        await asyncio.sleep(self.batch_window)
+        batch, self.pending, self.flush_task = self.pending, {}, None
+        # Lookups arriving while the request is out join it instead of sending another
+        self.in_flight.update(batch)
+        by_currency = {}
+        for (coin_id, currency), future in batch.items():
+            by_currency.setdefault(currency, {})[coin_id] = future
+        requests_to_send = []
+        for currency, futures in by_currency.items():
+            coin_ids = list(futures)
+            for i in range(0, len(coin_ids), self.max_batch):
+                chunk = {coin_id: futures[coin_id] for coin_id in coin_ids[i:i + self.max_batch]}
+                requests_to_send.append(self.fetch(chunk, currency))
+        await asyncio.gather(*requests_to_send)
+
+    async def fetch(self, futures, currency):
+        """Fetch one batch of coins and resolve the futures waiting for them."""
+        self.requests += 1
+        try:
+            data = await self.request_prices(list(futures), currency)
+        except Exception as e:
+            logger.error(f"Crypto price error: {e}")
+            for coin_id, future in futures.items():
+                self.in_flight.pop((coin_id, currency), None)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        expires_at = time.monotonic() + self.ttl
+        for coin_id, future in futures.items():
+            coin_quote = data.get(coin_id)
+            self.quotes[(coin_id, currency)] = (coin_quote, expires_at)
+            self.in_flight.pop((coin_id, currency), None)
+            if not future.done():
+                future.set_result(coin_quote)
+        self.prune()
+
+    async def request_prices(self, coin_ids, currency):
+        try:
+            # Always include USD for market cap and volume, plus requested currency
+            params = {
+                'ids': ','.join(coin_ids),
+                'vs_currencies': 'usd,' + currency if currency != 'usd' else 'usd',
+                'include_market_cap': 'true',
+                'include_24hr_change': 'true',
+                'include_24hr_vol': 'true',
+                'include_last_updated_at': 'true'
+            }
+            response = await get_http_client().get("https://api.coingecko.com/api/v3/simple/price", params=params, timeout=10)
+        except httpx.TimeoutException:
+            raise Exception("Request timeout. Please try again.")
+        except httpx.HTTPError as e:
+            raise Exception(f"Network error: {str(e)}")
+        if response.status_code == 200:
+            return response.json()
+        elif response.status_code == 429:
+            raise Exception("CoinGecko rate limit reached. Please try again in a minute.")
+        raise Exception(f"API returned status {response.status_code}")
+
+    def prune(self):
+        now = time.monotonic()
+        for key in [key for key, (_, expires_at) in self.quotes.items() if expires_at <= now]:
+            del self.quotes[key]
+
+crypto_prices = CryptoPriceService(CRYPTO_PRICE_TTL, CRYPTO_BATCH_WINDOW, CRYPTO_MAX_BATCH)
+
 async def crypto_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Get cryptocurrency price information."""
-    # Check if user is blocked
-    if await check_user_blocked(update, context):
-        return
-    
     if not context.args:
         help_text = (
             "💰 **Crypto Price Checker**\n\n"
-            "**Usage:** `/crypto <coin>` or `/crypto <coin> <currency>`\n\n"
+            "**Usage:** `/crypto <coin>` or `/crypto <coin> <currency>`\n"
+            "Several coins at once: `/crypto <coin> <coin> ... [currency]`\n\n"
             "**Examples:**\n"
             "• `/crypto bitcoin` - Bitcoin price in USD\n"
             "• `/crypto ethereum` - Ethereum price\n"
             "• `/crypto btc inr` - Bitcoin price in INR\n"
             "• `/crypto doge` - Dogecoin price\n"
-            "• `/crypto solana bdt` - Solana price in BDT\n\n"
+            "• `/crypto solana bdt` - Solana price in BDT\n"
+            "• `/crypto btc eth sol` - Three coins in one reply\n\n"
             "**Popular Coins (200+ supported):**\n"
             "• bitcoin, btc - Bitcoin\n"
             "• ethereum, eth - Ethereum\n"
@@ -13294,352 +15566,25 @@ async def crypto_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(help_text, parse_mode='Markdown')
         return
     
-    coin_input = context.args[0].lower()
-    
-    # Default currency is USD, but check if user specified another
+    # Default currency is USD; a currency given last applies to every coin before it
+    coin_args = [arg.lower() for arg in context.args]
     currency = 'usd'
-    if len(context.args) >= 2:
-        # Check if second argument is a currency (common patterns)
-        currency_input = context.args[1].lower()
-        if currency_input in ['in', 'inr', 'bdt', 'eur', 'gbp', 'jpy', 'cad', 'aud', 'cny', 'sgd', 'hkd', 'nzd', 'brl', 'mxn', 'krw', 'try', 'rub', 'pln', 'thb', 'idr', 'php', 'zar', 'sek', 'nok', 'dkk', 'chf', 'myr', 'vnd', 'pkr', 'egp', 'aed', 'sar', 'ils', 'clp', 'cop', 'ars', 'pen', 'nzd']:
-            currency = currency_input
-        elif currency_input == 'in':
-            currency = 'inr'
-    
-    # Coin name mapping (common aliases) - Expanded list with 100+ tokens
-    coin_mapping = {
-        # Top 20 Major Cryptocurrencies
-        'btc': 'bitcoin',
-        'bitcoin': 'bitcoin',
-        'eth': 'ethereum',
-        'ethereum': 'ethereum',
-        'bnb': 'binancecoin',
-        'binance': 'binancecoin',
-        'binancecoin': 'binancecoin',
-        'sol': 'solana',
-        'solana': 'solana',
-        'ada': 'cardano',
-        'cardano': 'cardano',
-        'xrp': 'ripple',
-        'ripple': 'ripple',
-        'doge': 'dogecoin',
-        'dogecoin': 'dogecoin',
-        'dot': 'polkadot',
-        'polkadot': 'polkadot',
-        'matic': 'matic-network',
-        'polygon': 'matic-network',
-        'ltc': 'litecoin',
-        'litecoin': 'litecoin',
-        'trx': 'tron',
-        'tron': 'tron',
-        'shib': 'shiba-inu',
-        'shiba': 'shiba-inu',
-        'shibainu': 'shiba-inu',
-        'avax': 'avalanche-2',
-        'avalanche': 'avalanche-2',
-        'link': 'chainlink',
-        'chainlink': 'chainlink',
-        'atom': 'cosmos',
-        'cosmos': 'cosmos',
-        'xlm': 'stellar',
-        'stellar': 'stellar',
-        'etc': 'ethereum-classic',
-        'ethereumclassic': 'ethereum-classic',
-        'icp': 'internet-computer',
-        'internetcomputer': 'internet-computer',
-        'near': 'near',
-        'nearprotocol': 'near',
-        'hbar': 'hedera-hashgraph',
-        'hedera': 'hedera-hashgraph',
-        'fil': 'filecoin',
-        'filecoin': 'filecoin',
-        'algo': 'algorand',
-        'algorand': 'algorand',
-        'xtz': 'tezos',
-        'tezos': 'tezos',
-        'vet': 'vechain',
-        'vechain': 'vechain',
-        'theta': 'theta-token',
-        'thetatoken': 'theta-token',
-        'ftm': 'fantom',
-        'fantom': 'fantom',
-        'eos': 'eos',
-        'xmr': 'monero',
-        'monero': 'monero',
-        'zec': 'zcash',
-        'zcash': 'zcash',
-        'dash': 'dash',
-        
-        # Stablecoins
-        'usdt': 'tether',
-        'tether': 'tether',
-        'usdc': 'usd-coin',
-        'usdcoin': 'usd-coin',
-        'busd': 'binance-usd',
-        'binanceusd': 'binance-usd',
-        'dai': 'dai',
-        'tusd': 'true-usd',
-        'trueusd': 'true-usd',
-        'usdp': 'paxos-standard',
-        'pax': 'paxos-standard',
-        
-        # DeFi Tokens
-        'aave': 'aave',
-        'uni': 'uniswap',
-        'uniswap': 'uniswap',
-        'sushi': 'sushi',
-        'sushiswap': 'sushi',
-        'comp': 'compound-governance-token',
-        'compound': 'compound-governance-token',
-        'mkr': 'maker',
-        'maker': 'maker',
-        'cake': 'pancakeswap-token',
-        'pancakeswap': 'pancakeswap-token',
-        'crv': 'curve-dao-token',
-        'curve': 'curve-dao-token',
-        'snx': 'havven',
-        'synthetix': 'havven',
-        'yfi': 'yearn-finance',
-        'yearn': 'yearn-finance',
-        '1inch': '1inch',
-        '1inch-network': '1inch',
-        'bal': 'balancer',
-        'balancer': 'balancer',
-        'ren': 'republic-protocol',
-        'renbtc': 'renbtc',
-        'knc': 'kyber-network-crystal',
-        'kyber': 'kyber-network-crystal',
-        'zrx': '0x',
-        '0x': '0x',
-        
-        # Layer 2 & Scaling Solutions
-        'arb': 'arbitrum',
-        'arbitrum': 'arbitrum',
-        'op': 'optimism',
-        'optimism': 'optimism',
-        'loopring': 'loopring',
-        'lrc': 'loopring',
-        'imx': 'immutable-x',
-        'immutablex': 'immutable-x',
-        'metis': 'metis-token',
-        
-        # Gaming & NFT Tokens
-        'mana': 'decentraland',
-        'decentraland': 'decentraland',
-        'sand': 'the-sandbox',
-        'sandbox': 'the-sandbox',
-        'axs': 'axie-infinity',
-        'axie': 'axie-infinity',
-        'gala': 'gala',
-        'enj': 'enjincoin',
-        'enjin': 'enjincoin',
-        'flow': 'flow',
-        'illuvium': 'illuvium',
-        'ilv': 'illuvium',
-        'gmt': 'stepn',
-        'stepn': 'stepn',
-        'ape': 'apecoin',
-        'apecoin': 'apecoin',
-        'immutable': 'immutable-x',
-        
-        # Exchange Tokens
-        'ftt': 'ftx-token',
-        'ftx': 'ftx-token',
-        'gt': 'gatechain-token',
-        'gate': 'gatechain-token',
-        'kcs': 'kucoin-shares',
-        'kucoin': 'kucoin-shares',
-        'ht': 'huobi-token',
-        'huobi': 'huobi-token',
-        'okb': 'okb',
-        'okex': 'okb',
-        'leo': 'leo-token',
-        'bitfinex': 'leo-token',
-        'crypto': 'crypto-com-chain',
-        'cro': 'crypto-com-chain',
-        'cel': 'celsius-degree-token',
-        'celsius': 'celsius-degree-token',
-        
-        # Meme Coins
-        'floki': 'floki',
-        'flokinu': 'floki',
-        'pepe': 'pepe',
-        'bonk': 'bonk',
-        'babydoge': 'baby-doge-coin',
-        'babydogecoin': 'baby-doge-coin',
-        'dogelon': 'dogelon-mars',
-        'elon': 'dogelon-mars',
-        'shibarium': 'shibarium',
-        
-        # AI & Big Data
-        'fet': 'fetch-ai',
-        'fetch': 'fetch-ai',
-        'fetchai': 'fetch-ai',
-        'ocean': 'ocean-protocol',
-        'oceanprotocol': 'ocean-protocol',
-        'grt': 'the-graph',
-        'graph': 'the-graph',
-        'rndr': 'render-token',
-        'render': 'render-token',
-        
-        # Infrastructure & Cloud
-        'rune': 'thorchain',
-        'thorchain': 'thorchain',
-        'kava': 'kava',
-        'terra': 'terra-luna',
-        'luna': 'terra-luna',
-        'lunc': 'terra-luna-2',
-        'luna2': 'terra-luna-2',
-        'inj': 'injective-protocol',
-        'injective': 'injective-protocol',
-        
-        # Privacy Coins
-        'zec': 'zcash',
-        'dash': 'dash',
-        'xmr': 'monero',
-        'zcoin': 'firo',
-        'firo': 'firo',
-        
-        # Smart Contract Platforms
-        'avax': 'avalanche-2',
-        'ftm': 'fantom',
-        'matic': 'matic-network',
-        'dot': 'polkadot',
-        'atom': 'cosmos',
-        'sol': 'solana',
-        'ada': 'cardano',
-        'algo': 'algorand',
-        'egld': 'elrond-erd-2',
-        'elrond': 'elrond-erd-2',
-        'multiversx': 'elrond-erd-2',
-        'hbar': 'hedera-hashgraph',
-        'icp': 'internet-computer',
-        'apt': 'aptos',
-        'aptos': 'aptos',
-        'sui': 'sui',
-        'sei': 'sei-network',
-        'seinetwork': 'sei-network',
-        'tia': 'celestia',
-        'celestia': 'celestia',
-        
-        # Oracle & Data
-        'link': 'chainlink',
-        'band': 'band-protocol',
-        'bandprotocol': 'band-protocol',
-        'nest': 'nest-protocol',
-        'nestprotocol': 'nest-protocol',
-        
-        # Social & Content
-        'bat': 'basic-attention-token',
-        'battoken': 'basic-attention-token',
-        'rss3': 'rss3',
-        'mask': 'mask-network',
-        'masknetwork': 'mask-network',
-        
-        # Metaverse & VR
-        'mana': 'decentraland',
-        'sand': 'the-sandbox',
-        'somnium': 'somnium-space-cubes',
-        'vr': 'somnium-space-cubes',
-        
-        # Additional Popular Tokens
-        'qnt': 'quant-network',
-        'quant': 'quant-network',
-        'xym': 'symbol',
-        'symbol': 'symbol',
-        'xdc': 'xdce-crowd-sale',
-        'xdcnetwork': 'xdce-crowd-sale',
-        'hnt': 'helium',
-        'helium': 'helium',
-        'iotex': 'iotex',
-        'iotx': 'iotex',
-        'one': 'harmony',
-        'harmony': 'harmony',
-        'rose': 'oasis-network',
-        'oasis': 'oasis-network',
-        'celo': 'celo',
-        'celodollar': 'celo',
-        'omg': 'omisego',
-        'omisego': 'omisego',
-        'zil': 'zilliqa',
-        'zilliqa': 'zilliqa',
-        'wax': 'wax',
-        'waxp': 'wax',
-        'hive': 'hive',
-        'hiveblockchain': 'hive',
-        'waves': 'waves',
-        'nano': 'nano',
-        'xno': 'nano',
-        'iota': 'iota',
-        'miota': 'iota',
-        'xem': 'nem',
-        'nem': 'nem',
-        'qtum': 'qtum',
-        'ont': 'ontology',
-        'ontology': 'ontology',
-        'zcn': '0chain',
-        '0chain': '0chain',
-        'sc': 'siacoin',
-        'siacoin': 'siacoin',
-        'stx': 'blockstack',
-        'blockstack': 'blockstack',
-        'stacks': 'blockstack',
-        
-        # The Open Network (TON)
-        'ton': 'the-open-network',
-        'toncoin': 'the-open-network',
-        'the-open-network': 'the-open-network',
-        'telegram-open-network': 'the-open-network',
-    }
+    if len(coin_args) >= 2 and coin_args[-1] in CRYPTO_CURRENCIES:
+        currency = 'inr' if coin_args[-1] == 'in' else coin_args[-1]
+        coin_args = coin_args[:-1]
+    coin_inputs = list(dict.fromkeys(coin_args))[:CRYPTO_MAX_COINS]
+    coin_input = coin_inputs[0]
     
-    # Get coin ID from mapping or use input as-is
-    coin_id = coin_mapping.get(coin_input, coin_input)
+    # Get coin IDs from mapping or use input as-is
+    coin_ids = [resolve_coin_id(coin) for coin in coin_inputs]
     
     processing_msg = await update.message.reply_text(
-        f"💰 Fetching {coin_input.upper()} price...\n"
+        f"💰 Fetching {', '.join(coin.upper() for coin in coin_inputs)} price{'s' if len(coin_inputs) > 1 else ''}...\n"
         f"⏳ Please wait..."
     )
     
     try:
-        def get_crypto_price(coin, curr):
-            """Fetch cryptocurrency price from CoinGecko API."""
-            try:
-                # CoinGecko free API (no key needed)
-                # Always include USD for market cap and volume, plus requested currency
-                currencies = 'usd,' + curr if curr != 'usd' else 'usd'
-                
-                api_url = f"https://api.coingecko.com/api/v3/simple/price"
-                params = {
-                    'ids': coin,
-                    'vs_currencies': currencies,
-                    'include_market_cap': 'true',
-                    'include_24hr_change': 'true',
-                    'include_24hr_vol': 'true',
-                    'include_last_updated_at': 'true'
-                }
-                
-                response = requests.get(api_url, params=params, timeout=10)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if coin in data:
-                        return data[coin]
-                    else:
-                        raise Exception(f"Coin '{coin}' not found")
-                elif response.status_code == 404:
-                    raise Exception(f"Coin '{coin}' not found. Try: bitcoin, ethereum, dogecoin, etc.")
-                else:
-                    raise Exception(f"API returned status {response.status_code}")
-            except requests.exceptions.Timeout:
-                raise Exception("Request timeout. Please try again.")
-            except requests.exceptions.RequestException as e:
-                raise Exception(f"Network error: {str(e)}")
-            except Exception as e:
-                logger.error(f"Crypto price error: {e}")
-                raise
-        
-        loop = asyncio.get_event_loop()
-        price_data = await loop.run_in_executor(None, get_crypto_price, coin_id, currency)
+        quotes = await crypto_prices.get_quotes(coin_ids, currency)
         
         # Delete processing message
         try:
@@ -13647,6 +15592,26 @@ async def crypto_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             pass
         
+        if len(coin_inputs) > 1:
+            lines = [f"💰 **Crypto Prices** ({currency.upper()})\n"]
+            for coin, coin_id in zip(coin_inputs, coin_ids):
+                coin_quote = quotes.get(coin_id)
+                if coin_quote is None:
+                    lines.append(f"• **{coin.upper()}**: not found")
+                    continue
+                change_24h = coin_quote.get(f"{currency}_24h_change") or 0
+                lines.append(
+                    f"• **{coin.upper()}**: {format_coin_price(coin_quote.get(currency, 0), currency)} "
+                    f"{'📈' if change_24h >= 0 else '📉'} {change_24h:+.2f}%"
+                )
+            lines.append(f"\n💡 Use `/crypto <coin>` for market cap and volume")
+            await update.message.reply_text('\n'.join(lines), parse_mode='Markdown')
+            return
+        
+        price_data = quotes.get(coin_ids[0])
+        if price_data is None:
+            raise Exception(f"Coin '{coin_ids[0]}' not found")
+        
         # Format price data
         price_key = currency
         price_value = price_data.get(price_key, 0)
@@ -13656,27 +15621,7 @@ async def crypto_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             current_price = price_value
         
-        # Currency symbols
-        currency_symbols = {
-            'usd': '$', 'eur': '€', 'gbp': '£', 'jpy': '¥', 'inr': '₹', 'bdt': '৳',
-            'cad': 'C$', 'aud': 'A$', 'cny': '¥', 'sgd': 'S$', 'hkd': 'HK$', 'nzd': 'NZ$',
-            'brl': 'R$', 'mxn': 'Mex$', 'krw': '₩', 'try': '₺', 'rub': '₽', 'pln': 'zł',
-            'thb': '฿', 'idr': 'Rp', 'php': '₱', 'zar': 'R', 'sek': 'kr', 'nok': 'kr',
-            'dkk': 'kr', 'chf': 'CHF', 'myr': 'RM', 'vnd': '₫', 'pkr': '₨', 'egp': 'E£',
-            'aed': 'د.إ', 'sar': '﷼', 'ils': '₪', 'clp': '$', 'cop': '$', 'ars': '$', 'pen': 'S/'
-        }
-        
-        symbol = currency_symbols.get(currency, currency.upper())
-        
-        # Format price with appropriate decimal places
-        if current_price >= 1000:
-            price_str = f"{symbol}{current_price:,.2f}"
-        elif current_price >= 1:
-            price_str = f"{symbol}{current_price:,.4f}"
-        elif current_price >= 0.01:
-            price_str = f"{symbol}{current_price:,.6f}"
-        else:
-            price_str = f"{symbol}{current_price:.10f}"
+        price_str = format_coin_price(current_price, currency)
         
         # Get market cap (always in USD for global comparison)
         market_cap_key = "usd_market_cap"
@@ -13766,6 +15711,330 @@ async def crypto_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         await update.message.reply_text(detailed_msg)
 
+# Price alerts - one poller fetches every watched coin per interval (a single batched
+# CoinGecko request per currency, however many users watch it) and checks the alerts
+# through per-coin sorted threshold lists, so a tick costs O(log n) per coin plus
+# the alerts that actually fire
+PRICE_ALERT_INTERVAL = int(os.getenv("PRICE_ALERT_INTERVAL", "60"))  # seconds between price checks
+PRICE_ALERTS_PER_USER = 20
+
+class PriceAlertIndex:
+    """Alert thresholds per (coin_id, currency), kept sorted for bisect."""
+
+    def __init__(self):
+        # (coin_id, currency) -> {'above': [(target, seq, user_id, alert_id)], 'below': [...]}, ascending
+        self.thresholds = {}
+        self.entries = {}  # alert_id -> ((coin_id, currency), direction, entry), for removal
+        self.seq = 0
+
+    def add(self, user_id, alert):
+        self.remove(alert['alert_id'])
+        key = (alert['coin_id'], alert.get('currency', 'usd'))
+        self.seq += 1
+        entry = (float(alert['target']), self.seq, user_id, alert['alert_id'])
+        sides = self.thresholds.setdefault(key, {'above': [], 'below': []})
+        bisect.insort(sides[alert['direction']], entry)
+        self.entries[alert['alert_id']] = (key, alert['direction'], entry)
+
+    def remove(self, alert_id):
+        found = self.entries.pop(alert_id, None)
+        if found is None:
+            return
+        key, direction, entry = found
+        sides = self.thresholds[key]
+        side = sides[direction]
+        i = bisect.bisect_left(side, entry)
+        if i < len(side) and side[i] == entry:
+            del side[i]
+        if not sides['above'] and not sides['below']:
+            del self.thresholds[key]
+
+    def clear(self):
+        self.thresholds.clear()
+        self.entries.clear()
+
+    def watched(self):
+        """{currency: [coin_id, ...]} of everything that has an alert."""
+        by_currency = {}
+        for coin_id, currency in self.thresholds:
+            by_currency.setdefault(currency, []).append(coin_id)
+        return by_currency
+
+    def pop_triggered(self, key, price):
+        """Remove and return the (user_id, alert_id) of every alert crossed by price."""
+        sides = self.thresholds.get(key)
+        if sides is None:
+            return []
+        above, below = sides['above'], sides['below']
+        # 'above' alerts with target <= price form a prefix, 'below' ones with target >= price a suffix
+        cut_above = bisect.bisect_right(above, (price, math.inf))
+        cut_below = bisect.bisect_left(below, (price,))
+        fired = above[:cut_above] + below[cut_below:]
+        del above[:cut_above]
+        del below[cut_below:]
+        for _, _, user_id, alert_id in fired:
+            self.entries.pop(alert_id, None)
+        if not above and not below:
+            del self.thresholds[key]
+        return [(user_id, alert_id) for _, _, user_id, alert_id in fired]
+
+price_alert_index = PriceAlertIndex()
+price_alert_wakeup = None  # asyncio.Event owned by the poller task, set when the first alert appears
+
+def price_alert_coin_label(coin):
+    """The coin as the user typed it, upper-cased and safe inside Markdown text."""
+    return coin.upper().replace('_', '\\_').replace('*', '\\*').replace('[', '\\[').replace(']', '\\]').replace('`', '\\`')
+
+def index_all_price_alerts():
+    """(Re)build the threshold index from the price alerts store."""
+    price_alert_index.clear()
+    for user_id, user_alerts in price_alerts.items():
+        for alert in user_alerts:
+            try:
+                price_alert_index.add(user_id, alert)
+            except (KeyError, TypeError, ValueError):
+                logger.warning(f"Skipping malformed price alert {alert.get('alert_id')!r}")
+    logger.info(f"Indexed {len(price_alert_index.entries)} price alerts")
+
+async def check_price_alerts(bot):
+    """Fetch every watched coin once and deliver the alerts whose threshold was crossed."""
+    fired = []
+    for currency, coin_ids in price_alert_index.watched().items():
+        try:
+            quotes = await crypto_prices.get_quotes(coin_ids, currency)
+        except Exception as e:
+            logger.warning(f"Price alert check failed for {currency.upper()}: {e}")
+            continue
+        for coin_id, coin_quote in quotes.items():
+            price = coin_quote.get(currency) if coin_quote else None
+            if isinstance(price, (int, float)):
+                fired.extend((user_id, alert_id, price) for user_id, alert_id in
+                             price_alert_index.pop_triggered((coin_id, currency), price))
+    if not fired:
+        return
+    
+    batch = []
+    deliveries = []
+    for user_id, alert_id, price in fired:
+        alert = next((a for a in price_alerts.get(user_id, []) if a.get('alert_id') == alert_id), None)
+        if alert is None:
+            continue
+        currency = alert.get('currency', 'usd')
+        batch.append((user_id, alert))
+        deliveries.append(send_message_limited(
+            bot,
+            user_id,
+            f"🚨 **Price Alert!**\n\n"
+            f"💰 **{price_alert_coin_label(alert['coin'])}** is now {alert['direction']} "
+            f"{format_coin_price(alert['target'], currency)}\n"
+            f"💵 **Current Price:** {format_coin_price(price, currency)}\n\n"
+            f"💡 Use `/pricealert` to set another alert",
+            parse_mode='Markdown',
+            disable_notification=False
+        ))
+    results = await asyncio.gather(*deliveries, return_exceptions=True)
+    
+    # Alerts fire once, so they are only dropped after a successful send (or when the
+    # user blocked the bot); others go back into the index and fire on a later check
+    delivered = 0
+    changed = set()
+    for (user_id, alert), result in zip(batch, results):
+        user_alerts = price_alerts.get(user_id, [])
+        if not any(a is alert for a in user_alerts):
+            continue  # deleted while the message was being sent
+        if isinstance(result, Exception):
+            logger.error(f"Error sending price alert to user {user_id}: {result}")
+            error = str(result).lower()
+            if "chat not found" not in error and "blocked" not in error:
+                price_alert_index.add(user_id, alert)
+                continue
+        else:
+            delivered += 1
+        user_alerts.remove(alert)
+        if not user_alerts:
+            del price_alerts[user_id]
+        changed.add(user_id)
+    for user_id in changed:
+        save_user_price_alerts(user_id)
+    logger.info(f"Delivered {delivered} of {len(batch)} price alerts")
+
+async def price_alert_poller_loop(bot):
+    """Background task that checks all price alerts every PRICE_ALERT_INTERVAL seconds."""
+    global price_alert_wakeup
+    price_alert_wakeup = asyncio.Event()
+    while True:
+        try:
+            if not price_alert_index.entries:
+                # Nothing to watch - sleep until an alert is added
+                price_alert_wakeup.clear()
+                await price_alert_wakeup.wait()
+            await check_price_alerts(bot)
+            await asyncio.sleep(PRICE_ALERT_INTERVAL)
+        except Exception as e:
+            logger.error(f"Error in price alert poller: {e}")
+            await asyncio.sleep(PRICE_ALERT_INTERVAL)
+
+async def pricealert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Set an alert for when a coin's price goes above or below a value."""
+    user_id = update.message.from_user.id
+    
+    if not context.args or len(context.args) < 3:
+        await update.message.reply_text(
+            "🚨 **Crypto Price Alerts**\n\n"
+            "**Usage:**\n"
+            "• `/pricealert <coin> <above|below> <value> [currency]`\n\n"
+            "**Examples:**\n"
+            "• `/pricealert btc above 70000`\n"
+            "• `/pricealert eth below 2500`\n"
+            "• `/pricealert sol above 15000 inr`\n\n"
+            f"Prices are checked every {PRICE_ALERT_INTERVAL} seconds; each alert fires once.\n\n"
+            "**Other Commands:**\n"
+            "• `/pricealerts` - List your price alerts\n"
+            "• `/delpricealert <id>` - Delete a price alert",
+            parse_mode='Markdown'
+        )
+        return
+    
+    coin_input = context.args[0].lower()
+    direction = {'above': 'above', '>': 'above', 'below': 'below', '<': 'below'}.get(context.args[1].lower())
+    try:
+        target = float(context.args[2].replace(',', '').lstrip('$'))
+    except ValueError:
+        target = None
+    currency = context.args[3].lower() if len(context.args) >= 4 else 'usd'
+    if currency == 'in':
+        currency = 'inr'
+    
+    if direction is None or target is None or not math.isfinite(target) or target <= 0 or currency not in CRYPTO_CURRENCIES:
+        await update.message.reply_text(
+            "❌ **Invalid alert!**\n\n"
+            "**Usage:** `/pricealert <coin> <above|below> <value> [currency]`\n"
+            "**Example:** `/pricealert btc above 70000`",
+            parse_mode='Markdown'
+        )
+        return
+    
+    if len(price_alerts.get(user_id, [])) >= PRICE_ALERTS_PER_USER:
+        await update.message.reply_text(
+            f"❌ You already have {PRICE_ALERTS_PER_USER} price alerts.\n"
+            "Delete one with `/delpricealert <id>` first.",
+            parse_mode='Markdown'
+        )
+        return
+    
+    # Validate the coin and make sure the alert would not fire straight away
+    coin_id = resolve_coin_id(coin_input)
+    try:
+        coin_quote = (await crypto_prices.get_quotes([coin_id], currency)).get(coin_id)
+    except Exception as e:
+        await update.message.reply_text(f"❌ Could not check the current price: {str(e)}\n\nPlease try again.")
+        return
+    if coin_quote is None:
+        await update.message.reply_text(
+            f"❌ Coin Not Found\n\nCould not find '{coin_input}'.\n"
+            "💡 Use coin symbol (btc, eth) or full name (bitcoin, ethereum)"
+        )
+        return
+    current_price = coin_quote.get(currency, 0)
+    if (direction == 'above' and current_price >= target) or (direction == 'below' and current_price <= target):
+        await update.message.reply_text(
+            f"ℹ️ {coin_input.upper()} is already {direction} {format_coin_price(target, currency)} "
+            f"(now {format_coin_price(current_price, currency)})."
+        )
+        return
+    
+    alert_id = f"{user_id}_{datetime.now().timestamp()}"
+    alert = {
+        'alert_id': alert_id,
+        'coin': coin_input,
+        'coin_id': coin_id,
+        'direction': direction,
+        'target': target,
+        'currency': currency,
+        'created_at': datetime.now().isoformat()
+    }
+    price_alerts.setdefault(user_id, []).append(alert)
+    save_user_price_alerts(user_id)
+    price_alert_index.add(user_id, alert)
+    if price_alert_wakeup is not None:
+        price_alert_wakeup.set()
+    
+    await update.message.reply_text(
+        f"✅ **Price Alert Set!**\n\n"
+        f"💰 **Coin:** {price_alert_coin_label(coin_input)}\n"
+        f"🎯 **When:** {direction} {format_coin_price(target, currency)}\n"
+        f"💵 **Now:** {format_coin_price(current_price, currency)}\n"
+        f"🆔 **Alert ID:** `{alert_id}`\n\n"
+        f"💡 Use `/pricealerts` to see all your alerts\n"
+        f"🗑️ Use `/delpricealert {alert_id}` to delete",
+        parse_mode='Markdown'
+    )
+
+async def pricealerts_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List the user's crypto price alerts."""
+    user_id = update.message.from_user.id
+    user_alerts = price_alerts.get(user_id, [])
+    
+    if not user_alerts:
+        await update.message.reply_text(
+            "📭 **No Price Alerts Set**\n\n"
+            "**Set one:**\n"
+            "`/pricealert <coin> <above|below> <value> [currency]`\n\n"
+            "**Example:**\n"
+            "`/pricealert btc above 70000`",
+            parse_mode='Markdown'
+        )
+        return
+    
+    text = f"🚨 **Your Price Alerts ({len(user_alerts)})**\n\n"
+    for idx, alert in enumerate(user_alerts, 1):
+        currency = alert.get('currency', 'usd')
+        text += f"**{idx}.** 💰 {price_alert_coin_label(alert.get('coin', ''))} {alert.get('direction')} {format_coin_price(alert.get('target', 0), currency)}\n"
+        text += f"   🆔 `{alert.get('alert_id', '')}`\n\n"
+    text += "**Commands:**\n"
+    text += "• `/delpricealert <id>` - Delete a price alert\n"
+    text += "• `/pricealert <coin> <above|below> <value>` - Set new alert"
+    
+    await update.message.reply_text(text, parse_mode='Markdown')
+
+async def delpricealert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Delete a crypto price alert by ID."""
+    user_id = update.message.from_user.id
+    
+    if not context.args:
+        await update.message.reply_text(
+            "🗑️ **Delete Price Alert**\n\n"
+            "**Usage:** `/delpricealert <alert_id>`\n\n"
+            "Use `/pricealerts` to see your alerts with IDs.",
+            parse_mode='Markdown'
+        )
+        return
+    
+    alert_id = context.args[0]
+    user_alerts = price_alerts.get(user_id, [])
+    remaining = [a for a in user_alerts if a.get('alert_id') != alert_id]
+    
+    if len(remaining) == len(user_alerts):
+        await update.message.reply_text(
+            f"❌ **Price Alert Not Found!**\n\n"
+            f"Alert ID `{alert_id}` doesn't exist.\n\n"
+            f"Use `/pricealerts` to see your alerts.",
+            parse_mode='Markdown'
+        )
+        return
+    
+    if remaining:
+        price_alerts[user_id] = remaining
+    else:
+        del price_alerts[user_id]
+    save_user_price_alerts(user_id)
+    price_alert_index.remove(alert_id)
+    await update.message.reply_text(
+        f"✅ **Price Alert Deleted!**\n\n"
+        f"Alert ID: `{alert_id}`",
+        parse_mode='Markdown'
+    )
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle errors gracefully."""
     try:
@@ -13814,22 +16083,52 @@ def main():
         else:
             logger.info("Pillow is available and ready to use!")
         
-        application = Application.builder().token(BOT_TOKEN).build()
+        async def post_init(app: Application):
+            """Start background tasks once the bot is initialized."""
+            schedule_all_alarms()
+            logger.info("Starting alarm scheduler...")
+            start_background_task(alarm_scheduler_loop(app.bot))
+            index_all_price_alerts()
+            start_background_task(price_alert_poller_loop(app.bot))
+            resume_broadcast(app.bot)
+            start_admin_contacts_refresh(app.bot)
+        
+        async def post_shutdown(app: Application):
+            """Close the shared HTTP connection pools."""
+            await close_http_clients()
+        
+        application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+            .build()
+        )
         
         # Register error handler first to catch all errors
         application.add_error_handler(error_handler)
         
+        # Block check and activity tracking run once per update, before any other handler
+        application.add_handler(TypeHandler(Update, activity_middleware), group=-1)
+        
         # Register handlers
         application.add_handler(CommandHandler("start", start))
         application.add_handler(CallbackQueryHandler(check_join_callback, pattern="^check_join$"))
+        # Channel join/leave events (needs the bot to be an admin of REQUIRED_CHANNEL)
+        application.add_handler(ChatMemberHandler(channel_member_update, ChatMemberHandler.CHAT_MEMBER))
         application.add_handler(CallbackQueryHandler(admin_callback_handler, pattern="^admin_"))
         application.add_handler(CommandHandler("help", help_command))
+        application.add_handler(CommandHandler("cancel", cancel_command))
         
         # Admin panel handlers
         application.add_handler(CommandHandler("admin", admin_command))
         application.add_handler(CommandHandler("admin_stats", admin_stats_command))
         application.add_handler(CommandHandler("admin_users", admin_users_command))
         application.add_handler(CommandHandler("admin_broadcast", admin_broadcast_command))
+        application.add_handler(CommandHandler("admin_prune", admin_prune_command))
+        application.add_handler(CommandHandler("admin_load", admin_load_command))
+        application.add_handler(CommandHandler("admin_health", admin_health_command))
         application.add_handler(CommandHandler("admin_referrals", admin_referrals_command))
         application.add_handler(CommandHandler("admin_add", admin_add_command))
         application.add_handler(CommandHandler("admin_remove", admin_remove_command))
@@ -13921,6 +16220,9 @@ def main():
         application.add_handler(CommandHandler("cryptoprice", crypto_command))  # Alias
         application.add_handler(CommandHandler("coin", crypto_command))  # Alias
         application.add_handler(CommandHandler("price", crypto_command))  # Alias
+        application.add_handler(CommandHandler("pricealert", pricealert_command))
+        application.add_handler(CommandHandler("pricealerts", pricealerts_command))
+        application.add_handler(CommandHandler("delpricealert", delpricealert_command))
         application.add_handler(CommandHandler("audiototext", audio_to_text_command))
         application.add_handler(CommandHandler("speech", audio_to_text_command))  # Alias
         application.add_handler(CommandHandler("voice", audio_to_text_command))  # Alias
@@ -13990,33 +16292,51 @@ def main():
         application.add_handler(MessageHandler(filters.VIDEO | filters.Document.ALL, mp4tomp3_command))
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_to_speech))
         
+        # Commands whose handlers run as heavy jobs skip per-user ordering
+        heavy_commands.update(
+            command
+            for handler in application.handlers[0]
+            if isinstance(handler, CommandHandler) and getattr(handler.callback, 'heavy', False)
+            for command in handler.commands
+        )
+        
         # Start the bot
         logger.info("Bot is starting...")
         
-        # Start background alarm checking task
-        # Use a one-time handler to start the alarm task when bot receives first update
-        alarm_task_started = False
-        
-        async def start_alarm_on_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
-            """Start alarm task when bot receives first update."""
-            nonlocal alarm_task_started
-            if not alarm_task_started:
-                alarm_task_started = True
-                logger.info("Starting alarm checking task...")
-                asyncio.create_task(check_alarms_loop(context.bot))
-                # Return None to allow other handlers to process the update
-                return
+        # Worker processes are forked first, while no other thread is running
+        start_executors()
+        media_cache.load_index()
         
-        # Add temporary handler for first update (will run on first message/update)
-        first_update_handler = MessageHandler(filters.ALL, start_alarm_on_first_update)
-        application.add_handler(first_update_handler, group=-1)  # Add with high priority
+        # Flush dirty stores in the background; pending writes are flushed again on exit
+        persistence.start()
+        activity_journal.start()
         
         try:
-            application.run_polling(
-                allowed_updates=Update.ALL_TYPES, 
-                drop_pending_updates=True,
-                close_loop=False
-            )
+            if BOT_MODE == "webhook":
+                if not WEBHOOK_URL:
+                    logger.error("❌ BOT_MODE=webhook needs WEBHOOK_URL (or RENDER_EXTERNAL_URL / RAILWAY_PUBLIC_DOMAIN)")
+                    import sys
+                    sys.exit(1)
+                logger.info(f"Serving webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH} for {WEBHOOK_URL}")
+                application.run_webhook(
+                    listen=WEBHOOK_LISTEN,
+                    port=WEBHOOK_PORT,
+                    url_path=WEBHOOK_PATH,
+                    webhook_url=f"{WEBHOOK_URL}/{WEBHOOK_PATH}",
+                    secret_token=WEBHOOK_SECRET,
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=True,
+                    close_loop=False
+                )
+            else:
+                application.run_polling(
+                    allowed_updates=Update.ALL_TYPES, 
+                    drop_pending_updates=True,
+                    close_loop=False
+                )
+            shutdown_executors()
+            activity_journal.stop()
+            persistence.stop()
         except Conflict as conflict_error:
             # Handle Conflict error specifically
             error_str = str(conflict_error)